@@ -1,32 +1,65 @@
 # Standard library imports
 import os
+import hmac
 import json
 from datetime import datetime, time, timedelta
-from collections import defaultdict
 
 # Third-party imports
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import (
+    Flask, Response, render_template, stream_template, request, redirect, url_for, flash,
+    get_flashed_messages, session, jsonify, make_response
+)
 from dotenv import load_dotenv
 from loguru import logger
+import pytz
 
 # Local application imports
 from calendar_time_tracker import (
-    get_calendar_timezone, 
-    get_events, 
-    calculate_weekly_summary
+    fetch_calendar_timezone, 
+    get_events_until_deadline, 
+    last_complete_week_end,
+    fetch_calendar_snapshot,
+    parse_events,
+    summarize_days,
+    summarize_weeks,
+    extend_event_index
 )
+from event_index_utils import EventIndex, get_event_index, store_event_index, drop_event_indexes
+from rollup_utils import load_rollup_days, pending_range, save_rollups, delete_rollups, ROLLUP_TTL
 
 from calendar_utils import format_timedelta
+from export_utils import iter_export_rows, stream_csv, stream_xlsx, CSV_MIMETYPE, XLSX_MIMETYPE
+from metrics_utils import record_cache, record_events, stage_timer, timed_stream, render_metrics
+from report_utils import (
+    build_period_summary, build_config_summary, iter_week_rows, buffered_stream,
+    save_report, get_report, get_report_page, delete_reports, REPORT_PAGE_SIZE
+)
 
 from auth_utils import (
     authenticate_google_calendar,
     get_authorization_url,
     complete_oauth_flow,
-    credentials_to_dict
+    credentials_to_dict,
+    get_user_key
+)
+
+from resilience_utils import (
+    calendar_breaker, new_request_deadline, remember_events, recall_events, forget_events
 )
+from background_utils import submit_job, get_job, delete_job, delete_jobs, JOB_DONE
+
+from logging_utils import configure_logging
+from session_utils import init_session
+from asset_utils import init_assets
+from template_utils import init_template_cache
+from compression_utils import CompressionMiddleware
+from profiling_utils import profiled, init_profiling
+from memory_utils import init_memory_tracing
+from cache_utils import cache_policy, init_cache_policy, templates_last_modified, POLICY_REVALIDATE, POLICY_NO_STORE
 
 from config_utils import (
     clean_env_value,
+    get_env_value,
     get_default_config,
     validate_config
 )
@@ -34,6 +67,9 @@ from config_utils import (
 # Cargar variables de entorno
 load_dotenv()
 
+# Configuración de logs (antes de inicializar el resto de componentes, que ya registran mensajes)
+configure_logging()
+
 # Configuración de la aplicación
 app = Flask(__name__)
 app.config['SECRET_KEY'] = clean_env_value(os.getenv('SECRET_KEY', 'clave_por_defecto_no_usar_en_produccion'))
@@ -48,6 +84,11 @@ app.config['PERMANENT_SESSION_LIFETIME'] = int(session_lifetime)
 app.config['SESSION_USE_SIGNER'] = True  # Firmar cookies de sesión
 app.config['SESSION_FILE_THRESHOLD'] = 500  # Límite de archivos en filesystem storage
 app.config['SESSION_PERMANENT'] = False  # Por defecto sesiones no permanentes
+app.config['SESSION_FILE_DIR'] = clean_env_value(os.getenv('SESSION_FILE_DIR', 'cache/sessions'))
+app.config['SESSION_SQLITE_PATH'] = clean_env_value(os.getenv('SESSION_SQLITE_PATH', 'cache/sessions.sqlite3'))
+app.config['SESSION_REDIS_URL'] = clean_env_value(os.getenv('SESSION_REDIS_URL', ''))
+# Renovar la caducidad de la sesión en cada petición (cuenta desde el último acceso)
+app.config['SESSION_REFRESH_EACH_REQUEST'] = get_env_value('SESSION_REFRESH_EACH_REQUEST', True, bool)
 
 # Configuración para forzar que las cookies sean enviadas solo en conexiones seguras en producción
 env = clean_env_value(os.getenv('FLASK_ENV', 'production'))
@@ -58,45 +99,34 @@ if env != 'development':
     app.config['REMEMBER_COOKIE_SECURE'] = True
     app.config['REMEMBER_COOKIE_HTTPONLY'] = True
 
-# Deshabilitar caché globalmente si está configurado
-disable_cache = os.getenv('DISABLE_CACHE', 'false').lower() in ('true', 'yes', '1')
-if disable_cache:
-    # No cachear recursos estáticos
-    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-    
-    @app.after_request
-    def add_no_cache_headers(response):
-        """Añadir encabezados para prevenir caché en todas las respuestas"""
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        # Añadir timestamp para forzar refrescos
-        response.headers['X-Timestamp'] = str(datetime.now().timestamp())
-        return response
-
-# Configuración de logs
-log_level = os.getenv('LOG_LEVEL', 'INFO')
-if log_level and ' ' in log_level:  # Eliminar posibles comentarios
-    log_level = log_level.split(' ')[0]
-log_format = os.getenv('LOG_FORMAT', '{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}')
-if log_format and ' ' in log_format:  # Eliminar posibles comentarios
-    log_format = log_format.split('#')[0].strip()
-log_path = os.getenv('LOG_PATH', 'logs/')
-if log_path and ' ' in log_path:  # Eliminar posibles comentarios
-    log_path = log_path.split(' ')[0]
-
-# Asegurar que existe el directorio de logs
-os.makedirs(log_path, exist_ok=True)
-
-# Configurar Loguru
-logger.remove()  # Remover el handler por defecto
-logger.add(f"{log_path}/app.log", 
-           level=log_level, 
-           format=log_format, 
-           rotation="10 MB", 
-           retention="1 month")
-# Agregar handler para mostrar todos los logs en la consola
-logger.add(lambda msg: print(msg), level=log_level, format=log_format)
+# Guardar la sesión en el servidor: la cookie solo lleva un identificador opaco
+init_session(app)
+
+# Recursos estáticos versionados (ver build_assets.py)
+init_assets(app)
+
+# Código compilado de las plantillas compartido en disco entre workers (TEMPLATE_BYTECODE_CACHE)
+init_template_cache(app)
+
+# Perfilado bajo demanda de /calculate y descarga de perfiles (PROFILING_ENABLED)
+init_profiling(app)
+
+# Memoria asignada por etapa con tracemalloc y /debug/memory (MEMORY_TRACING)
+init_memory_tracing(app)
+
+# Política de caché: las rutas la declaran con @cache_policy; con DISABLE_CACHE
+# las respuestas sin política explícita no se almacenan
+disable_cache = get_env_value('DISABLE_CACHE', False, bool)
+init_cache_policy(app, default_no_store=disable_cache)
+page_last_modified = templates_last_modified(app)
+
+# Compresión gzip/brotli de HTML y JSON (también de respuestas en streaming)
+if get_env_value('COMPRESSION_ENABLED', True, bool):
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=get_env_value('COMPRESSION_MIN_SIZE', 500, int),
+        level=get_env_value('COMPRESSION_LEVEL', 6, int)
+    )
 
 # Definir horario predeterminado (para usar time explícitamente)
 DEFAULT_WORK_START = time(9, 0)  # 9:00 AM
@@ -113,19 +143,25 @@ def index():
     return redirect(url_for('dashboard'))
 
 @app.route('/dashboard')
+@cache_policy(POLICY_REVALIDATE, last_modified=page_last_modified)
 def dashboard():
     return render_template('dashboard.html')
 
 @app.route('/config')
+@cache_policy(POLICY_REVALIDATE, last_modified=page_last_modified)
 def config():
     return render_template('config.html')
 
 @app.route('/privacy-policy')
+@cache_policy(POLICY_REVALIDATE, last_modified=page_last_modified)
 def privacy_policy():
     """Mostrar la política de privacidad y uso de cookies"""
-    return render_template('privacy_policy.html')
+    # Días (redondeados hacia arriba) que se conservan las semanas consolidadas
+    retention_days = (ROLLUP_TTL + 86399) // 86400 if ROLLUP_TTL > 0 else None
+    return render_template('privacy_policy.html', rollup_retention_days=retention_days)
 
 @app.route('/auth')
+@cache_policy(POLICY_NO_STORE)
 def auth():
     """Mostrar página de autenticación con Google"""
     # Guardar la URL a la que redirigir después de la autenticación
@@ -133,12 +169,14 @@ def auth():
     session['next_url'] = next_url
     
     # Obtener URL de autorización
-    auth_url = get_authorization_url()
+    auth_url, code_verifier = get_authorization_url()
+    session['oauth_code_verifier'] = code_verifier
     
     logger.info("Mostrando página de autenticación con Google")
     return render_template('auth.html', auth_url=auth_url)
 
 @app.route('/auth/google')
+@cache_policy(POLICY_NO_STORE)
 def auth_google():
     """Iniciar el flujo de autenticación con Google"""
     # Guardar la URL a la que redirigir después de la autenticación
@@ -146,7 +184,8 @@ def auth_google():
     session['next_url'] = next_url
     
     # Obtener URL de autorización
-    auth_url = get_authorization_url()
+    auth_url, code_verifier = get_authorization_url()
+    session['oauth_code_verifier'] = code_verifier
     if not auth_url:
         flash('Error al generar URL de autorización. Verifique la configuración.', 'error')
         logger.error("Error al generar URL de autorización de Google")
@@ -156,6 +195,7 @@ def auth_google():
     return redirect(auth_url)
 
 @app.route('/oauth2callback')
+@cache_policy(POLICY_NO_STORE)
 def oauth2callback():
     """Manejar la respuesta de Google OAuth"""
     error = request.args.get('error', '')
@@ -171,12 +211,16 @@ def oauth2callback():
         return redirect(url_for('dashboard'))
     
     # Completar el flujo de OAuth con el código recibido
-    credentials = complete_oauth_flow(code)
+    credentials = complete_oauth_flow(code, session.pop('oauth_code_verifier', None))
     if not credentials:
         flash('Error al procesar código de autorización', 'error')
         logger.error("Error al completar flujo OAuth")
         return redirect(url_for('dashboard'))
     
+    # Nuevo identificador de sesión tras autenticarse (evita fijación de sesión)
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+    
     # Guardar las credenciales en la sesión del usuario
     session['credentials'] = credentials_to_dict(credentials)
     session.modified = True
@@ -189,10 +233,21 @@ def oauth2callback():
     return redirect(next_url)
 
 @app.route('/logout')
+@cache_policy(POLICY_NO_STORE)
 def logout():
     """Cerrar sesión y eliminar credenciales"""
+    user_key = get_user_key(session.get('credentials'))
+    
     # Limpiar toda la sesión completamente
     session.clear()
+    # Tampoco se conservan los datos calculados del usuario: semanas consolidadas,
+    # informes, trabajos en segundo plano y eventos en memoria de este worker
+    # (en los demás caducan con su TTL)
+    delete_rollups(user_key)
+    delete_reports(user_key)
+    delete_jobs(user_key)
+    drop_event_indexes(user_key)
+    forget_events(user_key)
     flash('Sesión cerrada. Se ha desconectado de Google Calendar', 'success')
     
     # Log detallado
@@ -201,7 +256,75 @@ def logout():
     # Redirigir al dashboard con un parámetro para forzar recarga limpia
     return redirect(url_for('dashboard', _fresh=datetime.now().timestamp()))
 
+def _fetch_from_google(credentials, user_key, config, cached_index, fetch_start, fetch_end):
+    """
+    Obtener de Google los eventos del rango, o solo los días que faltan en el índice del usuario
+    
+    Cualquier fallo de Google (conexión o renovación del token, zona horaria o
+    eventos) cuenta para el circuit breaker.
+    
+    Returns:
+        Tuple (zona horaria, eventos, completo_hasta, índice, zona_local), con
+        eventos e índice None si Google no respondió y zona_local True si Google
+        no devolvió la zona horaria (se usa la local o UTC), o None si se
+        requiere autorización
+    """
+    try:
+        service, updated_credentials = authenticate_google_calendar(credentials)
+    except Exception as e:
+        logger.error(f"Error al conectar con Google Calendar: {e}")
+        calendar_breaker.record_failure()
+        return None, None, None, None, False
+    
+    # Si hay credenciales actualizadas, guardarlas en la sesión
+    if updated_credentials:
+        session['credentials'] = updated_credentials
+        session.modified = True
+    
+    if not service:
+        return None
+    
+    # Plazo máximo de la petición, repartido entre las llamadas a Google
+    deadline = new_request_deadline()
+    timezone, from_google = fetch_calendar_timezone(service, deadline)
+    if timezone is None:
+        calendar_breaker.record_failure()
+        return None, None, None, None, False
+    if not from_google:
+        logger.warning(f"Zona horaria de Google no disponible, se usa {timezone.zone} sin consolidar semanas")
+    
+    # Rango desplazado: obtener solo los días que faltan en el índice
+    if cached_index is not None:
+        index = extend_event_index(service, cached_index, fetch_start, fetch_end, timezone, config, deadline)
+        record_cache('event_index', index is not None)
+        if index is not None:
+            calendar_breaker.record_success()
+            store_event_index(user_key, config, index)
+            logger.info(f"Índice de eventos ampliado al rango {index.start_date} - {index.end_date}")
+            return timezone, None, None, index, not from_google
+    
+    with stage_timer('events'):
+        result = get_events_until_deadline(service, fetch_start, fetch_end, timezone, deadline)
+    
+    if result is None:
+        calendar_breaker.record_failure()
+        return timezone, None, None, None, not from_google
+    
+    calendar_breaker.record_success()
+    events, complete_until = result
+    if complete_until is not None:
+        logger.warning(f"Plazo agotado: eventos completos hasta {complete_until} para el rango {fetch_start} - {fetch_end}")
+    elif from_google:
+        remember_events(user_key, timezone.zone, events, fetch_start, fetch_end)
+    return timezone, events, complete_until, None, not from_google
+
+def _timezone_changed(timezone, timezone_fallback, expected_timezone):
+    """Indicar si Google devolvió una zona horaria distinta de la de los días consolidados"""
+    return timezone is not None and not timezone_fallback and timezone.zone != expected_timezone
+
 @app.route('/calculate', methods=['POST'])
+@cache_policy(POLICY_NO_STORE)
+@profiled(lambda: get_user_key(session.get('credentials')))
 def calculate():
     try:
         # Obtener datos de fechas del formulario
@@ -219,28 +342,24 @@ def calculate():
         
         # Obtener credenciales de la sesión
         credentials = session.get('credentials')
-        
-        # Autenticar con Google Calendar
-        service, updated_credentials = authenticate_google_calendar(credentials)
-        
-        # Si hay credenciales actualizadas, guardarlas en la sesión
-        if updated_credentials:
-            session['credentials'] = updated_credentials
-            session.modified = True
-        
-        if not service:
+        if not credentials:
             logger.warning("Redirección a autenticación - usuario sin credenciales")
             flash('Se requiere autenticación. Por favor inténtelo nuevamente después de iniciar sesión.', 'info')
             return redirect(url_for('auth', next=url_for('dashboard')))
         
-        timezone = get_calendar_timezone(service)
-        events = get_events(service, start_date, end_date, timezone)
+        user_key = get_user_key(credentials)
+        # "Actualizar" en los resultados: volver a pedir los eventos a Google
+        refresh = request.form.get('refresh') == '1'
+        # Última zona horaria devuelta por Google: solo se usan días consolidados con ella
+        expected_timezone = session.get('calendar_timezone')
+        timezone = None
+        timezone_fallback = False
+        stale_since = None
+        index_since = None
+        complete_until = None
+        events = None
+        index = None
         
-        if events is None:
-            flash('Error al obtener eventos del calendario', 'error')
-            logger.error(f"Error al obtener eventos para el rango {start_date} - {end_date}")
-            return redirect(url_for('dashboard'))
-            
         # Procesar la configuración recibida
         try:
             config = json.loads(config_data) if isinstance(config_data, str) else config_data
@@ -255,129 +374,239 @@ def calculate():
             logger.error(f"Error al procesar configuración: {e}")
             config = get_default_config()
         
-        # Calcular resumen semanal
-        weekly_summary = calculate_weekly_summary(
-            events, start_date, end_date, timezone,
-            datetime.strptime(config['work_start_time'], '%H:%M').time(),
-            datetime.strptime(config['work_end_time'], '%H:%M').time(),
-            [0, 1, 2, 3, 4],  # Lunes a Viernes
-            config  # Pasar la configuración completa para usar color_tags y servicios
-        )
+        # Semanas pasadas ya consolidadas: solo hay que obtener y clasificar los días restantes
+        rollup_days = {} if refresh else load_rollup_days(user_key, config, expected_timezone, start_date, end_date)
+        pending = pending_range(start_date, end_date, rollup_days)
+        fetch_start, fetch_end = pending or (start_date, end_date)
         
-        # Procesar resultados para enviar a la plantilla
-        processed_summary = []
-        period_totals = defaultdict(timedelta)
-        grand_total_time = timedelta()
+        # Índice reciente de los eventos del usuario (rango anterior con la misma configuración)
+        cached_index = None if refresh else get_event_index(user_key, config)
         
-        # Procesar resumen semanal - CORREGIDO para manejar el formato correcto
-        sorted_weeks = sorted(weekly_summary.keys())
-        for week_key in sorted_weeks:
-            week_services = weekly_summary[week_key]
-            week_total = timedelta()
-            
-            # Crear descripción de la semana
-            week_end = week_key + timedelta(days=6)
-            week_description = f"{week_key.strftime('%d/%m/%Y')} - {week_end.strftime('%d/%m/%Y')}"
+        # Eventos ya obtenidos por un trabajo en segundo plano ("continuar en segundo plano")
+        job_id = request.form.get('job_id')
+        job = get_job(job_id, user_key) if job_id else None
+        if pending is None:
+            record_cache('rollups', True)
+            logger.info(f"Todas las semanas del rango {start_date} - {end_date} están consolidadas")
+        elif job and job['status'] == JOB_DONE and job['result']['range'] == [start_date.isoformat(), end_date.isoformat()]:
+            timezone = pytz.timezone(job['result']['timezone'])
+            timezone_fallback = job['result'].get('timezone_fallback', False)
+            events = job['result']['events']
+            # El resultado guarda los eventos del usuario: no se conserva una vez usado
+            delete_job(job_id, user_key)
+            if rollup_days and _timezone_changed(timezone, timezone_fallback, expected_timezone):
+                # Los eventos del trabajo cubren el rango entero
+                logger.warning(f"Zona horaria cambiada ({expected_timezone} -> {timezone.zone}), se recalcula todo el rango")
+                rollup_days = {}
+                fetch_start, fetch_end = start_date, end_date
+            if not timezone_fallback:
+                remember_events(user_key, timezone.zone, events, start_date, end_date)
+                session['calendar_timezone'] = timezone.zone
+            record_cache('background_job', True)
+            logger.info(f"Usando eventos del trabajo en segundo plano {job_id}")
+        elif cached_index is not None and cached_index.covers(fetch_start, fetch_end):
+            # Rango acotado dentro del ya obtenido: basta con consultar el índice
+            index = cached_index
+            index_since = datetime.fromtimestamp(index.fetched_at)
+            timezone = pytz.timezone(index.timezone)
+            record_cache('event_index', True)
+            logger.info(f"Usando el índice de eventos del rango {index.start_date} - {index.end_date}")
+        elif calendar_breaker.allow_request():
+            fetched = _fetch_from_google(credentials, user_key, config, cached_index, fetch_start, fetch_end)
+            if fetched is not None and rollup_days and _timezone_changed(fetched[0], fetched[4], expected_timezone):
+                # Los días consolidados se calcularon con la zona anterior: obtener el rango entero
+                logger.warning(f"Zona horaria cambiada ({expected_timezone} -> {fetched[0].zone}), se recalcula todo el rango")
+                rollup_days = {}
+                fetch_start, fetch_end = start_date, end_date
+                fetched = _fetch_from_google(credentials, user_key, config, None, fetch_start, fetch_end)
+            if fetched is None:
+                logger.warning("Redirección a autenticación - usuario sin credenciales")
+                flash('Se requiere autenticación. Por favor inténtelo nuevamente después de iniciar sesión.', 'info')
+                return redirect(url_for('auth', next=url_for('dashboard')))
+            timezone, events, complete_until, index, timezone_fallback = fetched
+            if timezone is not None and not timezone_fallback:
+                session['calendar_timezone'] = timezone.zone
+            if index is not None:
+                index_since = datetime.fromtimestamp(index.fetched_at)
+        else:
+            logger.warning("Circuit breaker abierto, se omite la llamada a Google Calendar")
+        
+        # Si Google no respondió, usar los últimos datos conocidos del usuario
+        if pending is not None and events is None and index is None:
+            cached = recall_events(user_key, fetch_start, fetch_end)
+            record_cache('stale_events', cached is not None)
+            if cached is None:
+                flash('Error al obtener eventos del calendario', 'error')
+                logger.error(f"Error al obtener eventos para el rango {fetch_start} - {fetch_end}")
+                return redirect(url_for('dashboard'))
             
-            # Agregar los totales de servicios de esta semana a los totales del período
-            services_in_week = {}
-            for service, time_spent in week_services.items():
-                period_totals[service] += time_spent
-                grand_total_time += time_spent
-                week_total += time_spent
-                services_in_week[service] = {
-                    'time': time_spent,
-                    'formatted': format_timedelta(time_spent)
-                }
+            timezone_name, events, stored_at = cached
+            timezone = pytz.timezone(timezone_name)
+            stale_since = datetime.fromtimestamp(stored_at)
+            logger.warning(f"Sirviendo eventos en caché del {stale_since.isoformat()} para el rango {fetch_start} - {fetch_end}")
+        
+        # Indexar los eventos obtenidos; solo se reutilizan los de rangos completos y actuales
+        if pending is not None and index is None:
+            with stage_timer('parse'):
+                index = EventIndex(parse_events(events, timezone, config), fetch_start, fetch_end, timezone.zone)
+            if complete_until is None and stale_since is None and not timezone_fallback:
+                store_event_index(user_key, config, index)
             
-            # Crear estructura de días para mantener compatibilidad con la plantilla
-            # (La estructura actual no tiene desglose por días, solo por semana)
-            days = {}
+        # Si el plazo se agotó, calcular solo las semanas obtenidas por completo
+        summary_end_date = end_date
+        partial_until = None
+        if complete_until is not None:
+            summary_end_date = min(end_date, last_complete_week_end(complete_until))
+            partial_until = summary_end_date
+        
+        # Calcular resumen semanal: días consolidados más los días calculados ahora
+        weekly_summary = {}
+        if summary_end_date >= start_date:
+            with stage_timer('weekly_summary'):
+                daily_totals = dict(rollup_days)
+                if pending is not None and summary_end_date >= fetch_start:
+                    daily_totals.update(summarize_days(
+                        index, fetch_start, summary_end_date, timezone,
+                        datetime.strptime(config['work_start_time'], '%H:%M').time(),
+                        datetime.strptime(config['work_end_time'], '%H:%M').time(),
+                        [0, 1, 2, 3, 4],  # Lunes a Viernes
+                        config  # Pasar la configuración completa para usar color_tags y servicios
+                    ))
+                weekly_summary = summarize_weeks(daily_totals, start_date, summary_end_date, config)
             
-            processed_summary.append({
-                'week': week_key,
-                'week_description': week_description,
-                'days': days,
-                'services': services_in_week,
-                'week_total': week_total,
-                'week_total_formatted': format_timedelta(week_total)
-            })
+            # Consolidar las semanas pasadas calculadas ahora (no las de datos en caché
+            # ni las calculadas con la zona local porque Google no devolvió la suya)
+            if pending is not None and stale_since is None and not timezone_fallback:
+                save_rollups(user_key, config, timezone.zone, daily_totals, fetch_start, summary_end_date,
+                             today=datetime.now(timezone).date())
         
-        # Convertir los totales del período a formato legible
-        formatted_period_totals = {}
-        for service, time_spent in period_totals.items():
-            formatted_period_totals[service] = {
-                'time': time_spent,
-                'formatted': format_timedelta(time_spent)
-            }
+        if pending is not None:
+            record_events(len(events) if events is not None else len(index.overlapping(fetch_start, fetch_end + timedelta(days=1))))
         
         # Si no hay resultados, mostrar mensaje
-        if not processed_summary:
+        if not weekly_summary and partial_until is None:
             flash('No se encontraron datos para el período seleccionado', 'warning')
             return redirect(url_for('dashboard'))
         
-        # Preparar resumen de período para la plantilla
-        period_summary = []
-        for service, time_data in formatted_period_totals.items():
-            percentage = 0
-            if grand_total_time.total_seconds() > 0:
-                percentage = round((time_data['time'].total_seconds() / grand_total_time.total_seconds()) * 100, 1)
-            
-            period_summary.append({
-                'name': service,
-                'duration': time_data['formatted'],
-                'percentage': percentage
-            })
+        # El resumen del período va primero; las semanas se generan mientras se envía la página
+        period_summary, grand_total_time = build_period_summary(weekly_summary)
         
-        # Ordenar por porcentaje descendente
-        period_summary.sort(key=lambda x: x['percentage'], reverse=True)
+        # Solo la primera página de semanas va en el HTML; el resto se carga al desplazarse
+        report_id = save_report(user_key, weekly_summary, start_date, end_date) if weekly_summary else None
+        weeks_total = len(weekly_summary)
         
-        # Preparar resumen de semanas para la plantilla
-        weekly_summary = []
-        for week_data in processed_summary:
-            services_list = []
-            for service_name, service_data in week_data['services'].items():
-                services_list.append({
-                    'name': service_name,
-                    'duration': service_data['formatted'],
-                    'color': None  # Opcionalmente, se podría añadir color si está disponible en la configuración
-                })
-            
-            # Ordenar servicios por nombre
-            services_list.sort(key=lambda x: x['name'])
-            
-            weekly_summary.append({
-                'start_date': week_data['week'].strftime('%d/%m/%Y'),
-                'end_date': (week_data['week'] + timedelta(days=6)).strftime('%d/%m/%Y'),
-                'services': services_list,
-                'total_hours': week_data['week_total_formatted']
-            })
+        # La sesión se guarda antes de enviar el cuerpo: consumir ahora los mensajes flash
+        get_flashed_messages(with_categories=True)
         
-        # Preparar resumen de configuración
-        config_summary = {
-            'work_time': f"{config['work_start_time']} - {config['work_end_time']}",
-            'lunch': f"{config['lunch_duration_minutes']} min",
-            'default_service': config['default_service'],
-            'use_color_tags': config['use_color_tags']
-        }
-        
-        # Si hay resultados, mostrar la tabla
-        return render_template(
+        return Response(timed_stream(buffered_stream(stream_template(
             'results.html',
-            weekly_summary=weekly_summary,
+            weekly_summary=iter_week_rows(weekly_summary, limit=REPORT_PAGE_SIZE),
+            report_id=report_id,
+            weeks_total=weeks_total,
+            next_offset=REPORT_PAGE_SIZE if weeks_total > REPORT_PAGE_SIZE else None,
             period_summary=period_summary,
             start_date=start_date.strftime('%d/%m/%Y'),
             end_date=end_date.strftime('%d/%m/%Y'),
             total_hours=format_timedelta(grand_total_time),
-            config_summary=config_summary
-        )
+            config_summary=build_config_summary(config),
+            stale_since=stale_since.strftime('%d/%m/%Y %H:%M') if stale_since else None,
+            index_since=index_since.strftime('%d/%m/%Y %H:%M') if index_since else None,
+            from_rollups=bool(rollup_days),
+            partial_until=partial_until.strftime('%d/%m/%Y') if partial_until else None,
+            request_range={'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()},
+            config_json=json.dumps(config)
+        )), 'render'), mimetype='text/html')
     except Exception as e:
         logger.error(f"Error inesperado: {e}")
         flash(f'Error al procesar la solicitud: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/calculate/continue', methods=['POST'])
+@cache_policy(POLICY_NO_STORE)
+def calculate_continue():
+    """Continuar en segundo plano la obtención de eventos de un cálculo parcial"""
+    credentials = session.get('credentials')
+    if not credentials:
+        return jsonify({'error': 'Se requiere autenticación'}), 401
+    
+    try:
+        start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Rango de fechas inválido'}), 400
+    
+    job_id = submit_job(get_user_key(credentials), fetch_calendar_snapshot, credentials, start_date, end_date)
+    logger.info(f"Trabajo en segundo plano {job_id} lanzado para el rango {start_date} - {end_date}")
+    return jsonify({'job_id': job_id})
+
+@app.route('/calculate/jobs/<job_id>')
+@cache_policy(POLICY_NO_STORE)
+def calculate_job_status(job_id):
+    """Consultar el estado de un trabajo en segundo plano"""
+    job = get_job(job_id, get_user_key(session.get('credentials')))
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'status': job['status'], 'error': job.get('error')})
+
+@app.route('/calculate/reports/<report_id>/weeks')
+@cache_policy(POLICY_NO_STORE)
+def report_weeks(report_id):
+    """Obtener una página de semanas de un informe ya calculado"""
+    report = get_report(report_id, get_user_key(session.get('credentials')))
+    if not report:
+        return jsonify({'error': 'Informe no encontrado o caducado'}), 404
+    
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', REPORT_PAGE_SIZE, type=int)
+    return jsonify(get_report_page(report, offset, limit))
+
+@app.route('/calculate/reports/<report_id>/export.<export_format>')
+@cache_policy(POLICY_NO_STORE)
+def export_report(report_id, export_format):
+    """Descargar un informe ya calculado en CSV o XLSX, generado en streaming"""
+    exporters = {
+        'csv': (stream_csv, CSV_MIMETYPE),
+        'xlsx': (stream_xlsx, XLSX_MIMETYPE)
+    }
+    if export_format not in exporters:
+        return jsonify({'error': 'Formato de exportación no soportado'}), 404
+    
+    report = get_report(report_id, get_user_key(session.get('credentials')))
+    if not report:
+        return jsonify({'error': 'Informe no encontrado o caducado'}), 404
+    
+    stream, mimetype = exporters[export_format]
+    start, end = report['range']
+    response = Response(stream(iter_export_rows(report)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="horas_{start}_{end}.{export_format}"'
+    return response
+
+def _metrics_access_allowed():
+    """
+    Comprobar si la petición puede leer /metrics
+    
+    Con METRICS_TOKEN se exige la cabecera "Authorization: Bearer <token>";
+    sin él solo se atienden las peticiones directas desde la propia máquina
+    (no las que llegan a través de un proxy).
+    """
+    token = get_env_value('METRICS_TOKEN', '')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied, f'Bearer {token}')
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+@app.route('/metrics')
+@cache_policy(POLICY_NO_STORE)
+def metrics():
+    """Métricas de rendimiento en formato Prometheus (agregadas entre workers si está configurado)"""
+    if not get_env_value('METRICS_ENABLED', True, bool) or not _metrics_access_allowed():
+        return jsonify({'error': 'Métricas deshabilitadas'}), 404
+    content, content_type = render_metrics()
+    return Response(content, content_type=content_type)
+
 # Ruta para depuración de sesión - solo habilitada en modo desarrollo
 @app.route('/debug/session')
+@cache_policy(POLICY_NO_STORE)
 def debug_session():
     """Mostrar el contenido de la sesión para depuración"""
     env = os.getenv('FLASK_ENV', 'production')
@@ -0,0 +1,98 @@
+"""
+Utilidades para servir los recursos estáticos versionados.
+Este módulo lee el manifest generado por build_assets.py, expone asset_url()
+en las plantillas y sirve static/dist/ con caché inmutable y variantes
+precomprimidas (.br/.gz) según Accept-Encoding.
+"""
+
+import os
+import json
+import mimetypes
+
+from flask import abort, request, send_file, url_for
+from loguru import logger
+from werkzeug.security import safe_join
+
+# Local imports
+from cache_utils import CACHE_CONTROL, POLICY_IMMUTABLE
+
+MANIFEST_NAME = 'manifest.json'
+
+# Los nombres llevan el hash del contenido: pueden cachearse indefinidamente
+IMMUTABLE_CACHE_CONTROL = CACHE_CONTROL[POLICY_IMMUTABLE]
+
+# Codificaciones precomprimidas, por orden de preferencia
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def load_manifest(dist_dir):
+    """
+    Leer el manifest de recursos versionados
+
+    Returns:
+        Diccionario nombre lógico -> nombre versionado (vacío si no se ha construido)
+    """
+    path = os.path.join(dist_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Error al leer el manifest de recursos {path}: {e}")
+        return {}
+
+
+def send_asset(dist_dir, filename):
+    """
+    Servir un recurso versionado, usando la variante precomprimida si el cliente la acepta
+
+    Returns:
+        Respuesta de Flask con Cache-Control inmutable
+    """
+    path = safe_join(dist_dir, filename)
+    if path is None or filename.endswith(('.br', '.gz')) or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in PRECOMPRESSED_ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            encoding, path = name, path + suffix
+            break
+
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # send_file usaría el nombre de la variante (.gz/.br)
+    response.headers.pop('Content-Disposition', None)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def init_assets(app):
+    """
+    Registrar asset_url() en las plantillas y la ruta de static/dist/
+
+    Sin manifest (entorno de desarrollo sin build) asset_url() devuelve la URL
+    normal de static, por lo que las plantillas funcionan igual.
+    """
+    dist_dir = os.path.join(app.static_folder, 'dist')
+    manifest = load_manifest(dist_dir)
+    if manifest:
+        logger.info(f"Usando {len(manifest)} recursos versionados de {dist_dir}")
+
+    def asset_url(filename):
+        hashed = manifest.get(filename)
+        if hashed:
+            return url_for('assets', filename=hashed)
+        return url_for('static', filename=filename)
+
+    def assets(filename):
+        return send_asset(dist_dir, filename)
+
+    # Bajo static_url_path para que la sesión no se cargue en estas peticiones
+    app.add_url_rule(f"{app.static_url_path}/dist/<path:filename>", 'assets', assets)
+    app.add_template_global(asset_url, 'asset_url')
+    app.extensions['asset_manifest'] = manifest
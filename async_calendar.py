@@ -0,0 +1,218 @@
+"""
+Cliente asíncrono (asyncio) para Google Calendar API.
+Este módulo permite solapar en un mismo proceso la obtención de eventos de
+muchos usuarios: renovación de token, zona horaria y paginación de eventos se
+hacen con httpx.AsyncClient y el cálculo del resumen reutiliza
+calculate_weekly_summary. Lo usa batch_summary.py --google.
+"""
+
+import asyncio
+import datetime
+
+import httpx
+import pytz
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value, validate_config
+from calendar_time_tracker import calculate_weekly_summary, fallback_timezone
+from auth_utils import DEFAULT_TOKEN_URI, TOKEN_REFRESH_MARGIN, get_api_base_url
+
+# Días laborables usados por /calculate (lunes a viernes)
+WORK_DAYS = [0, 1, 2, 3, 4]
+
+
+def create_async_client(timeout=None, max_connections=None):
+    """
+    Crear un cliente HTTP asíncrono con pool de conexiones keep-alive
+
+    Returns:
+        Objeto httpx.AsyncClient (debe cerrarse con aclose o usarse con async with)
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections or get_env_value('ASYNC_MAX_CONNECTIONS', 50, int),
+        max_keepalive_connections=get_env_value('HTTP_POOL_MAXSIZE', 10, int)
+    )
+    return httpx.AsyncClient(
+        timeout=timeout or get_env_value('GOOGLE_API_TIMEOUT', 10, float),
+        limits=limits
+    )
+
+
+class AsyncCalendarClient:
+    """
+    Cliente asíncrono de Google Calendar para las credenciales de un usuario.
+
+    El token se renueva automáticamente ante un 401 si hay refresh token; las
+    credenciales actualizadas quedan en `credentials` y `refreshed` pasa a True.
+    """
+
+    def __init__(self, credentials_dict, client, base_url=None):
+        self.credentials = dict(credentials_dict)
+        self.refreshed = False
+        self._client = client
+        self._base_url = (base_url or get_api_base_url()).rstrip('/')
+        self._refresh_lock = asyncio.Lock()
+
+    async def refresh_token(self):
+        """Renovar el access token con el refresh token"""
+        async with self._refresh_lock:
+            response = await self._client.post(
+                self.credentials.get('token_uri') or DEFAULT_TOKEN_URI,
+                data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': self.credentials['refresh_token'],
+                    'client_id': self.credentials.get('client_id'),
+                    'client_secret': self.credentials.get('client_secret')
+                }
+            )
+            response.raise_for_status()
+            data = response.json()
+            self.credentials['token'] = data['access_token']
+            if data.get('expires_in'):
+                expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=int(data['expires_in']))
+                self.credentials['expiry'] = expiry.replace(tzinfo=None).isoformat()
+            if data.get('refresh_token'):
+                self.credentials['refresh_token'] = data['refresh_token']
+            self.refreshed = True
+
+    async def ensure_fresh_token(self, margin=TOKEN_REFRESH_MARGIN):
+        """Renovar el token por adelantado si expira en menos de `margin` segundos"""
+        expiry = self.credentials.get('expiry')
+        if not expiry or not self.credentials.get('refresh_token'):
+            return
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if (datetime.datetime.fromisoformat(expiry) - now).total_seconds() < margin:
+            await self.refresh_token()
+
+    async def _get(self, path, params=None):
+        token = self.credentials.get('token')
+        response = await self._client.get(
+            f"{self._base_url}{path}",
+            params=params,
+            headers={'Authorization': f"Bearer {token}"}
+        )
+        if response.status_code == 401 and self.credentials.get('refresh_token'):
+            # Otra corrutina pudo renovar el token mientras esperábamos
+            if self.credentials.get('token') == token:
+                await self.refresh_token()
+            response = await self._client.get(
+                f"{self._base_url}{path}",
+                params=params,
+                headers={'Authorization': f"Bearer {self.credentials['token']}"}
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def get_settings(self, setting):
+        """Obtener un ajuste del calendario del usuario (p. ej. 'timezone')"""
+        return await self._get(f"/users/me/settings/{setting}")
+
+    async def get_timezone(self):
+        """
+        Obtener zona horaria del calendario del usuario
+
+        Returns:
+            Zona horaria de pytz (si no se puede obtener, la misma de respaldo
+            que /calculate: la local o UTC)
+        """
+        try:
+            settings = await self.get_settings('timezone')
+            return pytz.timezone(settings['value'])
+        except Exception as e:
+            logger.error(f"Error al obtener zona horaria del calendario: {e}")
+            return fallback_timezone()
+
+    async def list_events(self, start_date, end_date, timezone):
+        """Obtener todos los eventos del rango recorriendo todas las páginas"""
+        time_min = timezone.localize(datetime.datetime.combine(start_date, datetime.time.min)).isoformat()
+        time_max = timezone.localize(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)).isoformat()
+
+        all_events = []
+        params = {
+            'timeMin': time_min,
+            'timeMax': time_max,
+            'singleEvents': 'true',
+            'orderBy': 'startTime',
+            'maxResults': 2500
+        }
+        while True:
+            result = await self._get('/calendars/primary/events', params)
+            all_events.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return all_events
+            params['pageToken'] = page_token
+
+
+async def calculate_summary_async(credentials_dict, start_date, end_date, config, client, base_url=None):
+    """
+    Variante asíncrona del cálculo de /calculate para un usuario
+
+    Args:
+        credentials_dict: Diccionario con las credenciales del usuario
+        start_date, end_date: Rango de fechas (inclusive)
+        config: Configuración del usuario (diccionario o JSON)
+        client: httpx.AsyncClient compartido
+
+    Returns:
+        Diccionario con la zona horaria, el número de eventos, el resumen
+        semanal y las credenciales actualizadas (None si no cambiaron)
+    """
+    config = validate_config(config)
+    calendar = AsyncCalendarClient(credentials_dict, client, base_url)
+    await calendar.ensure_fresh_token()
+
+    timezone = await calendar.get_timezone()
+    events = await calendar.list_events(start_date, end_date, timezone)
+
+    # El cálculo es CPU: se ejecuta en un hilo para no bloquear el bucle de eventos
+    weekly_summary = await asyncio.to_thread(
+        calculate_weekly_summary,
+        events, start_date, end_date, timezone,
+        datetime.datetime.strptime(config['work_start_time'], '%H:%M').time(),
+        datetime.datetime.strptime(config['work_end_time'], '%H:%M').time(),
+        WORK_DAYS,
+        config
+    )
+
+    return {
+        'timezone': timezone.zone,
+        'events_count': len(events),
+        'weekly_summary': weekly_summary,
+        'credentials': calendar.credentials if calendar.refreshed else None
+    }
+
+
+async def calculate_many_async(jobs, concurrency=None, base_url=None):
+    """
+    Calcular los resúmenes de muchos usuarios solapando sus peticiones
+
+    Args:
+        jobs: Lista de diccionarios con credentials, start_date, end_date y config
+        concurrency: Máximo de usuarios procesándose a la vez
+
+    Returns:
+        Lista con el resultado de cada trabajo (o la excepción producida), en el mismo orden
+    """
+    semaphore = asyncio.Semaphore(concurrency or get_env_value('ASYNC_CONCURRENCY', 20, int))
+
+    async with create_async_client() as client:
+        async def run(job):
+            async with semaphore:
+                return await calculate_summary_async(
+                    job['credentials'], job['start_date'], job['end_date'],
+                    job.get('config'), client, base_url
+                )
+
+        results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error en cálculo asíncrono {job['start_date']} - {job['end_date']}: {result}")
+    return results
+
+
+def run_calculations(jobs, concurrency=None, base_url=None):
+    """Punto de entrada síncrono para calculate_many_async"""
+    return asyncio.run(calculate_many_async(jobs, concurrency, base_url))
@@ -1,71 +1,121 @@
 """
 Utilidades para la autenticación con Google Calendar API.
 Este módulo maneja la autenticación OAuth2 con Google.
+
+Las bibliotecas de Google (google_auth_oauthlib, google.oauth2, googleapiclient
+y el transporte de http_utils) se importan la primera vez que se usan para que
+arrancar un worker no las cargue; con preload_app de gunicorn se cargan una
+sola vez en el proceso maestro (ver preload_google_client).
 """
 
 import os
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import json
+import datetime
+import hashlib
+import threading
+from loguru import logger
 
 # Local imports
-from config_utils import clean_env_value
+from config_utils import clean_env_value, get_env_value
+from background_utils import submit_background
+from metrics_utils import stage_timer, record_cache
+from resilience_utils import StaleCache
 
 # Google Calendar API Scopes
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
-# Variable global para almacenar el flujo de autenticación en curso
-_current_flow = None
+# Endpoints de Google (configurables para usar un servidor falso local, ver fake_calendar_server.py)
+DEFAULT_AUTH_URI = 'https://accounts.google.com/o/oauth2/auth'
+DEFAULT_TOKEN_URI = 'https://oauth2.googleapis.com/token'
+DEFAULT_API_BASE_URL = 'https://www.googleapis.com/calendar/v3'
+
+# Segundos antes de la expiración en los que un token se renueva por adelantado.
+# Es el margen de google.auth (_helpers.REFRESH_THRESHOLD) con el que
+# Credentials.expired ya considera expirado el token.
+TOKEN_REFRESH_MARGIN = 225
+
+def get_api_base_url():
+    """URL base de Google Calendar API (GOOGLE_API_BASE_URL)"""
+    return get_env_value('GOOGLE_API_BASE_URL', DEFAULT_API_BASE_URL).rstrip('/')
+
+# Configuración del cliente OAuth, compartida por todos los hilos (solo lectura)
+_client_config = None
+_client_config_lock = threading.Lock()
+
+def _load_client_config():
+    """
+    Leer la configuración del cliente OAuth (variables de entorno o credentials.json)
+    
+    Returns:
+        Tuple (configuración del cliente, URL de redirección) o (None, None)
+    """
+    # Comprobar si existen variables de entorno para las credenciales
+    client_id = clean_env_value(os.environ.get('GOOGLE_CLIENT_ID'))
+    client_secret = clean_env_value(os.environ.get('GOOGLE_CLIENT_SECRET'))
+    redirect_uri = clean_env_value(os.environ.get('GOOGLE_REDIRECT_URI'))
+    
+    if client_id and client_secret:
+        redirect_uri = redirect_uri or "http://localhost:5000/oauth2callback"
+        client_config = {
+            "web": {
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "redirect_uris": [redirect_uri],
+                "auth_uri": get_env_value('GOOGLE_AUTH_URI', DEFAULT_AUTH_URI),
+                "token_uri": get_env_value('GOOGLE_TOKEN_URI', DEFAULT_TOKEN_URI)
+            }
+        }
+        return client_config, redirect_uri
+    
+    if os.path.exists('credentials.json'):
+        with open('credentials.json', 'r') as f:
+            return json.load(f), None
+    
+    return None, None
 
 def get_oauth_flow(force_new=False):
     """
-    Obtener o crear el flujo OAuth para autenticación web
+    Crear un flujo OAuth para autenticación web
+    
+    Cada llamada devuelve un flujo nuevo: el flujo guarda estado de cada
+    usuario (code verifier, token), por lo que no se comparte entre peticiones
+    concurrentes. Solo la configuración del cliente se lee una vez.
     
     Args:
-        force_new: Forzar la creación de un nuevo flujo
+        force_new: Volver a leer la configuración del cliente
         
     Returns:
         Objeto de flujo OAuth o None si no se puede crear
     """
-    global _current_flow
+    global _client_config
     
-    if _current_flow is None or force_new:
-        # Comprobar si existen variables de entorno para las credenciales
-        client_id = clean_env_value(os.environ.get('GOOGLE_CLIENT_ID'))
-        client_secret = clean_env_value(os.environ.get('GOOGLE_CLIENT_SECRET'))
-        redirect_uri = clean_env_value(os.environ.get('GOOGLE_REDIRECT_URI'))
-        
-        if client_id and client_secret:
-            client_config = {
-                "web": {
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "redirect_uris": [redirect_uri or "http://localhost:5000/oauth2callback"],
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token"
-                }
-            }
-            _current_flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
-            # Configurar la URL de redirección correcta
-            _current_flow.redirect_uri = redirect_uri or "http://localhost:5000/oauth2callback"
-        elif os.path.exists('credentials.json'):
-            _current_flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-        else:
-            return None
+    with _client_config_lock:
+        if _client_config is None or force_new:
+            _client_config = _load_client_config()
+        client_config, redirect_uri = _client_config
     
-    return _current_flow
+    if not client_config:
+        return None
+    
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
+    if redirect_uri:
+        # Configurar la URL de redirección correcta
+        flow.redirect_uri = redirect_uri
+    return flow
 
 def get_authorization_url():
     """
     Generar URL para autorización de OAuth
     
     Returns:
-        URL de autorización o None si hay error
+        Tuple (URL de autorización, code verifier PKCE) o (None, None) si hay error.
+        El code verifier debe guardarse en la sesión del usuario y pasarse a
+        complete_oauth_flow.
     """
     flow = get_oauth_flow()
     if not flow:
-        return None
+        return None, None
         
     # Configurar la solicitud de autorización para obtener refresh token
     auth_url, _ = flow.authorization_url(
@@ -73,14 +123,15 @@ def get_authorization_url():
         prompt='consent'
     )
     
-    return auth_url
+    return auth_url, flow.code_verifier
 
-def complete_oauth_flow(code):
+def complete_oauth_flow(code, code_verifier=None):
     """
     Completar el flujo OAuth con el código de autorización
     
     Args:
         code: Código de autorización recibido de Google
+        code_verifier: Code verifier PKCE generado junto con la URL de autorización
         
     Returns:
         Objeto Credentials o None si hay error
@@ -88,6 +139,7 @@ def complete_oauth_flow(code):
     flow = get_oauth_flow()
     if not flow:
         return None
+    flow.code_verifier = code_verifier
     
     try:
         flow.fetch_token(code=code)
@@ -96,7 +148,7 @@ def complete_oauth_flow(code):
         # Ya no guardamos en archivo, devolvemos las credenciales para guardar en sesión
         return creds
     except Exception as e:
-        print(f"Error al completar flujo OAuth: {e}")
+        logger.error(f"Error al completar flujo OAuth: {e}")
         return None
 
 def credentials_to_dict(credentials):
@@ -115,9 +167,39 @@ def credentials_to_dict(credentials):
         'token_uri': credentials.token_uri,
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
+        'scopes': credentials.scopes,
+        # Fecha de expiración en UTC (sin zona horaria, como la maneja google-auth)
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
     }
 
+def get_user_key(credentials_dict):
+    """
+    Obtener un identificador opaco y estable del usuario a partir de sus credenciales
+    
+    Args:
+        credentials_dict: Diccionario con las credenciales almacenadas en sesión
+        
+    Returns:
+        Hash hexadecimal que identifica al usuario o None si no hay credenciales
+    """
+    if not credentials_dict:
+        return None
+    
+    # El refresh token es estable entre renovaciones del access token
+    secret = credentials_dict.get('refresh_token') or credentials_dict.get('token')
+    if not secret:
+        return None
+    return hashlib.sha256(f"{credentials_dict.get('client_id')}:{secret}".encode('utf-8')).hexdigest()
+
+def _parse_expiry(value):
+    """Convertir la expiración guardada en sesión a datetime UTC sin zona horaria"""
+    if not value:
+        return None
+    expiry = datetime.datetime.fromisoformat(value)
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return expiry
+
 def dict_to_credentials(credentials_dict):
     """
     Convertir diccionario de sesión a objeto Credentials
@@ -131,6 +213,7 @@ def dict_to_credentials(credentials_dict):
     if not credentials_dict:
         return None
     
+    from google.oauth2.credentials import Credentials
     try:
         return Credentials(
             token=credentials_dict['token'],
@@ -138,16 +221,199 @@ def dict_to_credentials(credentials_dict):
             token_uri=credentials_dict['token_uri'],
             client_id=credentials_dict['client_id'],
             client_secret=credentials_dict['client_secret'],
-            scopes=credentials_dict['scopes']
+            scopes=credentials_dict['scopes'],
+            expiry=_parse_expiry(credentials_dict.get('expiry'))
         )
     except Exception as e:
-        print(f"Error al convertir diccionario a credenciales: {e}")
+        logger.error(f"Error al convertir diccionario a credenciales: {e}")
+        return None
+
+# Tokens renovados recientemente por usuario, compartidos por los hilos del worker.
+# Token y lock de renovación de los TOKEN_CACHE_MAX_ENTRIES usuarios más recientes;
+# los tokens expirados se descartan al consultarlos.
+_token_cache = StaleCache(max_entries=get_env_value('TOKEN_CACHE_MAX_ENTRIES', 1024, int))
+_token_cache_lock = threading.Lock()
+_refresh_locks = StaleCache(max_entries=get_env_value('TOKEN_CACHE_MAX_ENTRIES', 1024, int))
+_background_refreshes = set()
+
+def _seconds_to_expiry(creds):
+    """Segundos que faltan para que expire el token (None si no se conoce la expiración)"""
+    if not creds.expiry:
         return None
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (creds.expiry - now).total_seconds()
+
+def _remember_token(user_key, creds):
+    """Guardar un token renovado para que lo reutilicen las peticiones concurrentes"""
+    if not user_key or not creds.token:
+        return
+    with _token_cache_lock:
+        cached, _ = _token_cache.get(user_key)
+        if cached and cached['expiry'] and creds.expiry and cached['expiry'] >= creds.expiry:
+            return
+        _token_cache.set(user_key, {'token': creds.token, 'expiry': creds.expiry})
+
+def _apply_cached_token(user_key, creds):
+    """Sustituir el token de la sesión por uno más reciente renovado en este worker"""
+    cached, _ = _token_cache.get(user_key)
+    if not cached or not cached['expiry']:
+        return creds
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if cached['expiry'] <= now:
+        _token_cache.delete(user_key)
+        return creds
+    if creds.expiry and creds.expiry >= cached['expiry']:
+        return creds
+    creds.token = cached['token']
+    creds.expiry = cached['expiry']
+    return creds
+
+def _get_refresh_lock(user_key):
+    with _token_cache_lock:
+        lock, _ = _refresh_locks.get(user_key)
+        if lock is None:
+            lock = threading.Lock()
+            _refresh_locks.set(user_key, lock)
+        return lock
+
+def refresh_credentials(creds, user_key):
+    """
+    Renovar el token de un usuario evitando renovaciones duplicadas
+    
+    Si otro hilo ya lo renovó mientras se esperaba, se reutiliza ese token
+    en lugar de llamar de nuevo al endpoint de tokens.
+    
+    Args:
+        creds: Objeto Credentials de Google
+        user_key: Identificador del usuario (ver get_user_key)
+        
+    Returns:
+        Objeto Credentials con un token válido
+    """
+    with _get_refresh_lock(user_key):
+        creds = _apply_cached_token(user_key, creds)
+        if not creds.expired and creds.token:
+            record_cache('token', True)
+            return creds
+        record_cache('token', False)
+        from http_utils import get_auth_request
+        with stage_timer('credential_refresh'):
+            creds.refresh(get_auth_request())
+        _remember_token(user_key, creds)
+        return creds
+
+def _background_refresh(credentials_dict, user_key):
+    from http_utils import get_auth_request
+    try:
+        creds = dict_to_credentials(credentials_dict)
+        with _get_refresh_lock(user_key):
+            creds = _apply_cached_token(user_key, creds)
+            remaining = _seconds_to_expiry(creds)
+            if remaining is not None and remaining > _background_refresh_window():
+                return
+            creds.refresh(get_auth_request())
+            _remember_token(user_key, creds)
+    except Exception as e:
+        logger.error(f"Error al refrescar token en segundo plano: {e}")
+    finally:
+        with _token_cache_lock:
+            _background_refreshes.discard(user_key)
+
+def _background_refresh_window():
+    return get_env_value('TOKEN_BACKGROUND_REFRESH_WINDOW', 600, int)
+
+def _schedule_background_refresh(creds, user_key):
+    """Renovar en segundo plano un token que expirará pronto (una vez por usuario)"""
+    with _token_cache_lock:
+        if user_key in _background_refreshes:
+            return
+        _background_refreshes.add(user_key)
+    try:
+        submit_background(_background_refresh, credentials_to_dict(creds), user_key)
+    except Exception as e:
+        # Sin tarea programada nadie retiraría al usuario del conjunto
+        logger.error(f"Error al programar la renovación del token: {e}")
+        with _token_cache_lock:
+            _background_refreshes.discard(user_key)
+
+# Documento de descubrimiento de Calendar v3, analizado una vez por proceso
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+def get_discovery_document():
+    """
+    Obtener el documento de descubrimiento de Calendar v3 incluido en googleapiclient
+    
+    Returns:
+        Diccionario con el documento o None si la versión instalada no lo incluye
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                from googleapiclient.discovery_cache import get_static_doc
+                document = get_static_doc('calendar', 'v3')
+                _discovery_document = json.loads(document) if document else False
+    return _discovery_document or None
+
+def preload_google_client():
+    """
+    Importar las bibliotecas de Google y analizar el documento de descubrimiento
+    
+    Pensado para el proceso maestro de gunicorn con preload_app: los workers
+    creados después comparten estos módulos (copy-on-write) en lugar de
+    cargarlos en su primera petición.
+    """
+    import google_auth_oauthlib.flow  # noqa: F401
+    import google.oauth2.credentials  # noqa: F401
+    import googleapiclient.discovery  # noqa: F401
+    import http_utils  # noqa: F401
+    get_discovery_document()
+
+def build_calendar_service(creds, user_key=None):
+    """
+    Construir el servicio de Google Calendar sobre el transporte HTTP compartido del worker
+    
+    El servicio se crea a partir del documento de descubrimiento ya analizado
+    (build_from_document), sin volver a leerlo ni analizarlo en cada petición.
+    
+    Args:
+        creds: Objeto Credentials de Google
+        user_key: Identificador del usuario para compartir los tokens renovados ante un 401
+        
+    Returns:
+        Servicio de Google Calendar
+    """
+    from googleapiclient.discovery import build, build_from_document
+    from http_utils import PooledAuthorizedHttp
+    
+    http = PooledAuthorizedHttp(
+        creds,
+        on_refresh=lambda refreshed: _remember_token(user_key, refreshed),
+        # Un token que expira durante la petición se renueva con el lock del usuario
+        refresh=(lambda expired: refresh_credentials(expired, user_key)) if user_key else None
+    )
+    # api_endpoint sustituye a rootUrl + servicePath del documento de descubrimiento
+    api_base_url = get_api_base_url()
+    client_options = {'api_endpoint': api_base_url + '/'} if api_base_url != DEFAULT_API_BASE_URL else None
+    document = get_discovery_document()
+    with stage_timer('build'):
+        if document is None:
+            return build('calendar', 'v3', http=http, cache_discovery=False, client_options=client_options)
+        return build_from_document(document, http=http, client_options=client_options)
 
 def authenticate_google_calendar(credentials_dict=None):
     """
     Autenticar con Google Calendar API y devolver servicio
     
+    Los tokens se renuevan de forma proactiva: si ya expiraron (o expiran en
+    menos de unos minutos) se renuevan antes de construir el servicio, y si
+    expiran dentro de TOKEN_BACKGROUND_REFRESH_WINDOW segundos se renuevan en
+    segundo plano mientras la petición usa el token actual.
+    
+    Los errores de conexión al renovar el token y los errores al construir el
+    servicio se propagan para que quien llama los cuente como fallos de Google.
+    
     Args:
         credentials_dict: Diccionario con las credenciales almacenadas en sesión
         
@@ -155,23 +421,31 @@ def authenticate_google_calendar(credentials_dict=None):
         Tuple con (Servicio de Google Calendar, credenciales actualizadas) o (None, None)
     """
     creds = dict_to_credentials(credentials_dict)
+    user_key = get_user_key(credentials_dict)
+    
+    if creds and user_key:
+        creds = _apply_cached_token(user_key, creds)
     
     # Si hay credenciales y están expiradas, intentar renovarlas
     if creds and creds.expired and creds.refresh_token:
         try: 
-            creds.refresh(Request())
+            creds = refresh_credentials(creds, user_key)
             # Devolver las credenciales actualizadas y el servicio
-            return build('calendar', 'v3', credentials=creds), credentials_to_dict(creds)
+            return build_calendar_service(creds, user_key), credentials_to_dict(creds)
         except Exception as e:
-            print(f"Error al refrescar token: {e}")
+            from google.auth.exceptions import TransportError
+            # Un fallo de red no invalida las credenciales: se propaga para el circuit breaker
+            if isinstance(e, TransportError):
+                raise
+            logger.error(f"Error al refrescar token: {e}")
             creds = None
     
     # Construir y devolver el servicio si hay credenciales válidas
     if creds and creds.valid:
-        try:
-            return build('calendar', 'v3', credentials=creds), credentials_to_dict(creds)
-        except Exception as e:
-            print(f"Error al construir servicio: {e}")
+        remaining = _seconds_to_expiry(creds)
+        if creds.refresh_token and remaining is not None and remaining < _background_refresh_window():
+            _schedule_background_refresh(creds, user_key)
+        return build_calendar_service(creds, user_key), credentials_to_dict(creds)
     
     # Si no hay credenciales válidas, se necesita autorización
-    return None, None 
\ No newline at end of file
+    return None, None
@@ -0,0 +1,130 @@
+"""
+Utilidades para ejecutar trabajos en segundo plano.
+Este módulo mantiene un pool de hilos acotado por worker y registra el estado
+de cada trabajo en un almacén compartido, de modo que cualquier worker pueda
+consultar su progreso.
+"""
+
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value
+from storage_utils import JsonFileStore
+
+# Estados de un trabajo
+JOB_PENDING = 'pending'
+JOB_DONE = 'done'
+JOB_ERROR = 'error'
+
+BACKGROUND_WORKERS = get_env_value('BACKGROUND_WORKERS', 2, int)
+
+# Los resultados guardan los eventos del usuario: se purgan periódicamente aunque nadie los lea
+job_store = JsonFileStore(
+    get_env_value('BACKGROUND_JOBS_DIR', 'cache/jobs'),
+    ttl=get_env_value('BACKGROUND_JOB_TTL', 3600, int),
+    cleanup_interval=get_env_value('STORE_CLEANUP_INTERVAL', 300, int)
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Obtener el pool de hilos del proceso actual (se recrea tras un fork)"""
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='cwtt-bg')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def submit_background(fn, *args, **kwargs):
+    """
+    Ejecutar una función en segundo plano sin registrar su resultado
+
+    Returns:
+        Objeto Future de la ejecución
+    """
+    return _get_executor().submit(fn, *args, **kwargs)
+
+
+def _run_job(job_id, owner, fn, args, kwargs):
+    try:
+        result = fn(*args, **kwargs)
+        job_store.set(job_id, {
+            'owner': owner,
+            'status': JOB_DONE,
+            'finished_at': time.time(),
+            'result': result
+        })
+        logger.info(f"Trabajo en segundo plano {job_id} completado")
+    except Exception as e:
+        logger.error(f"Error en trabajo en segundo plano {job_id}: {e}")
+        job_store.set(job_id, {
+            'owner': owner,
+            'status': JOB_ERROR,
+            'finished_at': time.time(),
+            'error': str(e)
+        })
+
+
+def submit_job(owner, fn, *args, **kwargs):
+    """
+    Lanzar un trabajo en segundo plano cuyo resultado se podrá consultar después
+
+    Args:
+        owner: Identificador del usuario propietario del trabajo
+        fn: Función a ejecutar; su resultado debe ser serializable a JSON
+
+    Returns:
+        Identificador del trabajo
+    """
+    job_id = uuid.uuid4().hex
+    job_store.set(job_id, {
+        'owner': owner,
+        'status': JOB_PENDING,
+        'created_at': time.time()
+    })
+    submit_background(_run_job, job_id, owner, fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id, owner):
+    """
+    Consultar un trabajo en segundo plano
+
+    Args:
+        job_id: Identificador devuelto por submit_job
+        owner: Identificador del usuario que consulta
+
+    Returns:
+        Diccionario con el estado del trabajo o None si no existe o pertenece a otro usuario
+    """
+    try:
+        job = job_store.get(job_id)
+    except ValueError:
+        return None
+    if not job or job.get('owner') != owner:
+        return None
+    return job
+
+
+def delete_job(job_id, owner):
+    """Eliminar un trabajo del usuario (por ejemplo, una vez usado su resultado)"""
+    if get_job(job_id, owner) is not None:
+        job_store.delete(job_id)
+
+
+def delete_jobs(owner):
+    """Eliminar todos los trabajos de un usuario (al cerrar sesión)"""
+    if owner:
+        job_store.delete_matching(lambda job: job.get('owner') == owner)
@@ -0,0 +1,375 @@
+"""
+Cálculo por lotes de resúmenes a partir de calendarios exportados.
+
+Calcula sin la aplicación web el resumen semanal de muchos usuarios a la vez
+(por ejemplo, la facturación de fin de mes de todo el equipo). Cada archivo de
+entrada es la exportación de un usuario: la respuesta de events().list (una
+página o una lista de páginas), una lista de eventos, el formato de
+synthetic_calendar.py o un calendario iCalendar (.ics, ver ics_utils.py). El
+nombre del archivo identifica al usuario. Los archivos se procesan en paralelo
+en varios procesos y el resumen de cada usuario se escribe en JSON (y
+opcionalmente en CSV) en el directorio de salida.
+
+Con --google cada archivo JSON contiene las credenciales guardadas de un usuario
+(credentials_to_dict) y los eventos se obtienen de Google Calendar con el
+cliente asíncrono de async_calendar.py, solapando las peticiones de todos.
+
+Uso:
+    python batch_summary.py exportaciones/ --month 2024-05 --output-dir informes/
+    python batch_summary.py ana.json luis.json --start-date 2024-05-01 --end-date 2024-05-31 \\
+        --config config.json --workers 8 --csv
+    python batch_summary.py credenciales/ --month 2024-05 --google --workers 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import calendar
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pytz
+
+from config_utils import get_default_config, validate_config
+from metrics_utils import stage_timer
+from calendar_time_tracker import calculate_weekly_summary, summarize_parsed_events
+from ics_utils import parse_ics, read_calendar_timezone
+from export_utils import iter_export_rows, stream_csv
+
+# Días laborables usados por /calculate (lunes a viernes)
+WORK_DAYS = [0, 1, 2, 3, 4]
+
+# Extensiones de los archivos de entrada (exportaciones, o credenciales con --google)
+EXPORT_EXTENSIONS = ('.json', '.ics')
+CREDENTIAL_EXTENSIONS = ('.json',)
+
+# Resumen de la ejecución en el directorio de salida
+BATCH_SUMMARY_NAME = '_batch.json'
+
+
+def load_export(path):
+    """
+    Leer la exportación de eventos de un usuario
+
+    Returns:
+        Tuple (eventos, zona horaria o None)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get('items', data.get('events', [])), data.get('timeZone', data.get('timezone'))
+
+    # Lista de páginas de events().list o lista de eventos
+    if data and all(isinstance(item, dict) and 'items' in item for item in data):
+        events = [event for page in data for event in page['items']]
+        return events, next((page['timeZone'] for page in data if page.get('timeZone')), None)
+    return data, None
+
+
+def find_exports(paths, extensions=EXPORT_EXTENSIONS):
+    """
+    Archivos a procesar (los directorios se recorren sin entrar en subdirectorios)
+
+    Args:
+        paths: Archivos o directorios indicados en la línea de comandos
+        extensions: Extensiones admitidas (EXPORT_EXTENSIONS o CREDENTIAL_EXTENSIONS)
+
+    Returns:
+        Lista de tuplas (usuario, ruta) ordenada por usuario
+
+    Raises:
+        ValueError: Si un archivo indicado tiene otra extensión o un usuario se repite
+    """
+    exports = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in os.listdir(path)
+                     if name.endswith(extensions) and name != BATCH_SUMMARY_NAME]
+        elif not path.endswith(extensions):
+            raise ValueError(f"{path}: se esperaba un archivo {' o '.join(extensions)}")
+        else:
+            files = [path]
+        for file_path in files:
+            user = os.path.splitext(os.path.basename(file_path))[0]
+            if user in exports and exports[user] != file_path:
+                raise ValueError(f"Usuario repetido: {exports[user]} y {file_path}")
+            exports[user] = file_path
+    return sorted(exports.items())
+
+
+def load_config(path):
+    """Leer y validar una configuración de usuario (la misma que guarda la aplicación)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return validate_config(json.load(f))
+
+
+def build_report(user, weekly_summary, start_date, end_date, timezone, events_count):
+    """
+    Resumen serializable de un usuario
+
+    Las semanas tienen el formato de report_utils.save_report (duraciones en
+    segundos), por lo que sirve para export_utils.iter_export_rows.
+    """
+    weeks = [
+        [week_start.isoformat(), {
+            service: time_spent.total_seconds()
+            for service, time_spent in weekly_summary[week_start].items()
+        }]
+        for week_start in sorted(weekly_summary)
+    ]
+    period = {}
+    for _, services in weeks:
+        for service, seconds in services.items():
+            period[service] = period.get(service, 0.0) + seconds
+    return {
+        'user': user,
+        'range': [start_date.isoformat(), end_date.isoformat()],
+        'timezone': timezone.zone,
+        'events': events_count,
+        'weeks': weeks,
+        'period': dict(sorted(period.items(), key=lambda item: item[1], reverse=True)),
+    }
+
+
+def summarize_export(job):
+    """
+    Calcular y guardar el resumen de un usuario (se ejecuta en un proceso del pool)
+
+    Args:
+        job: Diccionario con user, path, start_date, end_date, config,
+            default_timezone, output_dir y csv
+
+    Returns:
+        Diccionario con el resultado del usuario; los errores se devuelven en
+        'error' para que un archivo incorrecto no detenga el lote
+    """
+    started = time.perf_counter()
+    result = {'user': job['user'], 'path': job['path']}
+    try:
+        config = job['config']
+        work_start = datetime.datetime.strptime(config['work_start_time'], '%H:%M').time()
+        work_end = datetime.datetime.strptime(config['work_end_time'], '%H:%M').time()
+        if job['path'].endswith('.ics'):
+            # Los eventos del .ics ya se obtienen parseados y solo los del rango
+            with stage_timer('parse'):
+                timezone = pytz.timezone(read_calendar_timezone(job['path']) or job['default_timezone'])
+                events, _ = parse_ics(job['path'], job['start_date'], job['end_date'], config, timezone)
+            with stage_timer('weekly_summary'):
+                weekly_summary = summarize_parsed_events(
+                    events, job['start_date'], job['end_date'], timezone, work_start, work_end, WORK_DAYS, config
+                )
+        else:
+            events, timezone_name = load_export(job['path'])
+            timezone = pytz.timezone(timezone_name or job['default_timezone'])
+            weekly_summary = calculate_weekly_summary(
+                events, job['start_date'], job['end_date'], timezone, work_start, work_end, WORK_DAYS, config
+            )
+        report = build_report(job['user'], weekly_summary, job['start_date'], job['end_date'],
+                              timezone, len(events))
+        result.update(write_report(job, report))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['duration'] = time.perf_counter() - started
+    return result
+
+
+def write_report(job, report):
+    """
+    Escribir el resumen de un usuario en el directorio de salida
+
+    Returns:
+        Diccionario con la ruta del JSON y los totales del usuario
+    """
+    output = os.path.join(job['output_dir'], f"{job['user']}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if job.get('csv'):
+        with open(os.path.join(job['output_dir'], f"{job['user']}.csv"), 'w',
+                  encoding='utf-8', newline='') as f:
+            f.writelines(stream_csv(iter_export_rows(report)))
+    return {
+        'output': output,
+        'events': report['events'],
+        'weeks': len(report['weeks']),
+        'total_seconds': sum(report['period'].values()),
+    }
+
+
+def summarize_google(jobs, concurrency=None):
+    """
+    Obtener de Google Calendar y resumir los calendarios de los trabajos
+
+    Cada archivo de entrada contiene las credenciales de un usuario. Las
+    peticiones de todos los usuarios se solapan en un único proceso
+    (async_calendar.run_calculations).
+
+    Args:
+        jobs: Trabajos de summarize_export
+        concurrency: Máximo de usuarios consultándose a la vez
+
+    Returns:
+        Lista de resultados ordenada por usuario
+    """
+    # httpx solo se carga en este modo
+    from async_calendar import run_calculations
+
+    started = time.perf_counter()
+    results, calculations = [], []
+    for job in jobs:
+        try:
+            with open(job['path'], 'r', encoding='utf-8') as f:
+                credentials = json.load(f)
+        except (OSError, ValueError) as e:
+            results.append({'user': job['user'], 'path': job['path'], 'error': f"{type(e).__name__}: {e}"})
+            continue
+        calculations.append((job, {
+            'credentials': credentials,
+            'start_date': job['start_date'],
+            'end_date': job['end_date'],
+            'config': job['config'],
+        }))
+
+    outcomes = run_calculations([calculation for _, calculation in calculations], concurrency)
+    for (job, _), outcome in zip(calculations, outcomes):
+        result = {'user': job['user'], 'path': job['path']}
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            report = build_report(job['user'], outcome['weekly_summary'], job['start_date'], job['end_date'],
+                                  pytz.timezone(outcome['timezone']), outcome['events_count'])
+            result.update(write_report(job, report))
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        results.append(result)
+
+    # Las peticiones se solapan: la duración es la del lote completo
+    elapsed = time.perf_counter() - started
+    for result in results:
+        result['duration'] = elapsed
+    return sorted(results, key=lambda item: item['user'])
+
+
+def run_batch(jobs, workers=None):
+    """
+    Procesar los trabajos en paralelo
+
+    Args:
+        jobs: Trabajos de summarize_export
+        workers: Procesos del pool (1 para procesar en el proceso actual)
+
+    Returns:
+        Lista de resultados ordenada por usuario
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        results = [summarize_export(job) for job in jobs]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            futures = [executor.submit(summarize_export, job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                status = result.get('error') or f"{result['events']} eventos"
+                print(f"{result['user']}: {status} ({result['duration']:.2f} s)", file=sys.stderr)
+                results.append(result)
+    return sorted(results, key=lambda item: item['user'])
+
+
+def _date_range(args, parser):
+    if args.month:
+        if args.start_date or args.end_date:
+            parser.error('Use --month o --start-date/--end-date, no ambos')
+        try:
+            year, month = (int(part) for part in args.month.split('-'))
+            last_day = calendar.monthrange(year, month)[1]
+        except ValueError:
+            parser.error(f"Mes no válido: {args.month} (formato AAAA-MM)")
+        return datetime.date(year, month, 1), datetime.date(year, month, last_day)
+
+    if not args.start_date or not args.end_date:
+        parser.error('Indique --month o --start-date y --end-date')
+    try:
+        start_date = datetime.date.fromisoformat(args.start_date)
+        end_date = datetime.date.fromisoformat(args.end_date)
+    except ValueError as e:
+        parser.error(f"Fecha no válida: {e}")
+    if start_date > end_date:
+        parser.error('La fecha de inicio es posterior a la de fin')
+    return start_date, end_date
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Resúmenes de horas de muchos usuarios a partir de calendarios exportados')
+    parser.add_argument('inputs', nargs='+', help='Archivos JSON o ICS exportados o directorios que los contienen')
+    parser.add_argument('--month', default=None, help='Mes completo (AAAA-MM)')
+    parser.add_argument('--start-date', default=None, help='Primer día (AAAA-MM-DD)')
+    parser.add_argument('--end-date', default=None, help='Último día (AAAA-MM-DD)')
+    parser.add_argument('--config', default=None, help='Configuración JSON común (por defecto la predeterminada)')
+    parser.add_argument('--config-dir', default=None,
+                        help='Directorio con configuraciones por usuario (<usuario>.json)')
+    parser.add_argument('--timezone', default='Europe/Madrid',
+                        help='Zona horaria de las exportaciones que no la incluyen')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Procesos en paralelo (por defecto, uno por CPU); con --google, usuarios a la vez')
+    parser.add_argument('--output-dir', default='informes', help='Directorio de los resúmenes')
+    parser.add_argument('--csv', action='store_true', help='Escribir también un CSV por usuario')
+    parser.add_argument('--google', action='store_true',
+                        help='Las entradas son credenciales JSON: obtener los eventos de Google Calendar')
+    args = parser.parse_args(argv)
+
+    start_date, end_date = _date_range(args, parser)
+    try:
+        pytz.timezone(args.timezone)
+        exports = find_exports(args.inputs, CREDENTIAL_EXTENSIONS if args.google else EXPORT_EXTENSIONS)
+        default_config = load_config(args.config) if args.config else get_default_config()
+    except (OSError, ValueError, pytz.UnknownTimeZoneError) as e:
+        parser.error(str(e))
+    if not exports:
+        parser.error('No se encontraron credenciales JSON' if args.google else 'No se encontraron archivos JSON ni ICS')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = []
+    for user, path in exports:
+        config = default_config
+        user_config = os.path.join(args.config_dir, f'{user}.json') if args.config_dir else None
+        if user_config and os.path.exists(user_config):
+            config = load_config(user_config)
+        jobs.append({
+            'user': user,
+            'path': path,
+            'start_date': start_date,
+            'end_date': end_date,
+            'config': config,
+            'default_timezone': args.timezone,
+            'output_dir': args.output_dir,
+            'csv': args.csv,
+        })
+
+    started = time.perf_counter()
+    if args.google:
+        results = summarize_google(jobs, args.workers)
+    else:
+        results = run_batch(jobs, args.workers)
+    elapsed = time.perf_counter() - started
+
+    with open(os.path.join(args.output_dir, BATCH_SUMMARY_NAME), 'w', encoding='utf-8') as f:
+        json.dump({
+            'range': [start_date.isoformat(), end_date.isoformat()],
+            'elapsed': elapsed,
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+
+    failed = [result for result in results if 'error' in result]
+    for result in results:
+        if 'error' in result:
+            print(f"{result['user']:<24} ERROR {result['error']}")
+        else:
+            print(f"{result['user']:<24} {result['events']:>8} eventos  {result['total_seconds'] / 3600:8.2f} h")
+    print(f"{len(results) - len(failed)}/{len(results)} usuarios en {elapsed:.1f} s ({args.output_dir})")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""
+Pruebas de rendimiento reproducibles del cálculo de horas.
+
+Mide cada etapa (parse_datetime_api, assign_service, parse_events, resumen
+semanal y calculate_weekly_summary), el índice de eventos (construirlo y
+resumir solo el último mes a partir de él), la lectura del mismo calendario en
+formato .ics (parse_ics) y la petición completa a /calculate con el
+calendario falso de fake_calendar_server.py sin HTTP (también con las semanas
+pasadas ya consolidadas, ver rollup_utils.py), sobre calendarios sintéticos generados
+con una semilla fija (ver synthetic_calendar.py), y el tiempo de importación
+de la aplicación en un proceso nuevo. Los resultados se escriben
+en JSON para poder compararlos entre versiones.
+
+Uso:
+    python benchmark.py --sizes 1000,10000 --repeat 5 --output resultados.json
+    python benchmark.py --sizes 1000 --compare resultados.json
+    python benchmark.py --sizes '' --import-time app,wsgi
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import tempfile
+import subprocess
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pytz
+
+from synthetic_calendar import generate_calendar, dst_range, synthetic_config, write_ics
+from calendar_utils import parse_datetime_api, assign_service
+from calendar_time_tracker import (
+    parse_events,
+    summarize_parsed_events,
+    calculate_weekly_summary
+)
+from ics_utils import parse_ics
+from event_index_utils import EventIndex
+from rollup_utils import RollupStore
+from resilience_utils import StaleCache
+from storage_utils import JsonFileStore
+from fake_calendar_server import FakeCalendar, InProcessCalendarService
+
+BENCHMARKS = [
+    'parse_datetime_api',
+    'assign_service',
+    'parse_events',
+    'summarize_parsed_events',
+    'calculate_weekly_summary',
+    'build_event_index',
+    'summarize_indexed_month',
+    'parse_ics',
+    'calculate_endpoint',
+    'calculate_endpoint_rollups',
+]
+
+def _event_range(events, timezone):
+    """Primer y último día de un calendario sintético"""
+    first, _ = parse_datetime_api(events[0]['start'])
+    last, _ = parse_datetime_api(events[-1]['end'])
+    return first.astimezone(timezone).date(), last.astimezone(timezone).date()
+
+
+def _work_settings(config):
+    work_start = datetime.datetime.strptime(config['work_start_time'], '%H:%M').time()
+    work_end = datetime.datetime.strptime(config['work_end_time'], '%H:%M').time()
+    # Lunes a viernes, como en /calculate
+    return work_start, work_end, [0, 1, 2, 3, 4]
+
+
+def build_cases(events, timezone_name, config, work_dir):
+    """
+    Preparar la función a medir de cada prueba
+
+    Args:
+        work_dir: Directorio temporal donde escribir el calendario en .ics
+
+    Returns:
+        Diccionario {nombre: función sin argumentos}
+    """
+    timezone = pytz.timezone(timezone_name)
+    start_date, end_date = _event_range(events, timezone)
+    work_start, work_end, work_days = _work_settings(config)
+    parsed_events = parse_events(events, timezone, config)
+    index = EventIndex(parsed_events, start_date, end_date, timezone_name)
+    month_start = max(start_date, end_date - datetime.timedelta(days=27))
+    service = InProcessCalendarService(FakeCalendar(events, timezone_name))
+
+    # Informes y semanas consolidadas en el directorio temporal, no en cache/ de la aplicación
+    report_store = JsonFileStore(os.path.join(work_dir, f'reports_{len(events)}'), ttl=3600)
+    rollup_store = RollupStore(os.path.join(work_dir, f'rollups_{len(events)}.sqlite3'))
+
+    # El mismo calendario en .ics (las series como RRULE)
+    ics_path = os.path.join(work_dir, f'calendar_{len(events)}.ics')
+    with open(ics_path, 'w', encoding='utf-8', newline='') as f:
+        write_ics(events, f, timezone_name)
+
+    def run_parse_datetime():
+        for event in events:
+            parse_datetime_api(event['start'])
+            parse_datetime_api(event['end'])
+
+    def run_assign_service():
+        for event in events:
+            assign_service(event, config)
+
+    def run_endpoint(keep_rollups=False):
+        import app as app_module
+
+        credentials = {'token': 'bench', 'refresh_token': 'bench', 'client_id': 'bench'}
+        if not keep_rollups:
+            rollup_store.delete(app_module.get_user_key(credentials))
+        with ExitStack() as stack:
+            # Cachés de eventos vacías en cada repetición (evitarían llamar al servicio)
+            stack.enter_context(patch('resilience_utils.events_cache', StaleCache()))
+            stack.enter_context(patch('event_index_utils.event_index_cache', StaleCache()))
+            stack.enter_context(patch('report_utils.report_store', report_store))
+            stack.enter_context(patch('rollup_utils.rollup_store', rollup_store))
+            if hasattr(app_module.app.session_interface, 'backend'):
+                from session_utils import FileSystemSessionBackend
+                stack.enter_context(patch.object(app_module.app.session_interface, 'backend',
+                                                 FileSystemSessionBackend(os.path.join(work_dir, 'sessions'))))
+            stack.enter_context(patch('app.authenticate_google_calendar', return_value=(service, None)))
+
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess['credentials'] = credentials
+                # Zona con la que se consolidaron las semanas (la devolvería una petición anterior)
+                sess['calendar_timezone'] = timezone_name
+            response = client.post('/calculate', data={
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'config': json.dumps(config),
+            })
+            body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"/calculate respondió {response.status_code}")
+        return body
+
+    return {
+        'parse_datetime_api': run_parse_datetime,
+        'assign_service': run_assign_service,
+        'parse_events': lambda: parse_events(events, timezone, config),
+        'summarize_parsed_events': lambda: summarize_parsed_events(
+            parsed_events, start_date, end_date, timezone, work_start, work_end, work_days, config
+        ),
+        'calculate_weekly_summary': lambda: calculate_weekly_summary(
+            events, start_date, end_date, timezone, work_start, work_end, work_days, config
+        ),
+        'build_event_index': lambda: EventIndex(parsed_events, start_date, end_date, timezone_name),
+        'summarize_indexed_month': lambda: summarize_parsed_events(
+            index, month_start, end_date, timezone, work_start, work_end, work_days, config
+        ),
+        'parse_ics': lambda: parse_ics(ics_path, start_date, end_date, config, timezone),
+        'calculate_endpoint': run_endpoint,
+        # Con las semanas pasadas ya consolidadas (el calentamiento las guarda)
+        'calculate_endpoint_rollups': lambda: run_endpoint(keep_rollups=True),
+    }
+
+
+def measure(func, repeat=5, warmup=1):
+    """
+    Medir una función varias veces
+
+    Returns:
+        Lista de duraciones en segundos
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize_timings(timings, items):
+    """Estadísticas de una serie de duraciones"""
+    ordered = sorted(timings)
+    median = statistics.median(ordered)
+    return {
+        'min': ordered[0],
+        'median': median,
+        'mean': statistics.fmean(ordered),
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'p95': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'items_per_second': items / median if median else None,
+    }
+
+
+def measure_import_time(module='app', repeat=5):
+    """
+    Medir el tiempo de importación de un módulo en procesos nuevos (arranque en frío)
+
+    Returns:
+        Tuple (duraciones en segundos según -X importtime, módulos pesados cargados)
+    """
+    heavy_modules = ['googleapiclient.discovery', 'google_auth_oauthlib.flow', 'google.oauth2.credentials',
+                     'requests', 'httplib2', 'httpx']
+    code = (f"import sys, json, {module}; "
+            f"print(json.dumps([m for m in {heavy_modules!r} if m in sys.modules]))")
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                capture_output=True, text=True, check=True)
+        # Última línea de -X importtime para el módulo: "import time: propio | acumulado | nombre"
+        lines = [line for line in result.stderr.splitlines()
+                 if line.startswith('import time:') and line.rsplit('|', 1)[-1].strip() == module]
+        timings.append(int(lines[-1].split('|')[1]) / 1e6)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, loaded
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(sizes, repeat=5, warmup=1, seed=0, events_per_day=8, timezone='Europe/Madrid',
+                   dst=False, only=None, import_modules=()):
+    """
+    Ejecutar las pruebas de rendimiento para cada tamaño de calendario
+
+    Args:
+        sizes: Números de eventos de los calendarios
+        repeat: Repeticiones medidas de cada prueba
+        warmup: Ejecuciones previas no medidas
+        seed: Semilla del generador
+        events_per_day: Media de eventos por día laborable
+        timezone: Zona horaria del calendario
+        dst: Empezar el calendario antes del cambio de horario de primavera
+        only: Nombres de las pruebas a ejecutar (None para todas)
+        import_modules: Módulos cuyo tiempo de importación se mide (p. ej. 'app', 'wsgi')
+
+    Returns:
+        Diccionario serializable con el entorno y los resultados
+    """
+    selected = [name for name in BENCHMARKS if not only or name in only]
+    config = synthetic_config()
+    start_date = dst_range(timezone=timezone)[0] if dst else datetime.date(2023, 1, 2)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            events = generate_calendar(start_date, seed=seed, events_per_day=events_per_day,
+                                       timezone=timezone, max_events=size)
+            cases = build_cases(events, timezone, config, work_dir)
+            for name in selected:
+                timings = measure(cases[name], repeat, warmup)
+                results.append({
+                    'name': name,
+                    'events': len(events),
+                    'repeat': repeat,
+                    'timings': timings,
+                    **summarize_timings(timings, len(events)),
+                })
+
+    for module in import_modules:
+        timings, loaded = measure_import_time(module, repeat)
+        results.append({
+            'name': f'import_{module}',
+            'events': 0,
+            'repeat': repeat,
+            'timings': timings,
+            'heavy_modules_loaded': loaded,
+            **summarize_timings(timings, 1),
+        })
+
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'revision': _git_revision(),
+            'seed': seed,
+            'events_per_day': events_per_day,
+            'timezone': timezone,
+            'start_date': start_date.isoformat(),
+        },
+        'results': results,
+    }
+
+
+def compare_results(current, baseline):
+    """
+    Comparar la mediana de cada prueba con una ejecución anterior
+
+    Returns:
+        Lista de (nombre, eventos, mediana actual, mediana anterior, cociente)
+    """
+    previous = {(item['name'], item['events']): item['median'] for item in baseline['results']}
+    rows = []
+    for item in current['results']:
+        before = previous.get((item['name'], item['events']))
+        ratio = item['median'] / before if before else None
+        rows.append((item['name'], item['events'], item['median'], before, ratio))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pruebas de rendimiento del cálculo de horas')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='Números de eventos separados por comas (p. ej. 1000,100000,1000000)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--events-per-day', type=float, default=8)
+    parser.add_argument('--timezone', default='Europe/Madrid')
+    parser.add_argument('--dst', action='store_true', help='Calendario que cruza el cambio de horario')
+    parser.add_argument('--only', default=None, help=f"Pruebas separadas por comas ({', '.join(BENCHMARKS)})")
+    parser.add_argument('--import-time', default=None,
+                        help="Módulos cuyo tiempo de importación en frío se mide, separados por comas (p. ej. app,wsgi)")
+    parser.add_argument('--output', default=None, help='Archivo JSON de resultados')
+    parser.add_argument('--compare', default=None, help='Archivo JSON de una ejecución anterior')
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    unknown = (only or set()) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Pruebas desconocidas: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(
+        [int(size) for size in args.sizes.split(',') if size], repeat=args.repeat, warmup=args.warmup,
+        seed=args.seed, events_per_day=args.events_per_day, timezone=args.timezone,
+        dst=args.dst, only=only,
+        import_modules=args.import_time.split(',') if args.import_time else ()
+    )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    for item in report['results']:
+        print(f"{item['name']:<26} {item['events']:>9} eventos  mediana {item['median'] * 1000:10.2f} ms  "
+              f"p95 {item['p95'] * 1000:10.2f} ms")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        for name, events, median, before, ratio in compare_results(report, baseline):
+            change = f"x{ratio:.2f}" if ratio else 'sin referencia'
+            print(f"{name:<26} {events:>9} eventos  {change}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Construcción de los recursos estáticos para producción.
+
+Uso:
+    python build_assets.py [--safelist clase1,clase2] [--no-purge]
+
+Pasos:
+  1. Elimina de tailwind.min.css las clases que no aparecen en templates/ ni
+     en los scripts de static/js (las clases pueden añadirse desde JavaScript).
+  2. Genera nombres con hash de contenido en static/dist/ (caché inmutable).
+  3. Genera variantes precomprimidas .gz y, si está instalado brotli, .br.
+  4. Escribe static/dist/manifest.json, que usa asset_url() en las plantillas.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+
+# Importar brotli si está disponible
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+
+# Recursos que se publican con nombre versionado
+ASSETS = [
+    'css/tailwind.min.css',
+    'css/flowbite.min.css',
+    'css/styles.css',
+    'js/flowbite.min.js',
+]
+
+# Recursos a los que se aplica el purgado de clases
+PURGE_ASSETS = {'css/tailwind.min.css'}
+
+# Tamaño mínimo para generar variantes comprimidas
+COMPRESS_MIN_SIZE = 1024
+
+# Extractor de candidatos a clase (similar al extractor por defecto de Tailwind)
+_TOKEN_PATTERN = re.compile(r'[^<>"\'`\s=]*[^<>"\'`\s:=]')
+_CLASS_IN_SELECTOR = re.compile(r'\.((?:\\[0-9a-fA-F]{1,6} ?|\\.|[A-Za-z0-9_-])+)')
+_CSS_ESCAPE = re.compile(r'\\([0-9a-fA-F]{1,6}) ?|\\(.)')
+
+
+def collect_used_tokens(paths):
+    """
+    Obtener todos los posibles nombres de clase usados en los archivos indicados
+
+    Returns:
+        Conjunto de tokens
+    """
+    tokens = set()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for token in _TOKEN_PATTERN.findall(f.read()):
+                tokens.add(token)
+                # Las clases también aparecen dentro de cadenas como 'a b c' o classList.add('x')
+                tokens.update(part for part in re.split(r'[(),;{}\[\]+]', token) if part)
+    return tokens
+
+
+def _unescape(name):
+    def replace(match):
+        if match.group(1):
+            return chr(int(match.group(1), 16))
+        return match.group(2)
+    return _CSS_ESCAPE.sub(replace, name)
+
+
+def selector_classes(selector):
+    """Nombres de clase (sin escapes) que aparecen en un selector"""
+    return [_unescape(name) for name in _CLASS_IN_SELECTOR.findall(selector)]
+
+
+def _split_top_level(text, separator=','):
+    """Dividir por `separator` ignorando paréntesis, corchetes y cadenas"""
+    parts, depth, quote, current = [], 0, None, []
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+def _find_block_end(css, start):
+    """Posición de la llave que cierra el bloque abierto en `start`"""
+    depth, quote, i = 0, None, start
+    while i < len(css):
+        char = css[i]
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return len(css) - 1
+
+
+def purge_css(css, used):
+    """
+    Eliminar las reglas cuyas clases no se usan
+
+    Se conserva cada selector sin clases (elementos, preflight) o cuyas clases
+    aparecen todas en `used`. Los bloques @media/@supports se procesan de forma
+    recursiva y el resto de at-rules (@keyframes, @font-face...) se conservan.
+
+    Args:
+        css: Hoja de estilos
+        used: Conjunto de nombres de clase usados
+
+    Returns:
+        Hoja de estilos purgada
+    """
+    output = []
+    i = 0
+    length = len(css)
+    while i < length:
+        # Comentarios: conservar solo los de licencia (/*! ... */)
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            if css.startswith('/*!', i):
+                output.append(css[i:end])
+            i = end
+            continue
+
+        brace = css.find('{', i)
+        semicolon = css.find(';', i)
+        if brace == -1:
+            output.append(css[i:])
+            break
+
+        # At-rules sin bloque (@charset, @import)
+        if css[i] == '@' and semicolon != -1 and semicolon < brace:
+            output.append(css[i:semicolon + 1])
+            i = semicolon + 1
+            continue
+
+        prelude = css[i:brace].strip()
+        end = _find_block_end(css, brace)
+        body = css[brace + 1:end]
+        i = end + 1
+
+        if not prelude:
+            continue
+
+        if prelude.startswith('@'):
+            if prelude.startswith(('@media', '@supports')):
+                inner = purge_css(body, used)
+                if inner.strip():
+                    output.append(f"{prelude}{{{inner}}}")
+            else:
+                output.append(f"{prelude}{{{body}}}")
+            continue
+
+        selectors = [
+            selector for selector in _split_top_level(prelude)
+            if all(name in used for name in selector_classes(selector))
+        ]
+        if selectors:
+            output.append(f"{','.join(selectors)}{{{body}}}")
+
+    return ''.join(output)
+
+
+def fingerprint(content):
+    """Hash corto del contenido para versionar el nombre del archivo"""
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def hashed_name(asset, digest):
+    """css/styles.css -> css/styles.<hash>.css"""
+    root, ext = os.path.splitext(asset)
+    return f"{root}.{digest}{ext}"
+
+
+def write_variants(path, content):
+    """Escribir el recurso y sus variantes precomprimidas"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    if len(content) < COMPRESS_MIN_SIZE:
+        return
+    with open(f"{path}.gz", 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if BROTLI_AVAILABLE:
+        with open(f"{path}.br", 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+
+def build(safelist=(), purge=True, dist_dir=DIST_DIR):
+    """
+    Construir todos los recursos
+
+    Returns:
+        Diccionario manifest (nombre lógico -> nombre versionado)
+    """
+    sources = [os.path.join(TEMPLATES_DIR, name) for name in sorted(os.listdir(TEMPLATES_DIR))]
+    js_dir = os.path.join(STATIC_DIR, 'js')
+    sources += [os.path.join(js_dir, name) for name in sorted(os.listdir(js_dir))]
+    used = collect_used_tokens(sources) | set(safelist)
+
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+
+    manifest = {}
+    for asset in ASSETS:
+        with open(os.path.join(STATIC_DIR, asset), 'rb') as f:
+            content = f.read()
+        original_size = len(content)
+
+        if purge and asset in PURGE_ASSETS:
+            content = purge_css(content.decode('utf-8'), used).encode('utf-8')
+
+        target = hashed_name(asset, fingerprint(content))
+        write_variants(os.path.join(dist_dir, target), content)
+        manifest[asset] = target
+        print(f"{asset} -> dist/{target} ({original_size} -> {len(content)} bytes)")
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if not BROTLI_AVAILABLE:
+        print("brotli no está instalado: solo se generan variantes .gz")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Construir recursos estáticos versionados y comprimidos')
+    parser.add_argument('--safelist', default='', help='Clases a conservar siempre, separadas por comas')
+    parser.add_argument('--no-purge', action='store_true', help='No eliminar clases de Tailwind sin usar')
+    args = parser.parse_args(argv)
+
+    safelist = [name.strip() for name in args.safelist.split(',') if name.strip()]
+    build(safelist=safelist, purge=not args.no_purge)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Utilidades para la política de caché HTTP de cada ruta.
+Este módulo sustituye el no-store global por políticas por ruta:
+  - 'revalidate': páginas cacheables que el navegador revalida con ETag y
+    Last-Modified (respuesta 304 si no cambiaron).
+  - 'no-store': páginas con datos del usuario (resultados, autenticación).
+  - 'immutable': recursos con hash en el nombre (ver asset_utils).
+"""
+
+import os
+from functools import wraps
+
+from flask import make_response, request
+
+# Políticas disponibles
+POLICY_REVALIDATE = 'revalidate'
+POLICY_NO_STORE = 'no-store'
+POLICY_IMMUTABLE = 'immutable'
+
+CACHE_CONTROL = {
+    # Dependen de la cookie de sesión (menú de usuario, mensajes flash): solo caché privada
+    POLICY_REVALIDATE: 'private, no-cache',
+    POLICY_NO_STORE: 'no-store, no-cache, must-revalidate, max-age=0',
+    POLICY_IMMUTABLE: 'public, max-age=31536000, immutable',
+}
+
+# Endpoints que gestionan su propia caché (send_file con ETag/Last-Modified)
+STATIC_ENDPOINTS = ('static', 'assets')
+
+
+def apply_cache_policy(response, policy, last_modified=None):
+    """
+    Aplicar una política de caché a una respuesta
+
+    Args:
+        response: Respuesta de Flask
+        policy: Una de POLICY_REVALIDATE, POLICY_NO_STORE o POLICY_IMMUTABLE
+        last_modified: Fecha de última modificación (solo POLICY_REVALIDATE)
+
+    Returns:
+        La respuesta, convertida en 304 si el cliente ya tiene esta versión
+    """
+    response.headers['Cache-Control'] = CACHE_CONTROL[policy]
+
+    if policy == POLICY_NO_STORE:
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    elif policy == POLICY_REVALIDATE and response.status_code == 200 and not response.is_streamed:
+        # ETag del contenido renderizado: cambia si cambia cualquier dato de la página
+        response.add_etag()
+        if last_modified:
+            response.last_modified = last_modified
+        response.vary.add('Cookie')
+        response = response.make_conditional(request)
+
+    return response
+
+
+def cache_policy(policy, last_modified=None):
+    """
+    Decorador que aplica una política de caché a la respuesta de una vista
+
+    Args:
+        policy: Una de POLICY_REVALIDATE, POLICY_NO_STORE o POLICY_IMMUTABLE
+        last_modified: Función sin argumentos que devuelve la fecha de última modificación
+    """
+    if policy not in CACHE_CONTROL:
+        raise ValueError(f"Política de caché desconocida: {policy}")
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            return apply_cache_policy(response, policy, last_modified() if last_modified else None)
+        return wrapper
+    return decorator
+
+
+def templates_last_modified(app):
+    """
+    Función que devuelve la fecha de la plantilla modificada más recientemente
+
+    Returns:
+        Función sin argumentos para usar como `last_modified` en cache_policy
+    """
+    def last_modified():
+        folder = os.path.join(app.root_path, app.template_folder)
+        try:
+            mtimes = [entry.stat().st_mtime for entry in os.scandir(folder) if entry.is_file()]
+        except OSError:
+            return None
+        return max(mtimes) if mtimes else None
+    return last_modified
+
+
+def init_cache_policy(app, default_no_store=False):
+    """
+    Registrar la política por defecto para las rutas sin política explícita
+
+    Args:
+        app: Aplicación de Flask
+        default_no_store: Si es True (DISABLE_CACHE), las respuestas sin
+            Cache-Control reciben no-store. Los archivos estáticos nunca.
+    """
+    if not default_no_store:
+        return
+
+    @app.after_request
+    def add_default_cache_policy(response):
+        if request.endpoint in STATIC_ENDPOINTS or 'Cache-Control' in response.headers:
+            return response
+        return apply_cache_policy(response, POLICY_NO_STORE)
@@ -1,13 +1,12 @@
 # Standard library imports
 import datetime
-import os.path
 from collections import defaultdict
-import json
+import time
 
 # Third-party imports
 import pytz
 from dateutil.relativedelta import relativedelta, MO
-import os
+from loguru import logger
 
 # Importar tzlocal si está disponible
 try:
@@ -17,90 +16,204 @@ except ImportError:
     TZLOCAL_AVAILABLE = False
 
 # Local application imports
-from config_utils import clean_env_value
-from auth_utils import (
-    get_authorization_url,
-    complete_oauth_flow, 
-    credentials_to_dict,
-    authenticate_google_calendar
-)
+from logging_utils import event_error_sampler
+from metrics_utils import stage_timer, observe_stage, record_pages
+from auth_utils import authenticate_google_calendar
+from event_index_utils import EventIndex
 from calendar_utils import (
     parse_datetime_api,
-    format_timedelta,
     assign_service
 )
 
-# --- Google API Libraries ---
-from googleapiclient.discovery import build
-
 # --- FUNCIONES PRINCIPALES ---
 
-def get_calendar_timezone(service):
-    """Obtener zona horaria del calendario del usuario"""
+def set_request_timeout(service, seconds):
+    """Aplicar un timeout (en segundos) a las siguientes llamadas del servicio"""
+    http = getattr(service, '_http', None)
+    # google_auth_httplib2.AuthorizedHttp envuelve un httplib2.Http
+    http = getattr(http, 'http', http)
+    if http is None or not hasattr(http, 'timeout'):
+        return
+
+    http.timeout = seconds
+    # Las conexiones ya abiertas conservan el timeout con el que se crearon
+    for conn in list(getattr(http, 'connections', {}).values()):
+        conn.timeout = seconds
+        if getattr(conn, 'sock', None) is not None:
+            conn.sock.settimeout(seconds)
+
+def fallback_timezone():
+    """Zona horaria de respaldo si Google no devuelve la del calendario: la local o UTC"""
+    if TZLOCAL_AVAILABLE:
+        try:
+            local_tz_name = tzlocal.get_localzone_name()
+            return pytz.timezone(local_tz_name)
+        except Exception as e:
+            logger.error(f"Error al obtener zona horaria local: {e}")
+    return pytz.utc
+
+def fetch_calendar_timezone(service, deadline=None):
+    """
+    Obtener zona horaria del calendario del usuario indicando su origen
+
+    Args:
+        service: Servicio de Google Calendar
+        deadline: Plazo de la petición (opcional)
+
+    Returns:
+        Tuple (zona horaria pytz, True si la devolvió Google). Si Google no
+        responde se usa la zona local o UTC, que sirve para mostrar un resultado
+        pero no para consolidarlo. La zona es None si se agotó el plazo.
+    """
     try:
-        settings = service.settings().get(setting='timezone').execute()
-        return pytz.timezone(settings['value'])
+        if deadline is not None:
+            set_request_timeout(service, deadline.call_timeout())
+        with stage_timer('timezone'):
+            settings = service.settings().get(setting='timezone').execute()
+        return pytz.timezone(settings['value']), True
     except Exception as e:
-        print(f"Error al obtener zona horaria del calendario: {e}")
-        # Fallback a zona horaria local o UTC
-        if TZLOCAL_AVAILABLE:
-            try:
-                local_tz_name = tzlocal.get_localzone_name()
-                return pytz.timezone(local_tz_name)
-            except Exception as e:
-                print(f"Error al obtener zona horaria local: {e}")
-                pass
-        return pytz.utc
+        logger.error(f"Error al obtener zona horaria del calendario: {e}")
+        if deadline is not None and (deadline.expired() or isinstance(e, TimeoutError)):
+            return None, False
+        return fallback_timezone(), False
 
-def get_events(service, start_date, end_date, timezone):
-    """Obtener eventos del calendario en el rango de fechas especificado"""
+def get_calendar_timezone(service, deadline=None):
+    """
+    Obtener zona horaria del calendario del usuario
+
+    Args:
+        service: Servicio de Google Calendar
+        deadline: Plazo de la petición (opcional)
+
+    Returns:
+        Zona horaria pytz (la local o UTC si Google no la devuelve), o None si
+        se agotó el plazo: Google no respondió y la zona local no es fiable
+    """
+    timezone, _ = fetch_calendar_timezone(service, deadline)
+    return timezone
+
+def _last_complete_day(events, start_date, timezone):
+    """Último día cuyos eventos se obtuvieron por completo (los eventos llegan ordenados por inicio)"""
+    if not events:
+        return start_date - datetime.timedelta(days=1)
+    last_start, _ = parse_datetime_api(events[-1].get('start'))
+    if not last_start:
+        return start_date - datetime.timedelta(days=1)
+    # Del día del último evento recibido podrían faltar eventos
+    return last_start.astimezone(timezone).date() - datetime.timedelta(days=1)
+
+def last_complete_week_end(complete_until):
+    """Último domingo cuya semana está completa hasta la fecha indicada (inclusive)"""
+    week_start = complete_until + relativedelta(weekday=MO(-1))
+    week_end = week_start + datetime.timedelta(days=6)
+    if week_end <= complete_until:
+        return week_end
+    return week_start - datetime.timedelta(days=1)
+
+def get_events_until_deadline(service, start_date, end_date, timezone, deadline=None):
+    """
+    Obtener eventos del calendario respetando un plazo máximo
+
+    Returns:
+        Tuple (eventos, completo_hasta) donde completo_hasta es None si se
+        obtuvo todo el rango, o la última fecha con datos completos si se
+        agotó el plazo. Devuelve None si hay un error.
+    """
     try:
         time_min = timezone.localize(datetime.datetime.combine(start_date, datetime.time.min)).isoformat()
         time_max = timezone.localize(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)).isoformat()
     except Exception as e:
-        print(f"Error con fechas: {e}")
+        logger.error(f"Error con fechas: {e}")
         return None
-        
+
     all_events = []
     page_token = None
-    
+    pages = 0
+
     while True:
+        if deadline is not None:
+            if deadline.expired():
+                record_pages(pages)
+                return all_events, _last_complete_day(all_events, start_date, timezone)
+            set_request_timeout(service, deadline.call_timeout())
         try:
-            events_result = service.events().list(
-                calendarId='primary', timeMin=time_min, timeMax=time_max,
-                singleEvents=True, orderBy='startTime', pageToken=page_token,
-                maxResults=2500
-            ).execute()
+            pages += 1
+            with stage_timer('events_page'):
+                events_result = service.events().list(
+                    calendarId='primary', timeMin=time_min, timeMax=time_max,
+                    singleEvents=True, orderBy='startTime', pageToken=page_token,
+                    maxResults=2500
+                ).execute()
             events = events_result.get('items', [])
             all_events.extend(events)
             page_token = events_result.get('nextPageToken')
             if not page_token:
                 break
         except Exception as e:
-            print(f'Error obteniendo eventos: {e}')
+            if deadline is not None and deadline.expired():
+                logger.warning(f'Plazo agotado obteniendo eventos: {e}')
+                record_pages(pages)
+                return all_events, _last_complete_day(all_events, start_date, timezone)
+            logger.error(f'Error obteniendo eventos: {e}')
             return None
-            
-    return all_events
 
-def calculate_weekly_summary(events, start_date, end_date, timezone, work_start_time, work_end_time, work_days, config=None):
-    """Calcular resumen semanal de tiempo por servicio"""
-    # Verificar que la configuración no sea None
+    record_pages(pages)
+    return all_events, None
+
+def get_events(service, start_date, end_date, timezone, deadline=None):
+    """Obtener eventos del calendario en el rango de fechas especificado"""
+    result = get_events_until_deadline(service, start_date, end_date, timezone, deadline)
+    if result is None:
+        return None
+
+    events, complete_until = result
+    if complete_until is not None:
+        # El rango no se completó dentro del plazo
+        return None
+    return events
+
+def fetch_calendar_snapshot(credentials_dict, start_date, end_date):
+    """
+    Obtener zona horaria y eventos completos de un rango, pensado para
+    ejecutarse en segundo plano fuera de la petición HTTP
+
+    Returns:
+        Diccionario serializable con el rango, la zona horaria (y si es la
+        local por no haber respondido Google) y los eventos
+    """
+    service, _ = authenticate_google_calendar(credentials_dict)
+    if not service:
+        raise RuntimeError("Credenciales no válidas para Google Calendar")
+
+    timezone, from_google = fetch_calendar_timezone(service)
+    events = get_events(service, start_date, end_date, timezone)
+    if events is None:
+        raise RuntimeError(f"Error al obtener eventos para el rango {start_date} - {end_date}")
+
+    return {
+        'range': [start_date.isoformat(), end_date.isoformat()],
+        'timezone': timezone.zone,
+        'timezone_fallback': not from_google,
+        'events': events
+    }
+
+def parse_events(events, timezone, config=None):
+    """
+    Convertir los eventos de la API en eventos con fechas locales y servicio asignado
+
+    Args:
+        events: Eventos tal como los devuelve Google Calendar
+        timezone: Zona horaria del calendario
+        config: Configuración del usuario (para assign_service)
+
+    Returns:
+        Lista de diccionarios con id, summary, start, end, is_all_day y service
+    """
     if config is None:
         config = {}
-    
-    # Configuración de lunch
-    lunch_duration = config.get('lunch_duration_minutes', 60)
-    try:
-        lunch_duration = int(lunch_duration)
-    except (ValueError, TypeError):
-        lunch_duration = 60
-    
-    weekly_totals = defaultdict(lambda: defaultdict(datetime.timedelta))
-    current_date = start_date
-    lunch_delta = datetime.timedelta(minutes=lunch_duration)
 
-    # Preparar eventos
     parsed_events = []
+    assign_seconds = 0.0
     for event in events:
         start_dt_api, start_is_all_day = parse_datetime_api(event.get('start'))
         end_dt_api, end_is_all_day = parse_datetime_api(event.get('end'))
@@ -111,80 +224,136 @@ def calculate_weekly_summary(events, start_date, end_date, timezone, work_start_
             start_dt = start_dt_api.astimezone(timezone)
             end_dt = end_dt_api.astimezone(timezone)
         except Exception as e:
-            print(f"Error al convertir zona horaria: {e}, evento: {event.get('summary', 'Sin título')}")
+            event_error_sampler.log('timezone_conversion', f"Error al convertir zona horaria: {e}",
+                                    event=event.get('summary', 'Sin título'))
             continue
             
         if start_is_all_day and end_dt.time() == datetime.time.min and end_dt.date() > start_dt.date():
             end_dt = end_dt - datetime.timedelta(seconds=1)
 
+        # assign_service se mide en conjunto: un temporizador por evento costaría más que la propia llamada
+        assign_start = time.perf_counter()
+        service = assign_service(event, config)
+        assign_seconds += time.perf_counter() - assign_start
+
         parsed_events.append({
+            'id': event.get('id'),
             'summary': event.get('summary', 'N/A'),
             'start': start_dt,
             'end': end_dt,
             'is_all_day': start_is_all_day,
-            'service': assign_service(event, config)
+            'service': service
         })
 
+    observe_stage('assign_service', assign_seconds)
+    return parsed_events
+
+def summarize_days(parsed_events, start_date, end_date, timezone, work_start_time, work_end_time, work_days, config=None):
+    """
+    Calcular el tiempo laborable y el tiempo reservado por servicio de cada día
+
+    parsed_events puede ser una lista o un EventIndex (que puede cubrir un
+    rango mayor): cada día solo se recorren los eventos que lo ocupan.
+
+    Returns:
+        Diccionario {día: (tiempo laborable, {servicio: timedelta})} con todos los días del rango
+    """
+    # Verificar que la configuración no sea None
+    if config is None:
+        config = {}
+    
+    # Configuración de lunch
+    lunch_duration = config.get('lunch_duration_minutes', 60)
+    try:
+        lunch_duration = int(lunch_duration)
+    except (ValueError, TypeError):
+        lunch_duration = 60
+    
+    if not isinstance(parsed_events, EventIndex):
+        parsed_events = EventIndex(parsed_events)
+    ooo_service = config.get('ooo_service', '')
+    lunch_delta = datetime.timedelta(minutes=lunch_duration)
+    daily_totals = {}
+
+    temp_date = start_date
+    while temp_date <= end_date:
+        # Calcular horas laborales del día
+        daily_work_start_dt, daily_work_end_dt = None, None
+        daily_potential_time = datetime.timedelta()
+        booked = defaultdict(datetime.timedelta)
+        is_work_day = temp_date.weekday() in work_days
+        
+        if is_work_day:
+            try:
+                daily_work_start_dt = timezone.localize(datetime.datetime.combine(temp_date, work_start_time))
+                daily_work_end_dt = timezone.localize(datetime.datetime.combine(temp_date, work_end_time))
+                daily_potential_time = (daily_work_end_dt - daily_work_start_dt) - lunch_delta
+                if daily_potential_time < datetime.timedelta(0):
+                    daily_potential_time = datetime.timedelta(0)
+            except Exception as e:
+                event_error_sampler.log('work_hours', f"Error al calcular horas laborales del día {temp_date}: {e}")
+                daily_potential_time = datetime.timedelta()
+                is_work_day = False
+
+        # Procesar eventos que solapan con el día
+        for event_data in parsed_events.on_day(temp_date):
+            start_dt, end_dt = event_data['start'], event_data['end']
+            service, is_all_day = event_data['service'], event_data['is_all_day']
+
+            if is_all_day:
+                if service == ooo_service and is_work_day and daily_work_start_dt and daily_work_end_dt:
+                    booked[service] += daily_work_end_dt - daily_work_start_dt
+                continue  # Ignorar otros all-day
+
+            if not is_work_day:
+                continue  # Ignorar eventos con hora en días no laborables
+
+            if not daily_work_start_dt or not daily_work_end_dt:
+                continue
+
+            overlap_start = max(start_dt, daily_work_start_dt)
+            overlap_end = min(end_dt, daily_work_end_dt)
+            duration = datetime.timedelta(0)
+            if overlap_end > overlap_start:
+                duration = overlap_end - overlap_start
+
+            if duration > datetime.timedelta(seconds=1):
+                booked[service] += duration
+
+        daily_totals[temp_date] = (daily_potential_time, dict(booked))
+        temp_date += datetime.timedelta(days=1)
+
+    return daily_totals
+
+def summarize_weeks(daily_totals, start_date, end_date, config=None):
+    """
+    Agrupar por semanas el tiempo de cada día y asignar el tiempo libre al servicio predeterminado
+
+    Args:
+        daily_totals: Resultado de summarize_days; debe incluir todos los días del rango
+    """
+    if config is None:
+        config = {}
+    default_service = config.get('default_service', '')
+    
+    weekly_totals = defaultdict(lambda: defaultdict(datetime.timedelta))
+    current_date = start_date
+
     # Bucle por semanas
     while current_date <= end_date:
         week_start = current_date + relativedelta(weekday=MO(-1))
         week_end = week_start + datetime.timedelta(days=6)
-        actual_week_start_day = max(week_start, start_date)
-        actual_week_end_day = min(week_end, end_date)
         total_potential_work_time_week = datetime.timedelta()
         total_booked_time_week = datetime.timedelta()
 
         # Bucle por días de la semana
-        temp_date = actual_week_start_day
-        while temp_date <= actual_week_end_day:
-            # Calcular horas laborales del día
-            daily_work_start_dt, daily_work_end_dt = None, None
-            is_work_day = temp_date.weekday() in work_days
-            
-            if is_work_day:
-                try:
-                    daily_work_start_dt = timezone.localize(datetime.datetime.combine(temp_date, work_start_time))
-                    daily_work_end_dt = timezone.localize(datetime.datetime.combine(temp_date, work_end_time))
-                    daily_potential_time = (daily_work_end_dt - daily_work_start_dt) - lunch_delta
-                    if daily_potential_time < datetime.timedelta(0):
-                        daily_potential_time = datetime.timedelta(0)
-                    total_potential_work_time_week += daily_potential_time
-                except Exception as e:
-                    print(f"Error al calcular horas laborales del día {temp_date}: {e}")
-                    is_work_day = False
-
-            # Procesar eventos que solapan con el día
-            for event_data in parsed_events:
-                start_dt, end_dt = event_data['start'], event_data['end']
-                service, is_all_day = event_data['service'], event_data['is_all_day']
-
-                # Valores desde la configuración
-                ooo_service = config.get('ooo_service', '')
-
-                if start_dt.date() <= temp_date <= end_dt.date():
-                    if is_all_day:
-                        if service == ooo_service and is_work_day and daily_work_start_dt and daily_work_end_dt:
-                            duration = daily_work_end_dt - daily_work_start_dt
-                            weekly_totals[week_start][service] += duration
-                            total_booked_time_week += duration
-                        continue  # Ignorar otros all-day
-
-                    if not is_work_day:
-                        continue  # Ignorar eventos con hora en días no laborables
-
-                    if not daily_work_start_dt or not daily_work_end_dt:
-                        continue
-
-                    overlap_start = max(start_dt, daily_work_start_dt)
-                    overlap_end = min(end_dt, daily_work_end_dt)
-                    duration = datetime.timedelta(0)
-                    if overlap_end > overlap_start:
-                        duration = overlap_end - overlap_start
-
-                    if duration > datetime.timedelta(seconds=1):
-                        weekly_totals[week_start][service] += duration
-                        total_booked_time_week += duration
-
+        temp_date = current_date
+        while temp_date <= min(week_end, end_date):
+            daily_potential_time, booked = daily_totals[temp_date]
+            total_potential_work_time_week += daily_potential_time
+            for service, duration in booked.items():
+                weekly_totals[week_start][service] += duration
+                total_booked_time_week += duration
             temp_date += datetime.timedelta(days=1)
 
         # Tiempo libre para esta semana
@@ -193,10 +362,50 @@ def calculate_weekly_summary(events, start_date, end_date, timezone, work_start_
             free_time_week = datetime.timedelta(0)
         
         # Asignar tiempo libre al servicio predeterminado
-        default_service = config.get('default_service', '')
         if free_time_week > datetime.timedelta(seconds=1) and default_service:
             weekly_totals[week_start][default_service] += free_time_week
 
         current_date = week_end + datetime.timedelta(days=1)
 
-    return weekly_totals
\ No newline at end of file
+    return weekly_totals
+
+def summarize_parsed_events(parsed_events, start_date, end_date, timezone, work_start_time, work_end_time, work_days, config=None):
+    """Calcular resumen semanal de tiempo por servicio a partir de eventos ya parseados (lista o EventIndex)"""
+    daily_totals = summarize_days(
+        parsed_events, start_date, end_date, timezone, work_start_time, work_end_time, work_days, config
+    )
+    return summarize_weeks(daily_totals, start_date, end_date, config)
+
+def calculate_weekly_summary(events, start_date, end_date, timezone, work_start_time, work_end_time, work_days, config=None):
+    """Calcular resumen semanal de tiempo por servicio"""
+    with stage_timer('parse'):
+        parsed_events = parse_events(events, timezone, config)
+    with stage_timer('weekly_summary'):
+        return summarize_parsed_events(
+            parsed_events, start_date, end_date, timezone,
+            work_start_time, work_end_time, work_days, config
+        )
+
+def extend_event_index(service, index, start_date, end_date, timezone, config=None, deadline=None):
+    """
+    Ampliar el índice de un usuario obteniendo de Google solo los días que faltan
+
+    Returns:
+        EventIndex que cubre el rango, o None si el rango no es contiguo al del
+        índice o algún tramo no pudo obtenerse por completo (en ese caso debe
+        obtenerse el rango entero)
+    """
+    if index.timezone != timezone.zone:
+        return None
+    missing = index.missing_ranges(start_date, end_date)
+    if missing is None:
+        return None
+
+    for missing_start, missing_end in missing:
+        with stage_timer('events'):
+            result = get_events_until_deadline(service, missing_start, missing_end, timezone, deadline)
+        if result is None or result[1] is not None:
+            return None
+        with stage_timer('parse'):
+            index = index.extend(parse_events(result[0], timezone, config), missing_start, missing_end)
+    return index
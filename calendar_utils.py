@@ -7,6 +7,17 @@ import datetime
 import pytz
 from collections import defaultdict
 
+# Local imports
+from logging_utils import event_error_sampler
+
+# Paleta de colores de evento de Google Calendar (colors().get()['event']): colorId -> (fondo, texto)
+GOOGLE_EVENT_COLORS = {
+    '1': ('#a4bdfc', '#1d1d1d'), '2': ('#7ae7bf', '#1d1d1d'), '3': ('#dbadff', '#1d1d1d'),
+    '4': ('#ff887c', '#1d1d1d'), '5': ('#fbd75b', '#1d1d1d'), '6': ('#ffb878', '#1d1d1d'),
+    '7': ('#46d6db', '#1d1d1d'), '8': ('#e1e1e1', '#1d1d1d'), '9': ('#5484ed', '#1d1d1d'),
+    '10': ('#51b749', '#1d1d1d'), '11': ('#dc2127', '#1d1d1d'),
+}
+
 def parse_datetime_api(dt_obj):
     """
     Parsear objeto datetime de la API de Google Calendar
@@ -36,7 +47,7 @@ def parse_datetime_api(dt_obj):
             
         return dt, is_all_day
     except Exception as e:
-        print(f"Error al parsear fecha: {e}, objeto: {dt_obj}")
+        event_error_sampler.log('parse_datetime', f"Error al parsear fecha: {e}", value=str(dt_obj))
         return None, False
 
 def format_timedelta(td):
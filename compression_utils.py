@@ -0,0 +1,202 @@
+"""
+Middleware WSGI de compresión de respuestas.
+Comprime con brotli (si está instalado) o gzip las respuestas HTML, JSON y
+de texto que superan un tamaño mínimo. Las respuestas sin Content-Length
+(streaming) se comprimen por fragmentos, vaciando el compresor en cada uno
+para que el navegador reciba los datos en cuanto se generan.
+"""
+
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.wsgi import ClosingIterator
+
+# Importar brotli si está disponible
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Tipos de contenido que se comprimen
+COMPRESSIBLE_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/csv',
+    'application/json',
+)
+
+# Códigos de estado sin cuerpo o con cuerpo que no se debe transformar
+_SKIP_STATUS = (204, 206, 304)
+
+
+def parse_accept_encoding(value):
+    """
+    Obtener las codificaciones aceptadas por el cliente
+
+    Returns:
+        Conjunto de codificaciones con calidad mayor que cero
+    """
+    accepted = set()
+    for item in (value or '').split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, number = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name)
+    return accepted
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits=31: formato gzip (cabecera y CRC)
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        output = self._compressor.compress(data)
+        if flush:
+            output += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return output
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        # Calidad 4-5 equivale en velocidad a gzip nivel 6 y comprime más
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data, flush=False):
+        output = self._compressor.process(data)
+        if flush:
+            output += self._compressor.flush()
+        return output
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Middleware WSGI que comprime las respuestas según Accept-Encoding
+
+    Args:
+        app: Aplicación WSGI
+        min_size: Tamaño mínimo en bytes para comprimir respuestas con Content-Length
+        level: Nivel de compresión gzip (1-9)
+        brotli_quality: Calidad de brotli (0-11)
+    """
+
+    def __init__(self, app, min_size=500, level=6, brotli_quality=5):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, environ):
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if BROTLI_AVAILABLE and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def _new_compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.level)
+
+    @staticmethod
+    def _is_compressible(status, headers):
+        if int(status.split(' ', 1)[0]) in _SKIP_STATUS:
+            return False
+        if 'Content-Encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def __call__(self, environ, start_response):
+        captured = {}
+        written = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return written.append
+
+        app_iter = self.app(environ, capture_start_response)
+        status = captured['status']
+        headers = Headers(captured['headers'])
+        body = written + [app_iter] if written else [app_iter]
+
+        def chained():
+            for part in body:
+                if isinstance(part, bytes):
+                    yield part
+                else:
+                    yield from part
+
+        if not self._is_compressible(status, headers):
+            start_response(status, headers.to_wsgi_list(), captured['exc_info'])
+            return app_iter if not written else ClosingIterator(chained(), getattr(app_iter, 'close', None))
+
+        self._add_vary(headers)
+        encoding = self._choose_encoding(environ)
+        content_length = headers.get('Content-Length', type=int)
+        if (encoding is None or environ.get('REQUEST_METHOD') == 'HEAD'
+                or (content_length is not None and content_length < self.min_size)):
+            start_response(status, headers.to_wsgi_list(), captured['exc_info'])
+            return ClosingIterator(chained(), getattr(app_iter, 'close', None))
+
+        headers['Content-Encoding'] = encoding
+        headers.pop('Accept-Ranges', None)
+        # El ETag identifica la representación sin comprimir: pasa a ser débil
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = f"W/{etag}"
+
+        compressor = self._new_compressor(encoding)
+
+        if content_length is not None:
+            # Respuesta completa en memoria: comprimir de una vez
+            try:
+                data = compressor.compress(b''.join(chained())) + compressor.finish()
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            headers['Content-Length'] = str(len(data))
+            start_response(status, headers.to_wsgi_list(), captured['exc_info'])
+            return [data]
+
+        # Streaming: comprimir y vaciar cada fragmento
+        headers.pop('Content-Length', None)
+        start_response(status, headers.to_wsgi_list(), captured['exc_info'])
+
+        def compressed():
+            for chunk in chained():
+                if chunk:
+                    data = compressor.compress(chunk, flush=True)
+                    if data:
+                        yield data
+            yield compressor.finish()
+
+        return ClosingIterator(compressed(), getattr(app_iter, 'close', None))
+
+    @staticmethod
+    def _add_vary(headers):
+        values = [value.strip() for value in headers.get('Vary', '').split(',') if value.strip()]
+        if 'Accept-Encoding' not in values and '*' not in values:
+            headers['Vary'] = ', '.join(values + ['Accept-Encoding'])
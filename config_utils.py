@@ -4,7 +4,9 @@ Este módulo contiene funciones para limpiar valores de variables de entorno,
 y gestionar la configuración de la aplicación.
 """
 
+import os
 import json
+import hashlib
 from datetime import time
 from loguru import logger
 
@@ -25,6 +27,29 @@ def clean_env_value(value):
             return value.split('#')[0].strip()
     return value
 
+# Función para leer variables de entorno numéricas o booleanas
+def get_env_value(name, default, cast=str):
+    """
+    Lee una variable de entorno, limpia comentarios y la convierte al tipo indicado.
+    
+    Args:
+        name: Nombre de la variable de entorno
+        default: Valor a devolver si la variable no existe o no es válida
+        cast: Función de conversión (int, float, bool, str...)
+        
+    Returns:
+        El valor convertido o el valor por defecto
+    """
+    value = clean_env_value(os.getenv(name))
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        return value.strip().lower() in ('true', 'yes', '1')
+    try:
+        return cast(value.strip())
+    except (TypeError, ValueError):
+        return default
+
 # Función para obtener configuración predeterminada
 def get_default_config():
     """
@@ -70,7 +95,8 @@ def validate_config(config_data):
         if isinstance(config_data, str):
             config = json.loads(config_data)
         else:
-            config = config_data
+            # Copia: la configuración recibida puede estar compartida (p. ej. entre trabajos de un lote)
+            config = dict(config_data)
         
         # Verificar que existan todas las claves necesarias sin reemplazarlas
         default_config = get_default_config()
@@ -87,4 +113,19 @@ def validate_config(config_data):
         return get_default_config()
     except Exception as e:
         logger.error(f"Error inesperado al procesar configuración: {e}")
-        return get_default_config() 
\ No newline at end of file
+        return get_default_config()
+
+# Función para identificar una configuración en cachés y almacenes
+def config_fingerprint(config):
+    """
+    Huella estable de una configuración: cambia si cambia cualquier valor
+    (y con él la asignación de servicios o las horas de trabajo)
+    
+    Args:
+        config: Diccionario de configuración
+        
+    Returns:
+        Cadena hexadecimal de 16 caracteres
+    """
+    canonical = json.dumps(config or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,219 @@
+"""
+Utilidades de indexación de eventos por intervalo de fechas.
+Un EventIndex guarda los eventos ya parseados (ver parse_events) ordenados por
+su primer día local en un árbol de intervalos implícito: cada nodo conoce el
+último día que alcanza su subárbol, de modo que "eventos que solapan [a, b)"
+cuesta O(log n + k) en lugar de recorrer todos los eventos.
+
+summarize_parsed_events consulta el índice día a día, y /calculate guarda el
+índice de cada usuario durante EVENT_INDEX_TTL segundos: si el usuario acota o
+desplaza el rango solo se consultan (o se obtienen de Google) los días que
+faltan, sin volver a clasificar todos los eventos. Los resultados calculados
+desde el índice indican cuándo se obtuvieron sus eventos y permiten volver a
+pedirlos a Google.
+"""
+
+import time
+import datetime
+
+# Local imports
+from config_utils import get_env_value, config_fingerprint
+from resilience_utils import StaleCache
+
+# Segundos durante los que se reutiliza el índice de un usuario (0 lo desactiva)
+EVENT_INDEX_TTL = get_env_value('EVENT_INDEX_TTL', 300, int)
+
+# Días máximos cubiertos por un índice al ampliarlo con rangos contiguos
+EVENT_INDEX_MAX_DAYS = get_env_value('EVENT_INDEX_MAX_DAYS', 731, int)
+
+# Índices por (usuario, huella de la configuración), en memoria de cada worker
+event_index_cache = StaleCache(max_entries=get_env_value('EVENT_INDEX_MAX_ENTRIES', 64, int))
+
+_ONE_DAY = datetime.timedelta(days=1)
+
+
+class EventIndex:
+    """
+    Índice inmutable de eventos parseados por días locales.
+
+    Cada evento ocupa los días [start.date(), end.date()] (el mismo criterio
+    que summarize_parsed_events). Las consultas devuelven los eventos en el
+    orden en que se añadieron.
+    """
+
+    def __init__(self, parsed_events=(), start_date=None, end_date=None, timezone=None, fetched_at=None):
+        """
+        Args:
+            parsed_events: Eventos con start y end (datetimes locales)
+            start_date: Primer día del rango del que se obtuvieron los eventos
+            end_date: Último día del rango (inclusive)
+            timezone: Nombre de la zona horaria de los eventos
+            fetched_at: Timestamp en que se obtuvieron de Google los eventos más antiguos (por defecto, ahora)
+        """
+        self.events = list(parsed_events)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.timezone = timezone
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+        # Intervalos [primer día, último día + 1) como ordinales, ordenados por inicio
+        intervals = sorted(
+            (event['start'].date().toordinal(), event['end'].date().toordinal() + 1, position)
+            for position, event in enumerate(self.events)
+        )
+        self._first = [interval[0] for interval in intervals]
+        self._stop = [interval[1] for interval in intervals]
+        self._positions = [interval[2] for interval in intervals]
+        self._max_stop = [0] * len(intervals)
+        self._build(0, len(intervals))
+
+    def _build(self, low, high):
+        """Calcular el mayor fin del subárbol con raíz en el punto medio de [low, high)"""
+        if low >= high:
+            return 0
+        mid = (low + high) // 2
+        self._max_stop[mid] = max(self._stop[mid], self._build(low, mid), self._build(mid + 1, high))
+        return self._max_stop[mid]
+
+    def __len__(self):
+        return len(self.events)
+
+    def overlapping(self, start, end):
+        """
+        Eventos que ocupan algún día de [start, end)
+
+        Args:
+            start: Primer día (datetime.date)
+            end: Día siguiente al último (no incluido)
+
+        Returns:
+            Lista de eventos en el orden original
+        """
+        first, stop = start.toordinal(), end.toordinal()
+        pending = [(0, len(self._first))]
+        found = []
+        while pending:
+            low, high = pending.pop()
+            if low >= high:
+                continue
+            mid = (low + high) // 2
+            if self._max_stop[mid] <= first:
+                continue  # Ningún evento del subárbol llega a `start`
+            pending.append((low, mid))
+            # Los eventos a la derecha empiezan igual o más tarde
+            if self._first[mid] < stop:
+                if self._stop[mid] > first:
+                    found.append(self._positions[mid])
+                pending.append((mid + 1, high))
+        found.sort()
+        return [self.events[position] for position in found]
+
+    def on_day(self, day):
+        """Eventos que ocupan el día indicado"""
+        return self.overlapping(day, day + _ONE_DAY)
+
+    def covers(self, start_date, end_date):
+        """Indicar si el índice contiene todos los eventos del rango (inclusive)"""
+        return (self.start_date is not None and self.end_date is not None
+                and self.start_date <= start_date and end_date <= self.end_date)
+
+    def missing_ranges(self, start_date, end_date):
+        """
+        Rangos que faltan para cubrir [start_date, end_date] manteniendo el índice contiguo
+
+        Returns:
+            Lista de tuplas (inicio, fin) inclusive (vacía si ya está cubierto),
+            o None si el rango no toca el del índice o lo ampliaría por encima
+            de EVENT_INDEX_MAX_DAYS
+        """
+        if self.start_date is None or self.end_date is None:
+            return None
+        if end_date < self.start_date - _ONE_DAY or start_date > self.end_date + _ONE_DAY:
+            return None
+        if (max(end_date, self.end_date) - min(start_date, self.start_date)).days + 1 > EVENT_INDEX_MAX_DAYS:
+            return None
+
+        missing = []
+        if start_date < self.start_date:
+            missing.append((start_date, self.start_date - _ONE_DAY))
+        if end_date > self.end_date:
+            missing.append((self.end_date + _ONE_DAY, end_date))
+        return missing
+
+    def extend(self, parsed_events, start_date, end_date):
+        """
+        Nuevo índice con los eventos de un rango contiguo añadidos
+
+        Los eventos que cruzan el límite entre rangos llegan en ambas consultas
+        a Google: se descartan los que ya estaban (por id). El índice nuevo
+        conserva fetched_at: sus eventos más antiguos siguen siendo los de este.
+        """
+        known = {event.get('id') for event in self.events if event.get('id')}
+        added = [event for event in parsed_events if not event.get('id') or event['id'] not in known]
+        return EventIndex(
+            self.events + added,
+            min(start_date, self.start_date) if self.start_date else start_date,
+            max(end_date, self.end_date) if self.end_date else end_date,
+            self.timezone,
+            self.fetched_at
+        )
+
+    def to_dict(self):
+        """Representación serializable a JSON (fechas en ISO 8601)"""
+        return {
+            'range': [self.start_date.isoformat() if self.start_date else None,
+                      self.end_date.isoformat() if self.end_date else None],
+            'timezone': self.timezone,
+            'fetched_at': self.fetched_at,
+            'events': [
+                dict(event, start=event['start'].isoformat(), end=event['end'].isoformat())
+                for event in self.events
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data, timezone=None):
+        """
+        Reconstruir un índice guardado con to_dict
+
+        Args:
+            data: Diccionario de to_dict
+            timezone: Zona horaria pytz a la que convertir las fechas (opcional)
+        """
+        def _parse(value):
+            parsed = datetime.datetime.fromisoformat(value)
+            return parsed.astimezone(timezone) if timezone else parsed
+
+        start_date, end_date = (datetime.date.fromisoformat(value) if value else None for value in data['range'])
+        events = [
+            dict(event, start=_parse(event['start']), end=_parse(event['end']))
+            for event in data['events']
+        ]
+        return cls(events, start_date, end_date, data.get('timezone'), data.get('fetched_at'))
+
+
+def get_event_index(user_key, config):
+    """
+    Índice reciente de un usuario para una configuración
+
+    Returns:
+        EventIndex o None si no hay uno cuyos eventos se obtuvieran hace menos de EVENT_INDEX_TTL
+    """
+    if not EVENT_INDEX_TTL or not user_key:
+        return None
+    index, _ = event_index_cache.get((user_key, config_fingerprint(config)))
+    if index is None or time.time() - index.fetched_at > EVENT_INDEX_TTL:
+        return None
+    return index
+
+
+def store_event_index(user_key, config, index):
+    """Guardar el índice de un usuario (solo con rangos obtenidos por completo)"""
+    if EVENT_INDEX_TTL and user_key:
+        event_index_cache.set((user_key, config_fingerprint(config)), index)
+
+
+def drop_event_indexes(user_key):
+    """Eliminar los índices de un usuario para todas sus configuraciones (al cerrar sesión)"""
+    if user_key:
+        event_index_cache.delete_matching(lambda key: key[0] == user_key)
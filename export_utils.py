@@ -0,0 +1,169 @@
+"""
+Utilidades para exportar informes a CSV y XLSX.
+Las filas se generan a partir del resumen guardado (duraciones en segundos) y
+los archivos se envían en streaming a medida que se producen, sin construir
+el archivo completo en memoria.
+"""
+
+import io
+import csv
+import zipfile
+from collections import defaultdict
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+# Columnas de la exportación
+EXPORT_HEADER = ['tipo', 'inicio', 'fin', 'servicio', 'segundos', 'horas']
+
+# Tamaño mínimo de cada fragmento enviado
+EXPORT_CHUNK_SIZE = 8192
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def iter_export_rows(report):
+    """
+    Generar las filas de exportación de un informe guardado
+
+    Primero una fila por semana y servicio y, al final, los totales del
+    período por servicio (acumulados mientras se recorren las semanas).
+
+    Args:
+        report: Informe guardado por report_utils.save_report
+
+    Returns:
+        Generador de listas con los valores de EXPORT_HEADER
+    """
+    period_totals = defaultdict(float)
+    for week_start, services in report['weeks']:
+        week_end = (date.fromisoformat(week_start) + timedelta(days=6)).isoformat()
+        for service, seconds in sorted(services.items()):
+            period_totals[service] += seconds
+            yield ['semana', week_start, week_end, service, int(seconds), round(seconds / 3600, 2)]
+
+    start, end = report['range']
+    for service, seconds in sorted(period_totals.items(), key=lambda item: item[1], reverse=True):
+        yield ['periodo', start, end, service, int(seconds), round(seconds / 3600, 2)]
+
+
+def stream_csv(rows, header=EXPORT_HEADER):
+    """
+    Generar un CSV por fragmentos
+
+    Returns:
+        Generador de cadenas (la primera con BOM para que Excel detecte UTF-8)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino no posicionable para zipfile que acumula los bytes hasta recogerlos"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_workbook(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c t="n"><v>{value}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+def stream_xlsx(rows, header=EXPORT_HEADER, sheet_name='Horas'):
+    """
+    Generar una hoja de cálculo XLSX por fragmentos
+
+    El ZIP se escribe sobre un destino no posicionable (zipfile usa entonces
+    descriptores de datos), por lo que cada fragmento se envía en cuanto se
+    comprime, sin guardar el archivo completo.
+
+    Returns:
+        Generador de bytes
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _xlsx_workbook(sheet_name))
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(header).encode('utf-8'))
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                if sink.size >= EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
@@ -0,0 +1,503 @@
+"""
+Servidor falso de Google Calendar API para pruebas de carga.
+
+Reproduce un calendario grabado (ver `record`) o sintético (ver
+synthetic_calendar.py) con los endpoints que usa la aplicación: events.list
+con paginación y syncToken, settings, colors y calendarList, además de los
+endpoints OAuth de autorización y de tokens. Permite añadir latencia y errores
+aleatorios (429/500/503) para medir el comportamiento de cada despliegue sin
+llamar a Google.
+
+Uso:
+    python fake_calendar_server.py serve --synthetic 10000 --latency-ms 80 --error-rate 0.01
+    python fake_calendar_server.py serve --events eventos.json --port 8765
+    python fake_calendar_server.py record --credentials creds.json --start 2024-01-01 --end 2024-03-31 -o eventos.json
+
+La aplicación se apunta al servidor con:
+    GOOGLE_API_BASE_URL=http://127.0.0.1:8765/calendar/v3
+    GOOGLE_AUTH_URI=http://127.0.0.1:8765/o/oauth2/auth
+    GOOGLE_TOKEN_URI=http://127.0.0.1:8765/token
+    OAUTHLIB_INSECURE_TRANSPORT=1
+"""
+
+import sys
+import json
+import time
+import base64
+import bisect
+import random
+import secrets
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+
+import pytz
+
+# Local imports
+from calendar_utils import GOOGLE_EVENT_COLORS
+
+API_PREFIX = '/calendar/v3'
+
+# Límites de events.list en Google Calendar API
+DEFAULT_MAX_RESULTS = 250
+MAX_RESULTS_LIMIT = 2500
+
+# Motivo de error de Google para cada código inyectado
+ERROR_REASONS = {
+    429: 'rateLimitExceeded',
+    500: 'backendError',
+    503: 'backendError',
+}
+
+
+def load_calendar(path):
+    """
+    Leer un calendario grabado
+
+    Acepta el formato de synthetic_calendar.py y de `record` ({"timezone", "items"}),
+    las instantáneas de trabajos en segundo plano ({"timezone", "events"}) o una
+    lista de eventos.
+
+    Returns:
+        Tuple (eventos, zona horaria o None)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data, None
+    return data.get('items', data.get('events', [])), data.get('timezone')
+
+
+class FakeCalendar:
+    """
+    Estado del servidor falso: eventos indexados por inicio, tokens emitidos,
+    latencia y errores inyectados
+
+    Args:
+        events: Eventos con el formato de Google Calendar API
+        timezone: Zona horaria del calendario
+        latency_ms: Latencia media añadida a cada respuesta
+        jitter_ms: Desviación típica de la latencia
+        error_rate: Probabilidad de responder con un error a una llamada de la API
+        error_statuses: Códigos de error entre los que se elige
+        token_ttl: Validez en segundos de los access tokens emitidos
+        check_tokens: Rechazar con 401 los tokens desconocidos o caducados
+        seed: Semilla de la latencia y los errores
+    """
+
+    def __init__(self, events, timezone='Europe/Madrid', latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 error_statuses=(500, 503, 429), token_ttl=3600, check_tokens=True, seed=None):
+        self.timezone = timezone
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.token_ttl = token_ttl
+        self.check_tokens = check_tokens
+        self.sync_version = 1
+        self.stats = {'requests': 0, 'errors_injected': 0, 'tokens_issued': 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._index_events(events)
+
+    def _to_timestamp(self, value):
+        tz = pytz.timezone(self.timezone)
+        if 'dateTime' in value:
+            return datetime.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).timestamp()
+        day = datetime.date.fromisoformat(value['date'])
+        return tz.localize(datetime.datetime.combine(day, datetime.time.min)).timestamp()
+
+    def _index_events(self, events):
+        indexed = []
+        for event in events:
+            try:
+                indexed.append((self._to_timestamp(event['start']), self._to_timestamp(event['end']), event))
+            except (KeyError, ValueError):
+                continue
+        indexed.sort(key=lambda item: item[0])
+        self._starts = [item[0] for item in indexed]
+        self._events = indexed
+        # Duración máxima: acota la búsqueda de eventos que empiezan antes de timeMin
+        self._max_duration = max((end - start for start, end, _ in indexed), default=0)
+
+    # --- Latencia y errores ---
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                latency = self._rng.gauss(self.latency_ms, self.jitter_ms)
+            time.sleep(max(0.0, latency) / 1000)
+
+    def injected_error(self):
+        """Código de error a devolver o None"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.error_rate and self.error_statuses and self._rng.random() < self.error_rate:
+                self.stats['errors_injected'] += 1
+                return self._rng.choice(self.error_statuses)
+        return None
+
+    # --- OAuth ---
+
+    def issue_token(self, token=None):
+        """Emitir un access token (o dar por válido `token`) durante token_ttl segundos"""
+        token = token or f"fake-access-{secrets.token_urlsafe(16)}"
+        with self._lock:
+            self._tokens[token] = time.time() + self.token_ttl
+            self.stats['tokens_issued'] += 1
+        return token
+
+    def token_valid(self, token):
+        if not self.check_tokens:
+            return True
+        with self._lock:
+            expiry = self._tokens.get(token)
+        return expiry is not None and expiry > time.time()
+
+    # --- events.list ---
+
+    def sync_token(self):
+        return base64.urlsafe_b64encode(f"v{self.sync_version}".encode('ascii')).decode('ascii')
+
+    def list_events(self, time_min=None, time_max=None, page_token=None, max_results=DEFAULT_MAX_RESULTS,
+                    sync_token=None):
+        """
+        Página de events.list (singleEvents=True, orderBy=startTime)
+
+        Returns:
+            Tuple (código de estado, respuesta)
+        """
+        max_results = max(1, min(int(max_results or DEFAULT_MAX_RESULTS), MAX_RESULTS_LIMIT))
+
+        if sync_token is not None:
+            if sync_token != self.sync_token():
+                return 410, _error_body(410, 'fullSyncRequired', 'Sync token is no longer valid, a full sync is required.')
+            # El calendario grabado no cambia: una sincronización incremental no trae eventos
+            return 200, {'kind': 'calendar#events', 'timeZone': self.timezone, 'items': [],
+                         'nextSyncToken': self.sync_token()}
+
+        min_ts = _parse_rfc3339(time_min) if time_min else None
+        max_ts = _parse_rfc3339(time_max) if time_max else None
+        if page_token:
+            position = int(page_token)
+        elif min_ts is not None:
+            position = bisect.bisect_left(self._starts, min_ts - self._max_duration)
+        else:
+            position = 0
+        end = bisect.bisect_left(self._starts, max_ts) if max_ts is not None else len(self._events)
+
+        items = []
+        while position < end and len(items) < max_results:
+            start_ts, end_ts, event = self._events[position]
+            position += 1
+            if min_ts is None or end_ts > min_ts:
+                items.append(event)
+
+        payload = {'kind': 'calendar#events', 'summary': 'primary', 'timeZone': self.timezone, 'items': items}
+        if position < end:
+            payload['nextPageToken'] = str(position)
+        else:
+            payload['nextSyncToken'] = self.sync_token()
+        return 200, payload
+
+
+class InProcessCalendarService:
+    """
+    Servicio con la interfaz de googleapiclient que usa la aplicación
+    (settings().get y events().list) sobre un FakeCalendar, sin pasar por HTTP.
+    Sirve para medir /calculate sin la red (ver benchmark.py); la latencia y
+    los errores inyectados del calendario se aplican igual que en el servidor.
+    """
+
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def settings(self):
+        return self
+
+    def events(self):
+        return self
+
+    def get(self, setting):
+        def execute():
+            if setting != 'timezone':
+                return 404, _error_body(404, 'notFound', 'Not Found')
+            return 200, {'kind': 'calendar#setting', 'id': setting, 'value': self.calendar.timezone}
+        return _InProcessRequest(self.calendar, execute)
+
+    def list(self, calendarId='primary', timeMin=None, timeMax=None, pageToken=None, maxResults=None,
+             syncToken=None, **kwargs):
+        return _InProcessRequest(
+            self.calendar, lambda: self.calendar.list_events(timeMin, timeMax, pageToken, maxResults, syncToken)
+        )
+
+
+class _InProcessRequest:
+    def __init__(self, calendar, handler):
+        self._calendar = calendar
+        self._handler = handler
+
+    def execute(self):
+        self._calendar.delay()
+        error = self._calendar.injected_error()
+        if error:
+            raise RuntimeError(f"Error {error} ({ERROR_REASONS.get(error, 'backendError')}) del calendario falso")
+        status, payload = self._handler()
+        if status != 200:
+            raise RuntimeError(f"Error {status} del calendario falso: {payload['error']['message']}")
+        return payload
+
+
+def _parse_rfc3339(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def _error_body(status, reason, message):
+    return {'error': {'code': status, 'message': message, 'errors': [{'domain': 'global', 'reason': reason, 'message': message}]}}
+
+
+class FakeCalendarHandler(BaseHTTPRequestHandler):
+    """Endpoints de Google Calendar API y OAuth sobre el FakeCalendar del servidor"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeCalendar/1.0'
+
+    @property
+    def calendar(self):
+        return self.server.calendar
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status):
+        reason = ERROR_REASONS.get(status, 'backendError')
+        headers = {'Retry-After': '1'} if status == 429 else None
+        self._send_json(status, _error_body(status, reason, f'Injected error ({reason})'), headers)
+
+    def _authorized(self):
+        header = self.headers.get('Authorization', '')
+        return header.startswith('Bearer ') and self.calendar.token_valid(header[len('Bearer '):])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.calendar.delay()
+
+        if url.path == '/o/oauth2/auth':
+            return self._authorize(query)
+        if not url.path.startswith(API_PREFIX):
+            return self._send_json(404, _error_body(404, 'notFound', 'Not Found'))
+
+        error = self.calendar.injected_error()
+        if error:
+            return self._send_error(error)
+        if not self._authorized():
+            return self._send_json(401, _error_body(401, 'authError', 'Invalid Credentials'))
+
+        path = url.path[len(API_PREFIX):].rstrip('/')
+        parts = [unquote(part) for part in path.split('/') if part]
+        if parts[:2] == ['users', 'me'] and parts[2:3] == ['settings']:
+            return self._settings(parts[3] if len(parts) > 3 else None)
+        if parts[:3] == ['users', 'me', 'calendarList']:
+            return self._calendar_list(parts[3] if len(parts) > 3 else None)
+        if parts == ['colors']:
+            return self._send_json(200, self._colors())
+        if len(parts) == 3 and parts[0] == 'calendars' and parts[2] == 'events':
+            status, payload = self.calendar.list_events(
+                query.get('timeMin'), query.get('timeMax'), query.get('pageToken'),
+                query.get('maxResults'), query.get('syncToken')
+            )
+            return self._send_json(status, payload)
+        return self._send_json(404, _error_body(404, 'notFound', 'Not Found'))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        form = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        self.calendar.delay()
+
+        if url.path != '/token':
+            return self._send_json(404, _error_body(404, 'notFound', 'Not Found'))
+
+        grant_type = form.get('grant_type')
+        payload = {
+            'access_token': self.calendar.issue_token(),
+            'expires_in': self.calendar.token_ttl,
+            'token_type': 'Bearer',
+            'scope': 'https://www.googleapis.com/auth/calendar.readonly',
+        }
+        if grant_type == 'authorization_code' and form.get('code'):
+            # Un refresh token distinto por autorización: cada usuario simulado es un usuario distinto
+            payload['refresh_token'] = f"fake-refresh-{form['code']}"
+        elif grant_type != 'refresh_token' or not form.get('refresh_token'):
+            return self._send_json(400, {'error': 'invalid_grant'})
+        self._send_json(200, payload)
+
+    def _authorize(self, query):
+        """Autorización inmediata: redirigir a redirect_uri con un código nuevo"""
+        redirect_uri = query.get('redirect_uri')
+        if not redirect_uri:
+            return self._send_json(400, {'error': 'invalid_request'})
+        params = {'code': secrets.token_urlsafe(12), 'scope': query.get('scope', '')}
+        if 'state' in query:
+            params['state'] = query['state']
+        separator = '&' if '?' in redirect_uri else '?'
+        self.send_response(302)
+        self.send_header('Location', f"{redirect_uri}{separator}{urlencode(params)}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _settings(self, setting):
+        values = {'timezone': self.calendar.timezone, 'weekStart': '1', 'locale': 'es', 'format24HourTime': 'true'}
+        if setting is None:
+            items = [{'kind': 'calendar#setting', 'id': key, 'value': value} for key, value in values.items()]
+            return self._send_json(200, {'kind': 'calendar#settings', 'items': items})
+        if setting not in values:
+            return self._send_json(404, _error_body(404, 'notFound', 'Not Found'))
+        return self._send_json(200, {'kind': 'calendar#setting', 'id': setting, 'value': values[setting]})
+
+    def _calendar_list(self, calendar_id):
+        entry = {
+            'kind': 'calendar#calendarListEntry', 'id': 'primary', 'summary': 'Calendario',
+            'timeZone': self.calendar.timezone, 'colorId': '14', 'accessRole': 'owner', 'primary': True,
+        }
+        if calendar_id is None:
+            return self._send_json(200, {'kind': 'calendar#calendarList', 'items': [entry]})
+        if calendar_id != 'primary':
+            return self._send_json(404, _error_body(404, 'notFound', 'Not Found'))
+        return self._send_json(200, entry)
+
+    def _colors(self):
+        return {
+            'kind': 'calendar#colors',
+            'calendar': {'14': {'background': '#9fe1e7', 'foreground': '#000000'}},
+            'event': {key: {'background': bg, 'foreground': fg} for key, (bg, fg) in GOOGLE_EVENT_COLORS.items()},
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, calendar, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeCalendarHandler)
+        self.calendar = calendar
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Variables de entorno que apuntan la aplicación a este servidor"""
+        return {
+            'GOOGLE_API_BASE_URL': f"{self.base_url}{API_PREFIX}",
+            'GOOGLE_AUTH_URI': f"{self.base_url}/o/oauth2/auth",
+            'GOOGLE_TOKEN_URI': f"{self.base_url}/token",
+            'OAUTHLIB_INSECURE_TRANSPORT': '1',
+        }
+
+    def start_in_thread(self):
+        """Atender peticiones en un hilo en segundo plano (para pruebas)"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def record_calendar(credentials_dict, start_date, end_date, path):
+    """
+    Grabar los eventos reales de un rango para reproducirlos después
+
+    Returns:
+        Número de eventos grabados
+    """
+    from calendar_time_tracker import fetch_calendar_snapshot
+
+    snapshot = fetch_calendar_snapshot(credentials_dict, start_date, end_date)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'timezone': snapshot['timezone'], 'range': snapshot['range'], 'items': snapshot['events']},
+                  f, ensure_ascii=False)
+    return len(snapshot['events'])
+
+
+def add_server_arguments(parser):
+    """Opciones del calendario reproducido (compartidas con load_test.py)"""
+    parser.add_argument('--events', default=None, help='Calendario grabado (JSON)')
+    parser.add_argument('--synthetic', type=int, default=2000, help='Eventos sintéticos si no se indica --events')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timezone', default='Europe/Madrid')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', default='500,503,429', help='Códigos de error inyectados')
+    parser.add_argument('--token-ttl', type=int, default=3600, help='Validez de los access tokens (segundos)')
+
+
+def calendar_from_args(args):
+    """Crear el FakeCalendar a partir de las opciones de add_server_arguments"""
+    if args.events:
+        events, timezone = load_calendar(args.events)
+        timezone = timezone or args.timezone
+    else:
+        from synthetic_calendar import generate_calendar
+        timezone = args.timezone
+        events = generate_calendar(datetime.date(2023, 1, 2), seed=args.seed, timezone=timezone,
+                                   max_events=args.synthetic)
+    return FakeCalendar(
+        events, timezone, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        error_statuses=[int(code) for code in args.error_status.split(',') if code],
+        token_ttl=args.token_ttl, seed=args.seed
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor falso de Google Calendar API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Reproducir un calendario grabado o sintético')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    add_server_arguments(serve)
+
+    record = commands.add_parser('record', help='Grabar un calendario real')
+    record.add_argument('--credentials', required=True, help='JSON con credenciales (formato de credentials_to_dict)')
+    record.add_argument('--start', required=True, help='Primer día (AAAA-MM-DD)')
+    record.add_argument('--end', required=True, help='Último día (AAAA-MM-DD)')
+    record.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        with open(args.credentials, 'r', encoding='utf-8') as f:
+            credentials_dict = json.load(f)
+        count = record_calendar(credentials_dict, datetime.date.fromisoformat(args.start),
+                                datetime.date.fromisoformat(args.end), args.output)
+        print(f"{count} eventos grabados en {args.output}")
+        return 0
+
+    server = FakeCalendarServer(calendar_from_args(args), args.host, args.port)
+    for name, value in server.environment().items():
+        print(f"{name}={value}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Configuración de Gunicorn para Calendar Work Time Tracker.
+
+Uso:
+    gunicorn -c gunicorn_config.py wsgi:app
+
+La aplicación pasa la mayor parte del tiempo esperando a Google Calendar, por
+lo que por defecto se usan workers con hilos (gthread): cada worker atiende
+varias peticiones a la vez. Con GUNICORN_WORKER_CLASS=gevent (requiere instalar
+gevent) cada worker atiende cientos de conexiones cooperativas.
+"""
+
+import os
+import shutil
+
+from config_utils import get_env_value
+
+# Dirección de escucha
+bind = f"{get_env_value('HOST', '0.0.0.0')}:{get_env_value('PORT', 5000, int)}"
+
+# Cargar la aplicación en el proceso maestro antes de crear los workers: los
+# módulos, la aplicación, el documento de descubrimiento de Google y las
+# plantillas compiladas se comparten (copy-on-write) y cada worker nuevo
+# arranca sin volver a importarlos
+preload_app = get_env_value('GUNICORN_PRELOAD_APP', True, bool)
+
+# Procesos y modo de concurrencia (sync, gthread o gevent)
+workers = get_env_value('GUNICORN_WORKERS', 4, int)
+worker_class = get_env_value('GUNICORN_WORKER_CLASS', 'gthread')
+threads = get_env_value('GUNICORN_THREADS', 16, int)
+worker_connections = get_env_value('GUNICORN_WORKER_CONNECTIONS', 200, int)
+
+# Tiempos: el timeout debe superar el plazo máximo de /calculate (CALCULATE_DEADLINE)
+timeout = get_env_value('GUNICORN_TIMEOUT', 60, int)
+graceful_timeout = get_env_value('GUNICORN_GRACEFUL_TIMEOUT', 30, int)
+keepalive = get_env_value('GUNICORN_KEEPALIVE', 5, int)
+
+# Reciclado de workers para acotar el crecimiento de memoria
+max_requests = get_env_value('GUNICORN_MAX_REQUESTS', 1000, int)
+max_requests_jitter = get_env_value('GUNICORN_MAX_REQUESTS_JITTER', 100, int)
+
+forwarded_allow_ips = get_env_value('GUNICORN_FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = get_env_value('GUNICORN_ACCESS_LOG', None)
+errorlog = '-'
+
+# Métricas agregadas entre workers: prometheus_client lee la variable al
+# importarse, así que se define aquí, antes de cargar la aplicación
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', get_env_value('METRICS_MULTIPROC_DIR', '/tmp/calendar-metrics'))
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    """Vaciar las métricas de ejecuciones anteriores (modo multiproceso de prometheus_client)"""
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def _warm_templates():
+    if get_env_value('TEMPLATE_WARMUP', True, bool):
+        from app import app
+        from template_utils import warm_templates
+        warm_templates(app)
+
+
+def when_ready(server):
+    """
+    Cargar el cliente de Google y compilar las plantillas en el maestro antes
+    de crear los workers (solo con preload_app)
+    """
+    if server.cfg.preload_app:
+        from auth_utils import preload_google_client
+        preload_google_client()
+        _warm_templates()
+
+
+def post_worker_init(worker):
+    """Sin preload_app cada worker compila las plantillas al arrancar (desde la caché en disco)"""
+    if not worker.cfg.preload_app:
+        _warm_templates()
+
+
+def child_exit(server, worker):
+    """Descartar las métricas en vivo (gauges) de un worker terminado"""
+    from metrics_utils import mark_worker_dead
+    mark_worker_dead(worker.pid)
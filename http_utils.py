@@ -0,0 +1,132 @@
+"""
+Utilidades de transporte HTTP para Google Calendar API.
+Este módulo mantiene una sesión HTTP por worker con un pool de conexiones
+keep-alive acotado, compartida por todos los usuarios, y un adaptador
+compatible con httplib2 para usarla desde googleapiclient.
+"""
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request
+
+# Local imports
+from config_utils import get_env_value
+
+# Códigos de estado tras los cuales se renuevan las credenciales y se reintenta
+REFRESH_STATUS_CODES = (401,)
+
+# Cabeceras que dejan de ser válidas porque requests ya descomprime el contenido
+_DROPPED_RESPONSE_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=get_env_value('HTTP_POOL_CONNECTIONS', 4, int),
+        pool_maxsize=get_env_value('HTTP_POOL_MAXSIZE', 10, int),
+        pool_block=True
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # La sesión la comparten todos los usuarios: nunca guardar cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_shared_session():
+    """
+    Obtener la sesión HTTP compartida del worker actual
+
+    La sesión se recrea tras un fork para no compartir sockets entre procesos.
+
+    Returns:
+        Objeto requests.Session con pool de conexiones keep-alive
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _create_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def get_auth_request():
+    """Objeto Request de google-auth que usa la sesión compartida (para renovar tokens)"""
+    return Request(get_shared_session())
+
+
+class PooledAuthorizedHttp:
+    """
+    Adaptador con la interfaz de httplib2.Http que envía las peticiones de
+    googleapiclient a través de la sesión compartida, añadiendo las
+    credenciales del usuario y renovándolas ante un 401.
+
+    Un token ya expirado se renueva con `refresh` (p. ej. auth_utils.refresh_credentials,
+    que comparte la renovación entre las peticiones concurrentes del usuario) antes
+    de que google-auth lo renueve por su cuenta en before_request.
+    """
+
+    def __init__(self, credentials, session=None, timeout=None, max_refresh_attempts=1, on_refresh=None,
+                 refresh=None):
+        self.credentials = credentials
+        self.on_refresh = on_refresh
+        self.refresh = refresh
+        self.session = session or get_shared_session()
+        self.timeout = timeout
+        self.max_refresh_attempts = max_refresh_attempts
+        self._auth_request = Request(self.session)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5,
+                connection_type=None, **kwargs):
+        """
+        Realizar una petición HTTP autenticada
+
+        Returns:
+            Tuple (httplib2.Response, contenido en bytes) como httplib2.Http.request
+        """
+        request_headers = dict(headers or {})
+        if self.refresh and self.credentials.expired:
+            self.credentials = self.refresh(self.credentials)
+        self.credentials.before_request(self._auth_request, method, uri, request_headers)
+
+        attempt = 0
+        while True:
+            response = self.session.request(
+                method, uri, data=body, headers=request_headers,
+                timeout=self.timeout, allow_redirects=redirections > 0
+            )
+            if response.status_code not in REFRESH_STATUS_CODES or attempt >= self.max_refresh_attempts:
+                break
+
+            attempt += 1
+            self.credentials.refresh(self._auth_request)
+            self.credentials.apply(request_headers)
+            if self.on_refresh:
+                self.on_refresh(self.credentials)
+
+        return self._to_httplib2_response(response), response.content
+
+    @staticmethod
+    def _to_httplib2_response(response):
+        info = {
+            key: value for key, value in response.headers.items()
+            if key.lower() not in _DROPPED_RESPONSE_HEADERS
+        }
+        info['status'] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp
+
+    def close(self):
+        """La sesión es compartida entre usuarios, por lo que no se cierra"""
+        pass
@@ -0,0 +1,559 @@
+"""
+Utilidades para importar calendarios en formato iCalendar (.ics).
+Este módulo lee archivos .ics como fuente alternativa a Google Calendar API,
+para calendarios que solo pueden exportarse. El archivo se recorre sobre un
+mmap sin construir el árbol de componentes: los VEVENT se localizan con
+búsquedas de bytes y de cada uno solo se extraen (con expresiones regulares
+ancladas a inicio de línea) las propiedades que usa el cálculo; las líneas
+plegadas de las demás (descripciones, adjuntos...) nunca se decodifican. Los
+eventos sin recurrencia que quedan fuera del rango se descartan comparando
+la fecha en bruto, antes de interpretarla. Los eventos recurrentes
+(RRULE/RDATE/EXDATE y excepciones con RECURRENCE-ID) se expanden solo dentro
+del rango pedido, y el resultado tiene el mismo formato que parse_events,
+listo para summarize_parsed_events.
+
+COLOR y CATEGORIES se convierten en el colorId de Google Calendar más
+parecido, de modo que las etiquetas de color de la configuración
+(color_tags) funcionan igual que con eventos de Google.
+
+Las zonas horarias se resuelven por el nombre de TZID (pytz); los bloques
+VTIMEZONE no se interpretan y los TZID desconocidos (p. ej. nombres de
+Windows) usan la zona horaria del calendario.
+"""
+
+import os
+import re
+import mmap
+import datetime
+from functools import lru_cache
+
+import pytz
+from dateutil.rrule import rrulestr, rruleset
+
+# Local imports
+from logging_utils import event_error_sampler
+from calendar_utils import assign_service, GOOGLE_EVENT_COLORS
+
+# Nombres de los colores de Google (inglés y español) y nombres CSS habituales en COLOR
+COLOR_NAMES = {
+    'lavender': '1', 'lavanda': '1', 'sage': '2', 'salvia': '2', 'grape': '3', 'uva': '3',
+    'flamingo': '4', 'banana': '5', 'tangerine': '6', 'mandarina': '6', 'peacock': '7',
+    'pavo real': '7', 'graphite': '8', 'grafito': '8', 'blueberry': '9', 'arándano': '9',
+    'basil': '10', 'albahaca': '10', 'tomato': '11', 'tomate': '11',
+}
+CSS_COLORS = {
+    'red': '#ff0000', 'darkred': '#8b0000', 'crimson': '#dc143c', 'orange': '#ffa500',
+    'yellow': '#ffff00', 'gold': '#ffd700', 'green': '#008000', 'lime': '#00ff00',
+    'blue': '#0000ff', 'royalblue': '#4169e1', 'navy': '#000080', 'cyan': '#00ffff',
+    'turquoise': '#40e0d0', 'teal': '#008080', 'purple': '#800080', 'violet': '#ee82ee',
+    'plum': '#dda0dd', 'pink': '#ffc0cb', 'salmon': '#fa8072', 'coral': '#ff7f50',
+    'gray': '#808080', 'grey': '#808080', 'silver': '#c0c0c0', 'lightgray': '#d3d3d3',
+}
+
+VEVENT_BEGIN = b'\nBEGIN:VEVENT'
+VEVENT_END = b'\nEND:VEVENT'
+
+# Propiedades de VEVENT que se extraen (con sus líneas de continuación); las demás se ignoran
+PROPERTY_RE = re.compile(
+    rb'\n(UID|SUMMARY|DTSTART|DTEND|DURATION|RRULE|RDATE|EXDATE|RECURRENCE-ID|STATUS|COLOR|CATEGORIES'
+    rb'|X-MICROSOFT-CDO-BUSYSTATUS)([;:][^\r\n]*(?:\r?\n[ \t][^\r\n]*)*)'
+)
+# Componentes anidados en un VEVENT (VALARM): sus SUMMARY no son los del evento
+NESTED_RE = re.compile(rb'^BEGIN:([A-Z-]+)\r?\n.*?^END:\1\r?$', re.M | re.S)
+FOLD_RE = re.compile(rb'\r?\n[ \t]')
+CALENDAR_TIMEZONE_RE = re.compile(rb'^X-WR-TIMEZONE[;:]([^\r\n]*)', re.M)
+
+DURATION_RE = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$'
+)
+UNTIL_RE = re.compile(r'UNTIL=([0-9TZ]+)')
+
+TEXT_ESCAPES = {'\\n': '\n', '\\N': '\n', '\\,': ',', '\\;': ';', '\\\\': '\\'}
+TEXT_ESCAPE_RE = re.compile(r'\\[nN,;\\]')
+
+# Propiedades que hacen que un evento sea recurrente (o excepción de una serie)
+RECURRENCE_MARKERS = (b'\nRRULE', b'\nRDATE', b'\nRECURRENCE-ID')
+
+
+def _raw_date(block, name):
+    """Fecha AAAAMMDD de la propiedad `name` de un VEVENT en bruto, sin interpretarla (None si no está)"""
+    start = block.find(name)
+    if start == -1:
+        return None
+    end = block.find(b'\n', start + 1)
+    line = block[start:end if end != -1 else len(block)].rstrip(b'\r')
+    return line[line.rfind(b':') + 1:][:8]
+
+
+def iter_vevent_properties(path, first_date=None, last_date=None):
+    """
+    Recorrer los VEVENT de un archivo .ics
+
+    Args:
+        path: Ruta del archivo .ics
+        first_date, last_date: Si se indican (bytes AAAAMMDD), los eventos sin
+            recurrencia que terminan antes o empiezan después se descartan sin
+            extraer sus propiedades
+
+    Returns:
+        Generador de diccionarios {nombre de propiedad: [parámetros y valor en bruto]}
+        (bytes, con el plegado deshecho)
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = mm.find(VEVENT_BEGIN)
+        while position != -1:
+            end = mm.find(VEVENT_END, position + len(VEVENT_BEGIN))
+            if end == -1:
+                break
+            block = mm[position + len(VEVENT_BEGIN):end + 1]
+            position = mm.find(VEVENT_BEGIN, end)
+
+            if b'\nBEGIN:' in block:
+                block = NESTED_RE.sub(b'', block)
+            # RRULE, RDATE y RECURRENCE-ID empiezan por R: la mayoría de bloques se descartan con una búsqueda
+            recurring = b'\nR' in block and any(name in block for name in RECURRENCE_MARKERS)
+            if first_date is not None and not recurring:
+                start = _raw_date(block, b'\nDTSTART')
+                if start is not None and start > last_date:
+                    continue
+                end_date = _raw_date(block, b'\nDTEND')
+                if end_date is not None and end_date < first_date:
+                    continue
+
+            properties = {}
+            for name, raw in PROPERTY_RE.findall(block):
+                if b'\n' in raw:
+                    raw = FOLD_RE.sub(b'', raw)
+                properties.setdefault(name, []).append(raw)
+            yield properties
+
+
+def read_calendar_timezone(path):
+    """Zona horaria del calendario (X-WR-TIMEZONE) o None si el archivo no la indica"""
+    if os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_end = mm.find(VEVENT_BEGIN)
+        match = CALENDAR_TIMEZONE_RE.search(mm, 0, header_end if header_end != -1 else len(mm))
+        if not match:
+            return None
+        return match.group(1).decode('utf-8', errors='replace').strip() or None
+
+
+def split_property(raw):
+    """
+    Separar los parámetros y el valor de una propiedad en bruto (';TZID=...:valor')
+
+    Returns:
+        Tuple (diccionario de parámetros, valor)
+    """
+    text = raw.decode('utf-8', errors='replace')
+    if text[:1] == ':':
+        return {}, text[1:]
+    index = text.find(':')
+    if '"' in text[:index]:
+        # Los dos puntos pueden aparecer en parámetros entre comillas
+        in_quotes = False
+        for index, char in enumerate(text):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                break
+    params = {}
+    for param in text[1:index].split(';'):
+        key, _, param_value = param.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return params, text[index + 1:]
+
+
+def unescape_text(value):
+    """Deshacer el escapado de los valores TEXT"""
+    return TEXT_ESCAPE_RE.sub(lambda match: TEXT_ESCAPES[match.group()], value)
+
+
+def parse_duration(value):
+    """
+    Convertir una duración iCalendar (p. ej. PT1H30M, P1D) en timedelta
+
+    Returns:
+        Objeto timedelta o None si el formato no es válido
+    """
+    match = DURATION_RE.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = datetime.timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    return -duration if sign == '-' else duration
+
+
+def _resolve_timezone(tzid, default_timezone, cache):
+    if not tzid:
+        return default_timezone
+    timezone = cache.get(tzid)
+    if timezone is None:
+        try:
+            timezone = pytz.timezone(tzid)
+        except pytz.UnknownTimeZoneError:
+            event_error_sampler.log('ics_timezone', f"Zona horaria desconocida en ICS: {tzid}", tzid=tzid)
+            timezone = default_timezone
+        cache[tzid] = timezone
+    return timezone
+
+
+def parse_ics_value(value, params, default_timezone, tz_cache):
+    """
+    Convertir un valor DATE o DATE-TIME en (fecha u hora local sin zona, zona horaria, es día completo)
+
+    Las horas en UTC (sufijo Z) se devuelven en UTC; las flotantes, en la zona
+    horaria del calendario. Los días completos no tienen zona (None).
+    """
+    value = value.strip()
+    # Sin strptime: es la operación más repetida al leer archivos grandes
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.datetime(int(value[0:4]), int(value[4:6]), int(value[6:8])), None, True
+    if value[8:9] != 'T':
+        raise ValueError(f"Fecha y hora no válida: {value}")
+    naive = datetime.datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                              int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if value.endswith('Z'):
+        return naive, pytz.utc, False
+    return naive, _resolve_timezone(params.get('TZID'), default_timezone, tz_cache), False
+
+
+@lru_cache(maxsize=256)
+def color_to_color_id(value):
+    """
+    colorId de Google Calendar correspondiente a un valor de COLOR
+
+    Acepta un colorId ('1' a '11'), el nombre de un color de Google o un color
+    CSS (nombre o #rrggbb); en este caso se elige el color de Google más cercano.
+
+    Returns:
+        colorId o None si el valor no es un color reconocido
+    """
+    value = value.strip().lower()
+    if value in GOOGLE_EVENT_COLORS:
+        return value
+    if value in COLOR_NAMES:
+        return COLOR_NAMES[value]
+    hex_value = CSS_COLORS.get(value, value)
+    if not re.fullmatch(r'#[0-9a-f]{6}', hex_value):
+        return None
+    rgb = [int(hex_value[index:index + 2], 16) for index in (1, 3, 5)]
+
+    def distance(color_id):
+        background, _ = GOOGLE_EVENT_COLORS[color_id]
+        return sum((rgb[i] - int(background[1 + 2 * i:3 + 2 * i], 16)) ** 2 for i in range(3))
+    return min(GOOGLE_EVENT_COLORS, key=distance)
+
+
+def categories_to_color_id(categories, config):
+    """
+    colorId a partir de CATEGORIES
+
+    Una categoría con el nombre de un servicio de color_tags usa el color
+    asignado a ese servicio; si no, se prueba como nombre de color.
+    """
+    services = {service.strip().lower(): color_id for color_id, service in (config.get('color_tags') or {}).items()}
+    for category in categories:
+        name = category.strip().lower()
+        if name in services:
+            return services[name]
+    for category in categories:
+        color_id = color_to_color_id(category)
+        if color_id:
+            return color_id
+    return None
+
+
+class _IcsEvent:
+    """Propiedades de un VEVENT necesarias para el cálculo"""
+
+    __slots__ = ('uid', 'summary', 'start', 'end', 'duration', 'rrule', 'rdates', 'exdates',
+                 'recurrence_id', 'cancelled', 'color_id', 'out_of_office')
+
+    def __init__(self):
+        self.uid = None
+        self.summary = ''
+        self.start = None
+        self.end = None
+        self.duration = None
+        self.rrule = None
+        self.rdates = []
+        self.exdates = []
+        self.recurrence_id = None
+        self.cancelled = False
+        self.color_id = None
+        self.out_of_office = False
+
+
+def parse_vevent(properties, default_timezone, tz_cache, config):
+    """
+    Interpretar las propiedades en bruto de un VEVENT
+
+    Returns:
+        Objeto _IcsEvent (las fechas como tuplas de parse_ics_value)
+    """
+    event = _IcsEvent()
+    categories = []
+    color = None
+    for name, values in properties.items():
+        for raw in values:
+            params, value = split_property(raw)
+            try:
+                if name == b'SUMMARY':
+                    event.summary = unescape_text(value)
+                elif name == b'DTSTART':
+                    event.start = parse_ics_value(value, params, default_timezone, tz_cache)
+                elif name == b'DTEND':
+                    event.end = parse_ics_value(value, params, default_timezone, tz_cache)
+                elif name == b'DURATION':
+                    event.duration = parse_duration(value)
+                elif name == b'UID':
+                    event.uid = value.strip()
+                elif name == b'RRULE':
+                    event.rrule = value.strip()
+                elif name in (b'RDATE', b'EXDATE'):
+                    if params.get('VALUE') == 'PERIOD':
+                        continue
+                    target = event.rdates if name == b'RDATE' else event.exdates
+                    target.extend(parse_ics_value(item, params, default_timezone, tz_cache)
+                                  for item in value.split(',') if item.strip())
+                elif name == b'RECURRENCE-ID':
+                    event.recurrence_id = parse_ics_value(value, params, default_timezone, tz_cache)
+                elif name == b'STATUS':
+                    event.cancelled = value.strip().upper() == 'CANCELLED'
+                elif name == b'COLOR':
+                    color = value
+                elif name == b'CATEGORIES':
+                    categories.extend(unescape_text(item) for item in re.split(r'(?<!\\),', value) if item)
+                elif name == b'X-MICROSOFT-CDO-BUSYSTATUS':
+                    event.out_of_office = value.strip().upper() == 'OOF'
+            except ValueError as e:
+                event_error_sampler.log('ics_property', f"Propiedad ICS no válida {name.decode()}: {e}",
+                                        value=value[:80])
+    if color:
+        event.color_id = color_to_color_id(color)
+    if event.color_id is None and categories:
+        event.color_id = categories_to_color_id(categories, config)
+    return event
+
+
+class _Localizer:
+    """
+    Conversión de las fechas de iCalendar a datetime con la zona del calendario
+
+    pytz.localize es la operación más costosa por evento: el desfase se guarda
+    por zona y día, salvo en los días con cambio de horario. Los días completos
+    se interpretan como parse_datetime_api (medianoche UTC convertida a la zona
+    del calendario).
+    """
+
+    def __init__(self, calendar_timezone):
+        self.timezone = calendar_timezone
+        self._offsets = {}
+        self._transition_days = {}
+        self._all_day = {}
+
+    def _transitions(self, timezone):
+        days = self._transition_days.get(timezone)
+        if days is None:
+            # Días (en hora local, con margen) en los que cambia el desfase
+            days = set()
+            for moment in getattr(timezone, '_utc_transition_times', ())[1:]:
+                for delta in (-1, 0, 1):
+                    days.add((moment + datetime.timedelta(days=delta)).date())
+            self._transition_days[timezone] = days
+        return days
+
+    def __call__(self, value):
+        naive, timezone, is_all_day = value
+        if is_all_day:
+            aware = self._all_day.get(naive)
+            if aware is None:
+                aware = self._all_day[naive] = pytz.utc.localize(naive).astimezone(self.timezone)
+            return aware
+        day = naive.date()
+        key = (timezone, day)
+        tzinfo = self._offsets.get(key)
+        if tzinfo is None:
+            if day in self._transitions(timezone):
+                tzinfo = timezone.localize(naive).tzinfo
+            else:
+                tzinfo = self._offsets[key] = timezone.localize(naive).tzinfo
+        aware = naive.replace(tzinfo=tzinfo)
+        if timezone is not self.timezone:
+            aware = aware.astimezone(self.timezone)
+        return aware
+
+    def occurrence_key(self, value):
+        naive, _, is_all_day = value
+        return naive.date() if is_all_day else self(value)
+
+
+def _end_of(event, start_value, start, localize):
+    """Fin de una ocurrencia que empieza en start_value (tupla de parse_ics_value)"""
+    naive_start, timezone, is_all_day = start_value
+    if event.end is not None:
+        end_naive, end_timezone, _ = event.end
+        original_start = event.start[0]
+        if is_all_day or end_timezone is timezone:
+            # Misma hora del reloj que la ocurrencia original
+            return localize((naive_start + (end_naive - original_start), timezone, is_all_day))
+        duration = localize(event.end) - localize(event.start)
+    elif event.duration is not None:
+        duration = event.duration
+    else:
+        # Sin DTEND ni DURATION: un día para fechas y duración nula para horas (RFC 5545)
+        duration = datetime.timedelta(days=1) if is_all_day else datetime.timedelta(0)
+    if is_all_day:
+        return localize((naive_start + duration, None, True))
+    return localize.timezone.normalize(start + duration)
+
+
+def _expand(event, window_start, window_end):
+    """
+    Inicios (hora local sin zona) de las ocurrencias de un evento recurrente en la ventana
+
+    La regla se expande en hora local para que las repeticiones mantengan la
+    hora del día al cruzar un cambio de horario.
+    """
+    naive_start, timezone, is_all_day = event.start
+    rule_timezone = timezone or pytz.utc
+    rule = event.rrule
+    if rule:
+        # UNTIL en UTC se pasa a la hora local de DTSTART (dateutil no admite mezclarlas)
+        def local_until(match):
+            until = match.group(1)
+            if not until.endswith('Z') or is_all_day:
+                return f'UNTIL={until.rstrip("Z")}'
+            moment = pytz.utc.localize(datetime.datetime.strptime(until[:15], '%Y%m%dT%H%M%S'))
+            return f"UNTIL={moment.astimezone(rule_timezone).strftime('%Y%m%dT%H%M%S')}"
+        rule = UNTIL_RE.sub(local_until, rule)
+
+    occurrences = rruleset()
+    if rule:
+        occurrences.rrule(rrulestr(rule, dtstart=naive_start, ignoretz=True))
+    for rdate in event.rdates:
+        occurrences.rdate(_as_rule_time(rdate, rule_timezone))
+    for exdate in event.exdates:
+        occurrences.exdate(_as_rule_time(exdate, rule_timezone))
+    return occurrences.between(window_start.astimezone(rule_timezone).replace(tzinfo=None),
+                               window_end.astimezone(rule_timezone).replace(tzinfo=None), inc=True)
+
+
+def _as_rule_time(value, rule_timezone):
+    naive, timezone, is_all_day = value
+    if is_all_day or timezone is None or timezone is rule_timezone:
+        return naive
+    return timezone.localize(naive).astimezone(rule_timezone).replace(tzinfo=None)
+
+
+def iter_ics_events(path, start_date, end_date, config=None, timezone=None):
+    """
+    Eventos de un archivo .ics que solapan con el rango, en el formato de parse_events
+
+    Args:
+        path: Ruta del archivo .ics
+        start_date, end_date: Rango de fechas (inclusive) en la zona horaria del calendario
+        config: Configuración del usuario (para assign_service)
+        timezone: Zona horaria del calendario (por defecto X-WR-TIMEZONE o UTC)
+
+    Returns:
+        Generador de diccionarios con summary, start, end, is_all_day y service
+    """
+    config = config or {}
+    if timezone is None:
+        timezone = pytz.timezone(read_calendar_timezone(path) or 'UTC')
+    elif isinstance(timezone, str):
+        timezone = pytz.timezone(timezone)
+    localize = _Localizer(timezone)
+    tz_cache = {}
+
+    # Margen de un día para los eventos que empiezan antes del rango y lo solapan
+    window_start = timezone.localize(datetime.datetime.combine(start_date, datetime.time.min)) - datetime.timedelta(days=1)
+    window_end = timezone.localize(datetime.datetime.combine(end_date, datetime.time.max)) + datetime.timedelta(days=1)
+    # Límites para descartar por la fecha en bruto (con margen para la diferencia de zonas)
+    first_raw = (start_date - datetime.timedelta(days=2)).strftime('%Y%m%d').encode()
+    last_raw = (end_date + datetime.timedelta(days=2)).strftime('%Y%m%d').encode()
+
+    # Las series se expanden al final: sus excepciones (RECURRENCE-ID) pueden aparecer después
+    series = []
+    overridden = set()
+
+    def build(event, start, end):
+        if event.start[2] and end.time() == datetime.time.min and end.date() > start.date():
+            end = end - datetime.timedelta(seconds=1)
+        if end.date() < start_date or start.date() > end_date:
+            return None
+        api_event = {'summary': event.summary, 'eventType': 'outOfOffice' if event.out_of_office else 'default'}
+        if event.color_id:
+            api_event['colorId'] = event.color_id
+        return {
+            'summary': event.summary or 'N/A',
+            'start': start,
+            'end': end,
+            'is_all_day': event.start[2],
+            'service': assign_service(api_event, config),
+        }
+
+    for properties in iter_vevent_properties(path, first_raw, last_raw):
+        if b'DTSTART' not in properties:
+            continue
+        event = parse_vevent(properties, timezone, tz_cache, config)
+        if event.start is None:
+            continue
+        if event.recurrence_id is not None and event.uid:
+            overridden.add((event.uid, localize.occurrence_key(event.recurrence_id)))
+        if event.cancelled:
+            continue
+        if event.rrule or event.rdates:
+            series.append(event)
+            continue
+        try:
+            start = localize(event.start)
+            parsed = build(event, start, _end_of(event, event.start, start, localize))
+        except (ValueError, OverflowError) as e:
+            event_error_sampler.log('ics_event', f"Evento ICS no válido: {e}", event=event.summary)
+            continue
+        if parsed:
+            yield parsed
+
+    for event in series:
+        try:
+            # Margen para las ocurrencias que empiezan antes de la ventana y la solapan
+            lookback = datetime.timedelta(days=1)
+            if event.end is not None:
+                lookback = max(lookback, event.end[0] - event.start[0] + datetime.timedelta(days=1))
+            elif event.duration is not None:
+                lookback = max(lookback, event.duration)
+
+            for occurrence in _expand(event, window_start - lookback, window_end):
+                value = (occurrence, event.start[1], event.start[2])
+                if event.uid and (event.uid, localize.occurrence_key(value)) in overridden:
+                    continue
+                start = localize(value)
+                parsed = build(event, start, _end_of(event, value, start, localize))
+                if parsed:
+                    yield parsed
+        except (ValueError, OverflowError) as e:
+            event_error_sampler.log('ics_recurrence', f"Recurrencia ICS no válida: {e}", event=event.summary)
+
+
+def parse_ics(path, start_date, end_date, config=None, timezone=None):
+    """
+    Leer los eventos de un archivo .ics en el formato de parse_events
+
+    Returns:
+        Tuple (lista de eventos parseados, zona horaria del calendario)
+    """
+    if timezone is None:
+        timezone = pytz.timezone(read_calendar_timezone(path) or 'UTC')
+    elif isinstance(timezone, str):
+        timezone = pytz.timezone(timezone)
+    return list(iter_ics_events(path, start_date, end_date, config, timezone)), timezone
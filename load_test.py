@@ -0,0 +1,264 @@
+"""
+Prueba de carga de /calculate a través de gunicorn.
+
+Cada usuario simulado inicia sesión con el flujo OAuth completo contra el
+servidor falso de Google Calendar (fake_calendar_server.py) y después envía
+peticiones a /calculate de forma concurrente. Se mide el rendimiento
+(peticiones por segundo) y la latencia (p50/p90/p99) de la configuración de
+despliegue elegida, sin llamar a Google.
+
+Uso:
+    # Lanza el servidor falso y gunicorn con la configuración indicada
+    python load_test.py --users 50 --requests 10 --workers 4 --worker-class gthread --threads 16
+    # Contra una aplicación ya arrancada (apuntada a un servidor falso)
+    python load_test.py --app-url http://127.0.0.1:5000 --users 20 --duration 60
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import datetime
+import statistics
+import subprocess
+
+import httpx
+
+from config_utils import get_default_config
+from fake_calendar_server import FakeCalendarServer, add_server_arguments, calendar_from_args
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    """Percentil por el método del rango más cercano"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(latencies):
+    """Estadísticas de latencia en segundos"""
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'mean': statistics.fmean(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies),
+    }
+
+
+def start_gunicorn(port, fake_env, workers, worker_class, threads, extra_env=None):
+    """
+    Arrancar gunicorn con gunicorn_config.py apuntando al servidor falso
+
+    Returns:
+        Objeto subprocess.Popen
+    """
+    env = dict(os.environ)
+    env.update(fake_env)
+    env.update({
+        'HOST': '127.0.0.1',
+        'PORT': str(port),
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_THREADS': str(threads),
+        'GOOGLE_CLIENT_ID': 'load-test-client',
+        'GOOGLE_CLIENT_SECRET': 'load-test-secret',
+        'GOOGLE_REDIRECT_URI': f'http://127.0.0.1:{port}/oauth2callback',
+        # Cookies sin Secure: la prueba se hace por HTTP
+        'FLASK_ENV': 'development',
+        'LOG_LEVEL': 'WARNING',
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'wsgi:app'],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+
+def wait_until_ready(url, process=None, timeout=30):
+    """Esperar a que la aplicación responda"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"La aplicación no respondió en {timeout} segundos")
+
+
+async def _login(client):
+    """Flujo OAuth completo contra el servidor falso; devuelve True si hay sesión"""
+    # Solo un inicio de sesión correcto redirige a `next`; los errores vuelven al dashboard sin parámetros
+    response = await client.get('/auth/google', params={'next': '/dashboard?login=ok'})
+    return response.status_code == 200 and response.url.params.get('login') == 'ok'
+
+
+async def simulate_user(app_url, form, requests_count, stop_at, results):
+    """
+    Usuario simulado: iniciar sesión y enviar peticiones a /calculate
+
+    Args:
+        app_url: URL base de la aplicación
+        form: Datos del formulario de /calculate
+        requests_count: Número de peticiones (None para repetir hasta stop_at)
+        stop_at: Instante (time.monotonic) en el que parar si requests_count es None
+        results: Diccionario donde acumular latencias y códigos de estado
+    """
+    async with httpx.AsyncClient(base_url=app_url, follow_redirects=True, timeout=120) as client:
+        start = time.perf_counter()
+        try:
+            logged_in = await _login(client)
+        except httpx.HTTPError:
+            logged_in = False
+        results['login'].append(time.perf_counter() - start)
+        if not logged_in:
+            results['login_failures'] += 1
+            return
+
+        sent = 0
+        while (requests_count is None and time.monotonic() < stop_at) or (requests_count is not None and sent < requests_count):
+            sent += 1
+            start = time.perf_counter()
+            try:
+                # Sin seguir redirecciones: un 302 a dashboard es un error de cálculo
+                response = await client.post('/calculate', data=form, follow_redirects=False)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            results['statuses'][str(status)] = results['statuses'].get(str(status), 0) + 1
+            if status == 200:
+                results['latencies'].append(elapsed)
+            else:
+                results['failed_latencies'].append(elapsed)
+
+
+async def run_users(app_url, users, form, requests_count=None, duration=None, ramp_up=0.0):
+    """
+    Ejecutar los usuarios simulados de forma concurrente
+
+    Returns:
+        Diccionario con los resultados agregados
+    """
+    results = {'login': [], 'login_failures': 0, 'latencies': [], 'failed_latencies': [], 'statuses': {}}
+    started = time.perf_counter()
+    stop_at = time.monotonic() + (duration or 0)
+
+    async def delayed(index):
+        if ramp_up:
+            await asyncio.sleep(ramp_up * index / users)
+        await simulate_user(app_url, form, requests_count, stop_at, results)
+
+    await asyncio.gather(*(delayed(index) for index in range(users)))
+    elapsed = time.perf_counter() - started
+    completed = len(results['latencies'])
+    return {
+        'users': users,
+        'elapsed': elapsed,
+        'requests': completed + len(results['failed_latencies']),
+        'successful': completed,
+        'throughput': completed / elapsed if elapsed else None,
+        'statuses': results['statuses'],
+        'latency': summarize_latencies(results['latencies']),
+        'failed_latency': summarize_latencies(results['failed_latencies']),
+        'login': summarize_latencies(results['login']),
+        'login_failures': results['login_failures'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prueba de carga de /calculate con un Google Calendar falso')
+    parser.add_argument('--app-url', default=None, help='Aplicación ya arrancada (si no, se lanza gunicorn)')
+    parser.add_argument('--users', type=int, default=20, help='Usuarios simultáneos')
+    parser.add_argument('--requests', type=int, default=5, help='Peticiones por usuario')
+    parser.add_argument('--duration', type=float, default=None, help='Segundos de prueba (en lugar de --requests)')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='Segundos para incorporar a todos los usuarios')
+    parser.add_argument('--start-date', default='2023-01-02')
+    parser.add_argument('--end-date', default='2023-06-30')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--output', default=None, help='Archivo JSON de resultados')
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    fake_server = None
+    gunicorn = None
+    app_url = args.app_url
+    try:
+        if app_url is None:
+            fake_server = FakeCalendarServer(calendar_from_args(args))
+            fake_server.start_in_thread()
+            port = _free_port()
+            gunicorn = start_gunicorn(port, fake_server.environment(), args.workers, args.worker_class, args.threads)
+            app_url = f'http://127.0.0.1:{port}'
+        wait_until_ready(app_url, gunicorn)
+
+        form = {
+            'start_date': args.start_date,
+            'end_date': args.end_date,
+            'config': json.dumps(get_default_config()),
+        }
+        summary = asyncio.run(run_users(
+            app_url, args.users, form,
+            requests_count=None if args.duration else args.requests,
+            duration=args.duration, ramp_up=args.ramp_up
+        ))
+    finally:
+        if gunicorn is not None:
+            gunicorn.terminate()
+            gunicorn.wait(timeout=30)
+        if fake_server is not None:
+            fake_server.shutdown()
+            fake_server.server_close()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'app_url': args.app_url or 'gunicorn',
+            'workers': args.workers,
+            'worker_class': args.worker_class,
+            'threads': args.threads,
+            'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms,
+            'error_rate': args.error_rate,
+            'range': [args.start_date, args.end_date],
+        },
+        'fake_calendar': fake_server.calendar.stats if fake_server else None,
+        'summary': summary,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    latency = summary['latency']
+    print(f"{summary['successful']}/{summary['requests']} peticiones correctas en {summary['elapsed']:.1f} s "
+          f"({summary['throughput'] or 0:.1f} peticiones/s), estados: {summary['statuses']}")
+    if latency['count']:
+        print(f"latencia p50 {latency['p50'] * 1000:.0f} ms  p90 {latency['p90'] * 1000:.0f} ms  "
+              f"p99 {latency['p99'] * 1000:.0f} ms  máx {latency['max'] * 1000:.0f} ms")
+    if summary['login_failures']:
+        print(f"{summary['login_failures']} usuarios no pudieron iniciar sesión")
+    return 0 if summary['successful'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
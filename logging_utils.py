@@ -0,0 +1,135 @@
+"""
+Utilidades para la configuración de logs.
+Este módulo configura Loguru una única vez por proceso, de forma segura
+cuando la aplicación se importa desde varios hilos o workers. Los sinks
+escriben desde un hilo en segundo plano (enqueue) para que las peticiones no
+esperen a la E/S, y los errores repetitivos se registran por muestreo.
+"""
+
+import os
+import sys
+import time
+import threading
+
+from loguru import logger
+
+# Local imports
+from config_utils import clean_env_value, get_env_value
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _env_setting(name, default):
+    """Leer un ajuste de logs eliminando posibles comentarios"""
+    value = clean_env_value(os.getenv(name, default))
+    return value.strip() if value else default
+
+
+def configure_logging():
+    """
+    Configurar los sinks de Loguru (archivo y consola) si aún no se hizo
+
+    Returns:
+        True si se configuró en esta llamada, False si ya estaba configurado
+    """
+    global _configured
+
+    with _configure_lock:
+        if _configured:
+            return False
+
+        log_level = _env_setting('LOG_LEVEL', 'INFO').split(' ')[0]
+        log_format = _env_setting('LOG_FORMAT', '{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}')
+        log_path = _env_setting('LOG_PATH', 'logs/').split(' ')[0]
+
+        # Asegurar que existe el directorio de logs
+        os.makedirs(log_path, exist_ok=True)
+
+        # enqueue: los mensajes pasan por una cola y los escribe un hilo aparte,
+        # que también evita que se mezclen líneas de distintos hilos o workers
+        logger.remove()  # Remover el handler por defecto
+        logger.add(os.path.join(log_path, 'app.log'),
+                   level=log_level,
+                   format=log_format,
+                   serialize=get_env_value('LOG_JSON', True, bool),
+                   enqueue=True,
+                   rotation="10 MB",
+                   retention="1 month")
+        logger.add(sys.stderr,
+                   level=log_level,
+                   format=log_format,
+                   serialize=get_env_value('LOG_JSON_CONSOLE', False, bool),
+                   enqueue=True)
+
+        _configured = True
+        return True
+
+
+class LogSampler:
+    """
+    Registro por muestreo de mensajes repetitivos (p. ej. un error por evento).
+
+    Para cada clave se registran las primeras `first` apariciones y, después,
+    una de cada `every`, indicando cuántas se han producido. Las cuentas se
+    reinician cada `window` segundos (None: nunca), de modo que un error que
+    vuelve a aparecer horas después se registra de nuevo.
+    """
+
+    def __init__(self, first=5, every=100, window=None, clock=time.monotonic):
+        self.first = first
+        self.every = every
+        self.window = window
+        self._clock = clock
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _current(self, key, now):
+        """Cuenta de la ventana actual de una clave (None si caducó)"""
+        entry = self._counts.get(key)
+        if entry is None or (self.window and now - entry[0] >= self.window):
+            return None
+        return entry
+
+    def log(self, key, message, level='ERROR', **fields):
+        """
+        Registrar un mensaje si le toca según el muestreo
+
+        Args:
+            key: Tipo de mensaje (se cuentan las apariciones por clave)
+            message: Texto del mensaje
+            level: Nivel de Loguru
+            fields: Datos adicionales (aparecen en 'extra' en la salida JSON)
+
+        Returns:
+            True si el mensaje se registró
+        """
+        with self._lock:
+            now = self._clock()
+            window_start, count = self._current(key, now) or (now, 0)
+            count += 1
+            self._counts[key] = (window_start, count)
+        if count > self.first and count % self.every:
+            return False
+        if count > self.first:
+            message = f"{message} ({count} apariciones)"
+        logger.bind(sample_key=key, occurrences=count, **fields).log(level, message)
+        return True
+
+    def count(self, key):
+        """Número de apariciones registradas o descartadas de una clave en la ventana actual"""
+        with self._lock:
+            entry = self._current(key, self._clock())
+        return entry[1] if entry else 0
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+# Muestreo de los errores que se producen por cada evento del calendario
+event_error_sampler = LogSampler(
+    first=get_env_value('LOG_SAMPLE_FIRST', 5, int),
+    every=get_env_value('LOG_SAMPLE_EVERY', 100, int),
+    window=get_env_value('LOG_SAMPLE_WINDOW', 300, int) or None
+)
@@ -0,0 +1,175 @@
+"""
+Utilidades de medición de memoria por etapa.
+Con MEMORY_TRACING activado se inicia tracemalloc y cada etapa medida con
+metrics_utils.stage_timer (eventos, parseo, resumen semanal, renderizado...)
+registra el pico de memoria asignada y la memoria que sigue asignada al
+terminar. Los valores se exponen en /metrics, se añaden a los perfiles de
+profiling_utils y /debug/memory muestra los puntos del código con más memoria
+asignada.
+
+tracemalloc mide todo el proceso: con varios hilos por worker (gthread) las
+cifras de una etapa incluyen lo que asignan a la vez otras peticiones. Para
+atribuir la memoria con precisión conviene medir con GUNICORN_THREADS=1.
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+import linecache
+from contextlib import contextmanager
+
+from flask import jsonify, abort
+from loguru import logger
+
+# Importar resource si está disponible (no existe en Windows)
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+# Local imports
+from config_utils import get_env_value
+from metrics_utils import histogram, current_request_collector, register_stage_hook
+from profiling_utils import is_admin_request
+
+MEMORY_TRACING_ENABLED = get_env_value('MEMORY_TRACING', False, bool)
+
+# Límites de los histogramas de memoria (bytes)
+MEMORY_BUCKETS = tuple(2 ** exponent for exponent in range(16, 32, 2))
+
+STAGE_PEAK_BYTES = histogram(
+    'calendar_stage_peak_bytes', 'Pico de memoria asignada durante cada etapa del cálculo',
+    ['stage'], buckets=MEMORY_BUCKETS
+)
+STAGE_RETAINED_BYTES = histogram(
+    'calendar_stage_retained_bytes', 'Memoria que sigue asignada al terminar cada etapa',
+    ['stage'], buckets=MEMORY_BUCKETS
+)
+
+# Etapas abiertas del hilo actual: [etapa, memoria al empezar, pico observado]
+_local = threading.local()
+
+
+def _open_stages():
+    if not hasattr(_local, 'stages'):
+        _local.stages = []
+    return _local.stages
+
+
+def _fold_peak(stages):
+    """Trasladar el pico actual de tracemalloc a todas las etapas abiertas"""
+    _, peak = tracemalloc.get_traced_memory()
+    for entry in stages:
+        entry[2] = max(entry[2], peak)
+
+
+@contextmanager
+def memory_stage(stage):
+    """
+    Medir el pico y la memoria retenida del bloque como etapa `stage`
+
+    Las etapas pueden anidarse: tracemalloc solo tiene un pico global, así que
+    antes de reiniciarlo se traslada a las etapas exteriores.
+    """
+    if not tracemalloc.is_tracing():
+        yield
+        return
+
+    stages = _open_stages()
+    _fold_peak(stages)
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    entry = [stage, current, current]
+    stages.append(entry)
+    try:
+        yield
+    finally:
+        _fold_peak(stages)
+        stages.remove(entry)
+        current_after, _ = tracemalloc.get_traced_memory()
+        record_stage_memory(stage, entry[2] - entry[1], current_after - entry[1])
+
+
+def record_stage_memory(stage, peak_bytes, retained_bytes):
+    """Registrar la memoria de una etapa en /metrics y en el recolector de la petición"""
+    STAGE_PEAK_BYTES.labels(stage=stage).observe(peak_bytes)
+    STAGE_RETAINED_BYTES.labels(stage=stage).observe(max(0, retained_bytes))
+    collector = current_request_collector()
+    if collector is not None:
+        memory = collector.setdefault('memory', {})
+        previous = memory.get(stage, {'peak_bytes': 0, 'retained_bytes': 0})
+        memory[stage] = {
+            'peak_bytes': max(previous['peak_bytes'], peak_bytes),
+            'retained_bytes': previous['retained_bytes'] + retained_bytes,
+        }
+
+
+def max_rss_bytes():
+    """Máximo de memoria residente del proceso (None si no se puede obtener)"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def top_allocation_sites(limit=25, group_by='lineno'):
+    """
+    Puntos del código con más memoria asignada ahora mismo
+
+    Returns:
+        Lista de diccionarios con archivo, línea, tamaño, número de bloques y código
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    sites = []
+    for stat in snapshot.statistics(group_by)[:limit]:
+        frame = stat.traceback[0]
+        sites.append({
+            'file': frame.filename,
+            'line': frame.lineno,
+            'size_bytes': stat.size,
+            'blocks': stat.count,
+            'code': linecache.getline(frame.filename, frame.lineno).strip(),
+        })
+    return sites
+
+
+def start_memory_tracing(frames=None):
+    """Iniciar tracemalloc y medir la memoria de cada etapa"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or get_env_value('MEMORY_TRACE_FRAMES', 10, int))
+    register_stage_hook(memory_stage)
+
+
+def init_memory_tracing(app):
+    """
+    Activar la medición de memoria y la ruta /debug/memory (solo con MEMORY_TRACING)
+
+    /debug/memory requiere el token de administración de profiling_utils.
+    """
+    if not MEMORY_TRACING_ENABLED:
+        return
+
+    start_memory_tracing()
+
+    @app.route('/debug/memory')
+    def debug_memory():
+        if not is_admin_request():
+            abort(404)
+        current, peak = tracemalloc.get_traced_memory()
+        return jsonify({
+            'pid': os.getpid(),
+            'traced_bytes': current,
+            'traced_peak_bytes': peak,
+            'max_rss_bytes': max_rss_bytes(),
+            'top_sites': top_allocation_sites(get_env_value('MEMORY_TOP_SITES', 25, int)),
+        })
+
+    logger.info("Medición de memoria por etapa habilitada (tracemalloc)")
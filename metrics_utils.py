@@ -0,0 +1,270 @@
+"""
+Utilidades de métricas de rendimiento.
+Este módulo mide la duración de cada etapa de /calculate (renovación de
+credenciales, build(), zona horaria, páginas de eventos, parseo,
+assign_service, resumen semanal y renderizado) y cuenta eventos, páginas y
+aciertos de caché. Con prometheus_client instalado y PROMETHEUS_MULTIPROC_DIR
+configurado, /metrics agrega los valores de todos los workers de gunicorn;
+sin prometheus_client se usa un registro en memoria del propio worker.
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager, ExitStack
+
+# Importar prometheus_client si está disponible
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites de los histogramas
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+class _LocalChild:
+    """Métrica en memoria con valores de etiquetas fijados"""
+
+    def __init__(self, metric, label_values):
+        self._metric = metric
+        self._label_values = label_values
+
+    def inc(self, amount=1):
+        self._metric._inc(self._label_values, amount)
+
+    def observe(self, value):
+        self._metric._observe(self._label_values, value)
+
+
+class _LocalMetric:
+    """Métrica en memoria con la misma interfaz básica que prometheus_client"""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets or ())
+        self._values = defaultdict(lambda: {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.buckets)})
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        return _LocalChild(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def observe(self, value):
+        self._observe((), value)
+
+    def _inc(self, label_values, amount):
+        with self._lock:
+            self._values[label_values]['sum'] += amount
+
+    def _observe(self, label_values, value):
+        with self._lock:
+            data = self._values[label_values]
+            data['count'] += 1
+            data['sum'] += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data['buckets'][i] += 1
+
+    def _format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.labelnames, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for label_values, data in sorted(self._values.items()):
+                if self.kind == 'counter':
+                    lines.append(f"{self.name}_total{self._format_labels(label_values)} {data['sum']}")
+                    continue
+                for bound, count in zip(self.buckets, data['buckets']):
+                    lines.append(f"{self.name}_bucket{self._format_labels(label_values, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{self._format_labels(label_values, [('le', '+Inf')])} {data['count']}")
+                lines.append(f"{self.name}_count{self._format_labels(label_values)} {data['count']}")
+                lines.append(f"{self.name}_sum{self._format_labels(label_values)} {data['sum']}")
+        return '\n'.join(lines)
+
+
+_local_metrics = []
+
+
+def histogram(name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+    """Crear un histograma en prometheus_client o, sin él, en el registro en memoria"""
+    if PROMETHEUS_AVAILABLE:
+        return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+    metric = _LocalMetric('histogram', name, documentation, labelnames, buckets)
+    _local_metrics.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """Crear un contador en prometheus_client o, sin él, en el registro en memoria"""
+    if PROMETHEUS_AVAILABLE:
+        return prometheus_client.Counter(name, documentation, labelnames)
+    metric = _LocalMetric('counter', name, documentation, labelnames)
+    _local_metrics.append(metric)
+    return metric
+
+
+STAGE_SECONDS = histogram(
+    'calendar_stage_seconds', 'Duración de cada etapa del cálculo', ['stage']
+)
+EVENTS_PER_REQUEST = histogram(
+    'calendar_events_per_request', 'Eventos obtenidos por cálculo', buckets=COUNT_BUCKETS
+)
+PAGES_PER_REQUEST = histogram(
+    'calendar_event_pages_per_request', 'Páginas de eventos pedidas a Google por cálculo', buckets=COUNT_BUCKETS
+)
+CACHE_HITS = counter(
+    'calendar_cache_hits', 'Aciertos de caché', ['cache']
+)
+CACHE_MISSES = counter(
+    'calendar_cache_misses', 'Fallos de caché', ['cache']
+)
+
+
+# Métricas de la petición en curso; solo se recogen si hay un recolector activo (ver profiling_utils)
+_request_collector = contextvars.ContextVar('request_collector', default=None)
+
+
+def start_request_collector():
+    """
+    Empezar a recoger las etapas, eventos y páginas de la petición en curso
+
+    Returns:
+        Tuple (diccionario que se irá rellenando, token para stop_request_collector)
+    """
+    collector = {'stages': {}, 'events': None, 'pages': None}
+    return collector, _request_collector.set(collector)
+
+
+def current_request_collector():
+    """
+    Recolector de la petición en curso
+
+    Returns:
+        Diccionario de start_request_collector o None si no se están recogiendo métricas
+    """
+    return _request_collector.get()
+
+
+def stop_request_collector(token):
+    """Dejar de recoger métricas de la petición en curso"""
+    try:
+        _request_collector.reset(token)
+    except ValueError:
+        # El token se creó en otro contexto (p. ej. al cerrar la respuesta desde otro hilo)
+        _request_collector.set(None)
+
+
+def observe_stage(stage, seconds):
+    """Registrar la duración de una etapa"""
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    collector = _request_collector.get()
+    if collector is not None:
+        collector['stages'][stage] = collector['stages'].get(stage, 0.0) + seconds
+
+
+def record_events(count):
+    """Registrar el número de eventos obtenidos en un cálculo"""
+    EVENTS_PER_REQUEST.observe(count)
+    collector = _request_collector.get()
+    if collector is not None:
+        collector['events'] = count
+
+
+def record_pages(count):
+    """Registrar el número de páginas de eventos pedidas en un cálculo"""
+    PAGES_PER_REQUEST.observe(count)
+    collector = _request_collector.get()
+    if collector is not None:
+        collector['pages'] = count
+
+
+# Context managers adicionales que envuelven cada etapa (p. ej. memoria, ver memory_utils)
+_stage_hooks = []
+
+
+def register_stage_hook(hook):
+    """
+    Ejecutar `hook(stage)` (un context manager) alrededor de cada etapa medida
+
+    Sin hooks registrados las etapas solo miden el tiempo.
+    """
+    if hook not in _stage_hooks:
+        _stage_hooks.append(hook)
+
+
+def unregister_stage_hook(hook):
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Medir la duración del bloque como etapa `stage`
+
+    Uso:
+        with stage_timer('timezone'):
+            ...
+    """
+    with ExitStack() as stack:
+        for hook in list(_stage_hooks):
+            stack.enter_context(hook(stage))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            observe_stage(stage, time.perf_counter() - start)
+
+
+def timed_stream(chunks, stage):
+    """Medir el tiempo total de generación de una respuesta en streaming"""
+    with stage_timer(stage):
+        yield from chunks
+
+
+def record_cache(cache, hit):
+    """Contar un acierto o fallo de la caché `cache`"""
+    (CACHE_HITS if hit else CACHE_MISSES).labels(cache=cache).inc()
+
+
+def render_metrics():
+    """
+    Generar el texto de /metrics en formato de exposición de Prometheus
+
+    Returns:
+        Tuple (contenido en bytes, Content-Type)
+    """
+    if not PROMETHEUS_AVAILABLE:
+        content = '\n'.join(metric.render() for metric in _local_metrics) + '\n'
+        return content.encode('utf-8'), CONTENT_TYPE
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Agregar los archivos de métricas que escribe cada worker
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Limpiar las métricas de un worker terminado (hook child_exit de gunicorn)"""
+    if PROMETHEUS_AVAILABLE and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,304 @@
+"""
+Utilidades de perfilado bajo demanda.
+Este módulo perfila con cProfile peticiones concretas de /calculate, incluida
+la generación de la respuesta en streaming, y guarda el perfil junto con el
+número de eventos, las páginas pedidas a Google y la duración de cada etapa.
+Una petición se perfila si trae la cabecera X-Profile-Token con el token de
+administración, si el usuario está en PROFILING_USERS o, al azar, con
+probabilidad PROFILING_SAMPLE_RATE. Con PROFILING_ENABLED desactivado las
+vistas no se modifican (sin ningún coste añadido).
+"""
+
+import io
+import os
+import time
+import hmac
+import uuid
+import random
+import pstats
+import cProfile
+from functools import wraps
+
+from flask import request, make_response, jsonify, send_file, abort
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value
+from storage_utils import JsonFileStore
+from metrics_utils import start_request_collector, stop_request_collector
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+PROFILING_ENABLED = get_env_value('PROFILING_ENABLED', False, bool)
+PROFILES_DIR = get_env_value('PROFILES_DIR', 'cache/profiles')
+PROFILES_MAX = get_env_value('PROFILES_MAX', 50, int)
+
+# Funciones incluidas en el resumen de texto de cada perfil
+PROFILE_TOP_FUNCTIONS = 30
+
+profile_store = JsonFileStore(
+    PROFILES_DIR,
+    ttl=get_env_value('PROFILE_TTL', 7 * 24 * 3600, int),
+    cleanup_interval=get_env_value('STORE_CLEANUP_INTERVAL', 300, int)
+)
+
+
+def _profiling_token():
+    return get_env_value('PROFILING_TOKEN', '')
+
+
+def is_admin_request():
+    """Comprobar si la petición trae el token de administración de perfiles"""
+    token = _profiling_token()
+    supplied = request.headers.get(PROFILE_HEADER, '')
+    return bool(token) and bool(supplied) and hmac.compare_digest(supplied, token)
+
+
+def profile_reason(user_key=None):
+    """
+    Motivo por el que perfilar la petición en curso
+
+    Returns:
+        'header', 'user' o 'sample', o None si no se debe perfilar
+    """
+    if is_admin_request():
+        return 'header'
+    flagged_users = {key.strip() for key in get_env_value('PROFILING_USERS', '').split(',') if key.strip()}
+    if user_key and user_key in flagged_users:
+        return 'user'
+    sample_rate = get_env_value('PROFILING_SAMPLE_RATE', 0.0, float)
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+class RequestProfile:
+    """
+    Perfil de una petición: se activa durante la vista y durante cada
+    fragmento de la respuesta en streaming, y se guarda al terminar
+    """
+
+    def __init__(self, endpoint, path, reason, user_key=None):
+        self.id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.path = path
+        self.reason = reason
+        self.user_key = user_key
+        self._profiler = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._collector, self._collector_token = start_request_collector()
+        self._finished = False
+
+    def resume(self):
+        self._profiler.enable()
+
+    def pause(self):
+        self._profiler.disable()
+
+    def discard(self):
+        """Descartar el perfil sin guardarlo"""
+        self._finished = True
+        stop_request_collector(self._collector_token)
+
+    def finish(self, status):
+        """Guardar el perfil (una sola vez)"""
+        if self._finished:
+            return
+        self._finished = True
+        self.pause()
+        stop_request_collector(self._collector_token)
+        try:
+            save_profile(self, status, time.perf_counter() - self._started)
+        except Exception as e:
+            logger.error(f"Error al guardar el perfil {self.id}: {e}")
+
+
+class _ProfiledIterable:
+    """Iterable de la respuesta que perfila la generación de cada fragmento"""
+
+    def __init__(self, iterable, profile, status):
+        self._iterable = iterable
+        self._iterator = None
+        self._profile = profile
+        self._status = status
+
+    def __iter__(self):
+        self._iterator = iter(self._iterable)
+        return self
+
+    def __next__(self):
+        self._profile.resume()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._profile.finish(self._status)
+            raise
+        finally:
+            self._profile.pause()
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._profile.finish(self._status)
+
+
+def profiled(user_key_func=None):
+    """
+    Decorador que perfila la vista cuando profile_reason lo indica
+
+    Args:
+        user_key_func: Función sin argumentos que devuelve el identificador del usuario
+
+    Returns:
+        La vista sin cambios si PROFILING_ENABLED está desactivado
+    """
+    def decorator(func):
+        if not PROFILING_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            user_key = user_key_func() if user_key_func else None
+            reason = profile_reason(user_key)
+            if reason is None:
+                return func(*args, **kwargs)
+
+            profile = RequestProfile(request.endpoint, request.path, reason, user_key)
+            try:
+                profile.resume()
+            except ValueError as e:
+                # Otro perfilador activo en este hilo
+                logger.warning(f"No se pudo perfilar la petición: {e}")
+                profile.discard()
+                return func(*args, **kwargs)
+
+            try:
+                response = make_response(func(*args, **kwargs))
+            except BaseException:
+                profile.finish(500)
+                raise
+            profile.pause()
+
+            if response.is_streamed:
+                response.response = _ProfiledIterable(response.response, profile, response.status_code)
+            else:
+                profile.finish(response.status_code)
+            response.headers['X-Profile-Id'] = profile.id
+            return response
+        return wrapper
+    return decorator
+
+
+def _profile_path(profile_id):
+    # profile_store._path valida el identificador
+    return profile_store._path(profile_id)[:-len('.json')] + '.prof'
+
+
+def save_profile(profile, status, duration):
+    """
+    Guardar el perfil (formato pstats) y sus datos en PROFILES_DIR
+
+    Returns:
+        Diccionario con los datos guardados
+    """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    stats = pstats.Stats(profile._profiler)
+    stats.dump_stats(_profile_path(profile.id))
+
+    summary = io.StringIO()
+    stats.stream = summary
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+    collector = profile._collector
+    data = {
+        'id': profile.id,
+        'endpoint': profile.endpoint,
+        'path': profile.path,
+        'reason': profile.reason,
+        'user_key': profile.user_key,
+        'status': status,
+        'created_at': time.time(),
+        'duration': duration,
+        'events': collector['events'],
+        'pages': collector['pages'],
+        'stages': collector['stages'],
+        'memory': collector.get('memory'),
+        'summary': summary.getvalue(),
+    }
+    profile_store.set(profile.id, data)
+    logger.info(f"Perfil {profile.id} guardado ({profile.reason}, {duration:.3f} s)", profile_id=profile.id)
+    prune_profiles()
+    return data
+
+
+def list_profiles():
+    """Datos de los perfiles guardados, del más reciente al más antiguo"""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILES_DIR):
+        if name.endswith('.json'):
+            data = profile_store.get(name[:-len('.json')])
+            if data:
+                profiles.append(data)
+    return sorted(profiles, key=lambda item: item['created_at'], reverse=True)
+
+
+def delete_profile(profile_id):
+    profile_store.delete(profile_id)
+    try:
+        os.remove(_profile_path(profile_id))
+    except FileNotFoundError:
+        pass
+
+
+def prune_profiles():
+    """Conservar solo los PROFILES_MAX perfiles más recientes"""
+    for data in list_profiles()[PROFILES_MAX:]:
+        delete_profile(data['id'])
+
+
+def init_profiling(app):
+    """
+    Registrar las rutas de descarga de perfiles (solo con PROFILING_ENABLED)
+
+    Las rutas responden 404 salvo que la petición traiga el token de administración.
+    """
+    if not PROFILING_ENABLED:
+        return
+
+    def require_admin():
+        if not is_admin_request():
+            abort(404)
+
+    @app.route('/debug/profiles')
+    def profiles_list():
+        require_admin()
+        return jsonify([{key: value for key, value in data.items() if key != 'summary'} for data in list_profiles()])
+
+    @app.route('/debug/profiles/<profile_id>')
+    def profile_detail(profile_id):
+        require_admin()
+        try:
+            data = profile_store.get(profile_id)
+        except ValueError:
+            data = None
+        if not data:
+            abort(404)
+        return jsonify(data)
+
+    @app.route('/debug/profiles/<profile_id>.prof')
+    def profile_download(profile_id):
+        require_admin()
+        try:
+            path = _profile_path(profile_id)
+        except ValueError:
+            abort(404)
+        if not os.path.exists(path):
+            abort(404)
+        return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{profile_id}.prof')
+
+    logger.info(f"Perfilado bajo demanda habilitado (perfiles en {PROFILES_DIR})")
@@ -0,0 +1,206 @@
+"""
+Utilidades para preparar el informe de resultados.
+Este módulo convierte el resumen semanal calculado por calculate_weekly_summary
+en las estructuras que usa results.html. Las filas de semanas se generan de
+forma perezosa para poder enviar la página en streaming, y el resumen se
+guarda (en segundos) para servir el resto de semanas por páginas.
+"""
+
+import uuid
+from itertools import islice
+from collections import defaultdict
+from datetime import date, timedelta
+
+# Local imports
+from calendar_utils import format_timedelta
+from config_utils import get_env_value
+from storage_utils import JsonFileStore
+
+# Tamaño mínimo de cada fragmento enviado al navegador en streaming
+STREAM_CHUNK_SIZE = 4096
+
+# Semanas incluidas en la página inicial; el resto se cargan al desplazarse
+REPORT_PAGE_SIZE = get_env_value('REPORT_PAGE_SIZE', 12, int)
+
+# Informes calculados, compartidos por todos los workers
+report_store = JsonFileStore(
+    get_env_value('REPORTS_DIR', 'cache/reports'),
+    ttl=get_env_value('REPORT_TTL', 3600, int),
+    cleanup_interval=get_env_value('STORE_CLEANUP_INTERVAL', 300, int)
+)
+
+
+def build_period_summary(weekly_summary):
+    """
+    Calcular los totales del período por servicio
+
+    Args:
+        weekly_summary: Diccionario {inicio de semana: {servicio: timedelta}}
+
+    Returns:
+        Tuple (lista de servicios con duración y porcentaje ordenada por
+        porcentaje descendente, tiempo total del período)
+    """
+    period_totals = defaultdict(timedelta)
+    for week_services in weekly_summary.values():
+        for service, time_spent in week_services.items():
+            period_totals[service] += time_spent
+
+    grand_total_time = sum(period_totals.values(), timedelta())
+    total_seconds = grand_total_time.total_seconds()
+
+    period_summary = []
+    for service, time_spent in period_totals.items():
+        percentage = 0
+        if total_seconds > 0:
+            percentage = round((time_spent.total_seconds() / total_seconds) * 100, 1)
+        period_summary.append({
+            'name': service,
+            'duration': format_timedelta(time_spent),
+            'percentage': percentage
+        })
+
+    # Ordenar por porcentaje descendente
+    period_summary.sort(key=lambda x: x['percentage'], reverse=True)
+    return period_summary, grand_total_time
+
+
+def build_week_row(week_start, week_services):
+    """
+    Preparar una semana para la plantilla
+
+    Returns:
+        Diccionario con fechas, servicios ordenados por nombre y total de la semana
+    """
+    services_list = [
+        {
+            'name': service,
+            'duration': format_timedelta(time_spent),
+            'color': None  # Opcionalmente, se podría añadir color si está disponible en la configuración
+        }
+        for service, time_spent in sorted(week_services.items())
+    ]
+    week_total = sum(week_services.values(), timedelta())
+
+    return {
+        'start_date': week_start.strftime('%d/%m/%Y'),
+        'end_date': (week_start + timedelta(days=6)).strftime('%d/%m/%Y'),
+        'services': services_list,
+        'total_hours': format_timedelta(week_total)
+    }
+
+
+def iter_week_rows(weekly_summary, limit=None):
+    """Generar las filas de semanas en orden cronológico, una a una (como máximo `limit`)"""
+    for week_start in islice(sorted(weekly_summary), limit):
+        yield build_week_row(week_start, weekly_summary[week_start])
+
+
+def build_config_summary(config):
+    """Resumen de la configuración usada, para la cabecera del informe"""
+    return {
+        'work_time': f"{config['work_start_time']} - {config['work_end_time']}",
+        'lunch': f"{config['lunch_duration_minutes']} min",
+        'default_service': config['default_service'],
+        'use_color_tags': config['use_color_tags']
+    }
+
+
+def buffered_stream(chunks, min_size=STREAM_CHUNK_SIZE):
+    """
+    Agrupar los fragmentos de una plantilla en streaming
+
+    Jinja produce muchos fragmentos pequeños; agruparlos evita enviar (y
+    comprimir) cientos de trozos de pocos bytes.
+    """
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def save_report(owner, weekly_summary, start_date, end_date):
+    """
+    Guardar el resumen semanal de un cálculo para consultarlo por páginas
+
+    Args:
+        owner: Identificador del usuario (get_user_key)
+        weekly_summary: Diccionario {inicio de semana: {servicio: timedelta}}
+        start_date, end_date: Rango del cálculo
+
+    Returns:
+        Identificador del informe
+    """
+    report_id = uuid.uuid4().hex
+    report_store.set(report_id, {
+        'owner': owner,
+        'range': [start_date.isoformat(), end_date.isoformat()],
+        'weeks': [
+            [week_start.isoformat(), {
+                service: time_spent.total_seconds()
+                for service, time_spent in weekly_summary[week_start].items()
+            }]
+            for week_start in sorted(weekly_summary)
+        ]
+    })
+    return report_id
+
+
+def get_report(report_id, owner):
+    """
+    Obtener un informe guardado
+
+    Returns:
+        Diccionario del informe o None si no existe, caducó o pertenece a otro usuario
+    """
+    try:
+        report = report_store.get(report_id)
+    except ValueError:
+        return None
+    if not report or report.get('owner') != owner:
+        return None
+    return report
+
+
+def iter_report_weeks(report, offset=0, limit=None):
+    """
+    Generar las semanas de un informe guardado como (inicio de semana, {servicio: timedelta})
+    """
+    weeks = report['weeks'][offset:offset + limit if limit is not None else None]
+    for week_start, services in weeks:
+        yield date.fromisoformat(week_start), {
+            service: timedelta(seconds=seconds) for service, seconds in services.items()
+        }
+
+
+def get_report_page(report, offset, limit):
+    """
+    Obtener una página de filas de semanas de un informe guardado
+
+    Returns:
+        Diccionario con las filas, el total de semanas y el desplazamiento siguiente (None al final)
+    """
+    offset = max(0, offset)
+    limit = max(1, min(limit, 100))
+    rows = [build_week_row(week_start, services)
+            for week_start, services in iter_report_weeks(report, offset, limit)]
+    total = len(report['weeks'])
+    next_offset = offset + limit
+    return {
+        'weeks': rows,
+        'total': total,
+        'next_offset': next_offset if next_offset < total else None
+    }
+
+
+def delete_reports(owner):
+    """Eliminar todos los informes de un usuario (al cerrar sesión)"""
+    if owner:
+        report_store.delete_matching(lambda report: report.get('owner') == owner)
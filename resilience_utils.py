@@ -0,0 +1,262 @@
+"""
+Utilidades de resiliencia para las llamadas a Google Calendar API.
+Este módulo contiene un circuit breaker, una caché de últimos resultados
+conocidos por usuario para servir datos (marcados como obsoletos) mientras
+la API de Google no responde, y un plazo máximo (deadline) por petición.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value
+
+# Estados del circuit breaker
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker simple y seguro entre hilos.
+
+    Tras `failure_threshold` fallos consecutivos el circuito se abre y
+    `allow_request` devuelve False durante `reset_timeout` segundos. Pasado
+    ese tiempo se permite una única petición de prueba (half-open): si tiene
+    éxito el circuito se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+
+    @property
+    def state(self):
+        """Estado actual del circuito (closed, open o half_open)"""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        now = self._clock()
+        if self._state == STATE_OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probe_started_at = None
+        # Una petición de prueba que nunca informó su resultado no bloquea el circuito
+        if (self._state == STATE_HALF_OPEN and self._probe_started_at is not None
+                and now - self._probe_started_at >= self.reset_timeout):
+            self._probe_started_at = None
+        return self._state
+
+    def allow_request(self):
+        """
+        Indicar si se puede realizar una llamada a la API
+
+        Returns:
+            True si el circuito está cerrado o se admite una petición de prueba
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return True
+            if state == STATE_HALF_OPEN and self._probe_started_at is None:
+                self._probe_started_at = self._clock()
+                return True
+            return False
+
+    def record_success(self):
+        """Registrar una llamada exitosa y cerrar el circuito"""
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info("Circuit breaker de Google Calendar cerrado")
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self):
+        """Registrar una llamada fallida y abrir el circuito si corresponde"""
+        with self._lock:
+            self._failures += 1
+            self._probe_started_at = None
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    logger.warning(f"Circuit breaker de Google Calendar abierto tras {self._failures} fallos")
+                self._state = STATE_OPEN
+                self._opened_at = self._clock()
+
+
+class StaleCache:
+    """
+    Caché LRU acotada y segura entre hilos con los últimos resultados
+    conocidos. Cada entrada guarda el instante en que se almacenó.
+
+    Además del número de entradas se puede limitar su tamaño total: `weigh`
+    calcula el peso de cada valor (p. ej. su número de eventos) y se descartan
+    las entradas menos usadas mientras la suma supere `max_weight`.
+    """
+
+    def __init__(self, max_entries=256, clock=time.time, max_weight=None, weigh=None):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._weight = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _entry_weight(self, value):
+        return self._weigh(value) if self._weigh else 0
+
+    def set(self, key, value):
+        """Guardar un valor, descartando las entradas más antiguas si se supera algún límite"""
+        with self._lock:
+            if key in self._entries:
+                self._weight -= self._entry_weight(self._entries[key][1])
+            self._entries[key] = (self._clock(), value)
+            self._entries.move_to_end(key)
+            self._weight += self._entry_weight(value)
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_weight is not None and self._weight > self.max_weight)):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._weight -= self._entry_weight(evicted)
+
+    def get(self, key):
+        """
+        Obtener un valor almacenado
+
+        Returns:
+            Tuple (valor, timestamp de almacenamiento) o (None, None)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            self._entries.move_to_end(key)
+            stored_at, value = entry
+            return value, stored_at
+
+    def delete(self, key):
+        """Eliminar una entrada si existe"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._weight -= self._entry_weight(entry[1])
+
+    def delete_matching(self, predicate):
+        """Eliminar las entradas cuya clave cumple una condición"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._weight -= self._entry_weight(self._entries.pop(key)[1])
+
+    def clear(self):
+        """Eliminar todas las entradas"""
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+
+class Deadline:
+    """
+    Plazo máximo para completar una petición.
+
+    Permite repartir el tiempo restante entre las llamadas a la API, limitando
+    cada una a `max_call_timeout` segundos.
+    """
+
+    def __init__(self, seconds, max_call_timeout=None, clock=time.monotonic):
+        self._clock = clock
+        self.expires_at = clock() + seconds
+        self.max_call_timeout = max_call_timeout
+
+    def remaining(self):
+        """Segundos restantes (nunca negativos)"""
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self):
+        """Indicar si el plazo se ha agotado"""
+        return self.remaining() <= 0
+
+    def call_timeout(self):
+        """Timeout a aplicar en la próxima llamada a la API"""
+        remaining = self.remaining()
+        if self.max_call_timeout:
+            return min(remaining, self.max_call_timeout)
+        return remaining
+
+
+def new_request_deadline():
+    """
+    Crear el plazo de una petición a /calculate según la configuración
+
+    Returns:
+        Objeto Deadline o None si está deshabilitado (CALCULATE_DEADLINE=0)
+    """
+    seconds = get_env_value('CALCULATE_DEADLINE', 25, float)
+    if not seconds or seconds <= 0:
+        return None
+    return Deadline(seconds, max_call_timeout=get_env_value('GOOGLE_API_TIMEOUT', 10, float))
+
+
+# Instancias por worker usadas por la aplicación
+calendar_breaker = CircuitBreaker(
+    failure_threshold=get_env_value('CIRCUIT_FAILURE_THRESHOLD', 5, int),
+    reset_timeout=get_env_value('CIRCUIT_RESET_TIMEOUT', 30, float)
+)
+# Eventos de la API guardados por worker (en total, sumando todos los usuarios y rangos)
+STALE_CACHE_MAX_EVENTS = get_env_value('STALE_CACHE_MAX_EVENTS', 20000, int)
+
+events_cache = StaleCache(
+    max_entries=get_env_value('STALE_CACHE_MAX_ENTRIES', 256, int),
+    max_weight=STALE_CACHE_MAX_EVENTS,
+    weigh=lambda ranges: sum(len(entry[3]) for entry in ranges)
+)
+
+# Rangos recientes guardados por usuario en events_cache
+STALE_RANGES_PER_USER = get_env_value('STALE_RANGES_PER_USER', 4, int)
+
+
+def remember_events(user_key, timezone_name, events, start_date, end_date):
+    """
+    Guardar los eventos completos de un rango para servirlos si Google no responde
+
+    Se conservan los STALE_RANGES_PER_USER rangos más recientes de cada usuario.
+    Un rango con más de STALE_CACHE_MAX_EVENTS eventos no se guarda (desplazaría
+    los de todos los demás usuarios).
+    """
+    if len(events) > STALE_CACHE_MAX_EVENTS:
+        return
+    ranges, _ = events_cache.get(user_key)
+    ranges = [entry for entry in ranges or [] if (entry[0], entry[1]) != (start_date, end_date)]
+    entry = (start_date, end_date, timezone_name, events, time.time())
+    events_cache.set(user_key, [entry] + ranges[:max(0, STALE_RANGES_PER_USER - 1)])
+
+
+def recall_events(user_key, start_date, end_date):
+    """
+    Últimos eventos conocidos de un usuario que cubren el rango pedido
+
+    Los eventos de un rango mayor sirven igual: el resumen solo cuenta los días pedidos.
+
+    Returns:
+        Tuple (nombre de la zona horaria, eventos, timestamp de almacenamiento) o None
+    """
+    ranges, _ = events_cache.get(user_key)
+    for cached_start, cached_end, timezone_name, events, stored_at in ranges or []:
+        if cached_start <= start_date and end_date <= cached_end:
+            return timezone_name, events, stored_at
+    return None
+
+
+def forget_events(user_key):
+    """Eliminar los eventos guardados de un usuario (al cerrar sesión)"""
+    if user_key:
+        events_cache.delete(user_key)
@@ -0,0 +1,239 @@
+"""
+Utilidades de resúmenes semanales consolidados.
+Una semana ya pasada no cambia, así que su resultado se guarda en SQLite
+(ROLLUP_DB_PATH) con una fila por usuario, huella de la configuración y
+semana. Cada fila guarda el tiempo laborable y reservado por servicio de cada
+día ya calculado de la semana, de modo que también sirve para las semanas que
+el rango corta a medias (los informes mensuales empiezan y acaban a mitad de
+semana). Un informe de un año lee unas cincuenta filas y solo obtiene de Google
+y clasifica los días que aún no están consolidados.
+
+Una semana se consolida cuando su domingo queda a más de ROLLUP_GRACE_DAYS
+días en el pasado (margen para los cambios de última hora en el calendario).
+Los días solo se reutilizan con la misma zona horaria del calendario con la
+que se calcularon, y cada fila se conserva como mucho ROLLUP_TTL segundos:
+pasado ese plazo se vuelve a calcular desde Google y se elimina. Al cerrar
+sesión se eliminan todas las semanas del usuario.
+"""
+
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value, config_fingerprint
+
+ROLLUPS_ENABLED = get_env_value('ROLLUPS_ENABLED', True, bool)
+ROLLUP_GRACE_DAYS = get_env_value('ROLLUP_GRACE_DAYS', 2, int)
+# Segundos que se conserva una semana consolidada (30 días por defecto)
+ROLLUP_TTL = get_env_value('ROLLUP_TTL', 30 * 24 * 3600, int)
+
+
+class RollupStore:
+    """
+    Semanas consolidadas en una base de datos SQLite compartida por todos los workers.
+    La base de datos se crea con la primera operación.
+    """
+
+    def __init__(self, path, ttl=None):
+        """
+        Args:
+            path: Ruta del fichero SQLite
+            ttl: Segundos que se conserva cada semana (None: sin límite)
+        """
+        self.path = path
+        self.ttl = ttl
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: sqlite3 no comparte conexiones entre hilos.
+        # `with conn` solo confirma o deshace la transacción; la conexión se cierra aquí.
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            if not self._ready:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with conn:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS weekly_rollups ('
+                        'user_key TEXT NOT NULL, config_hash TEXT NOT NULL, week_start TEXT NOT NULL, '
+                        'timezone TEXT NOT NULL, days TEXT NOT NULL, created REAL NOT NULL, '
+                        'PRIMARY KEY (user_key, config_hash, week_start))'
+                    )
+                self._ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _oldest(self):
+        """Instante de creación más antiguo que se conserva"""
+        return time.time() - self.ttl if self.ttl else 0
+
+    def _select(self, conn, user_key, config_hash, timezone_name, first_week, last_week):
+        rows = conn.execute(
+            'SELECT week_start, days FROM weekly_rollups '
+            'WHERE user_key = ? AND config_hash = ? AND timezone = ? AND created >= ? '
+            'AND week_start BETWEEN ? AND ?',
+            (user_key, config_hash, timezone_name, self._oldest(), first_week.isoformat(), last_week.isoformat())
+        ).fetchall()
+        return {date.fromisoformat(week_start): json.loads(days) for week_start, days in rows}
+
+    def get_weeks(self, user_key, config_hash, timezone_name, first_week, last_week):
+        """
+        Semanas guardadas entre dos lunes (inclusive) calculadas con una zona horaria
+
+        Returns:
+            Diccionario {lunes: lista de 7 días [segundos laborables, {servicio: segundos}]
+            o None si el día no se ha calculado}
+        """
+        with self._connect() as conn:
+            return self._select(conn, user_key, config_hash, timezone_name, first_week, last_week)
+
+    def put_weeks(self, user_key, config_hash, timezone_name, weeks):
+        """
+        Guardar semanas con el formato de get_weeks, conservando los días ya
+        guardados (con la misma zona horaria) que no se incluyan, y eliminar
+        las semanas caducadas de todos los usuarios
+        """
+        if not weeks:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            stored = self._select(conn, user_key, config_hash, timezone_name, min(weeks), max(weeks))
+            weeks = {
+                week_start: [day if day is not None else previous
+                             for day, previous in zip(days, stored.get(week_start, [None] * 7))]
+                for week_start, days in weeks.items()
+            }
+            conn.executemany(
+                'INSERT OR REPLACE INTO weekly_rollups '
+                '(user_key, config_hash, week_start, timezone, days, created) VALUES (?, ?, ?, ?, ?, ?)',
+                [(user_key, config_hash, week_start.isoformat(), timezone_name,
+                  json.dumps(days, ensure_ascii=False), now)
+                 for week_start, days in weeks.items()]
+            )
+            if self.ttl:
+                conn.execute('DELETE FROM weekly_rollups WHERE created < ?', (self._oldest(),))
+
+    def delete(self, user_key):
+        """Eliminar todas las semanas de un usuario (por ejemplo, tras cambios en semanas pasadas)"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM weekly_rollups WHERE user_key = ?', (user_key,))
+
+
+rollup_store = RollupStore(get_env_value('ROLLUP_DB_PATH', 'cache/rollups.sqlite3'), ROLLUP_TTL)
+
+
+def _monday(day):
+    return day - timedelta(days=day.weekday())
+
+
+def load_rollup_days(user_key, config, timezone_name, start_date, end_date):
+    """
+    Días del rango que pertenecen a semanas consolidadas
+
+    Args:
+        timezone_name: Zona horaria actual del calendario (None si no se conoce:
+            no se usa ninguna semana)
+
+    Returns:
+        Diccionario {día: (tiempo laborable, {servicio: timedelta})} con el
+        formato de calendar_time_tracker.summarize_days
+    """
+    if not ROLLUPS_ENABLED or not user_key or not timezone_name:
+        return {}
+    try:
+        weeks = rollup_store.get_weeks(user_key, config_fingerprint(config), timezone_name,
+                                       _monday(start_date), _monday(end_date))
+    except sqlite3.Error as e:
+        logger.error(f"Error al leer semanas consolidadas: {e}")
+        return {}
+
+    daily_totals = {}
+    for week_start, days in weeks.items():
+        for offset, totals in enumerate(days):
+            day = week_start + timedelta(days=offset)
+            if totals is not None and start_date <= day <= end_date:
+                potential, booked = totals
+                daily_totals[day] = (
+                    timedelta(seconds=potential),
+                    {service: timedelta(seconds=seconds) for service, seconds in booked.items()}
+                )
+    return daily_totals
+
+
+def pending_range(start_date, end_date, daily_totals):
+    """
+    Primer y último día del rango que faltan en daily_totals
+
+    Returns:
+        Tuple (inicio, fin) o None si el rango está completo
+    """
+    missing = [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+        if start_date + timedelta(days=offset) not in daily_totals
+    ]
+    if not missing:
+        return None
+    return missing[0], missing[-1]
+
+
+def save_rollups(user_key, config, timezone_name, daily_totals, start_date, end_date, today=None):
+    """
+    Consolidar los días del rango de las semanas cuyo domingo ya quedó atrás
+
+    Args:
+        daily_totals: Resultado de summarize_days para (al menos) el rango
+        today: Fecha actual en la zona horaria del calendario
+
+    Returns:
+        Número de semanas guardadas
+    """
+    if not ROLLUPS_ENABLED or not user_key:
+        return 0
+    today = today or date.today()
+
+    weeks = {}
+    week_start = _monday(start_date)
+    while week_start <= end_date:
+        if (today - (week_start + timedelta(days=6))).days <= ROLLUP_GRACE_DAYS:
+            break
+        days = []
+        for offset in range(7):
+            day = week_start + timedelta(days=offset)
+            if start_date <= day <= end_date:
+                potential, booked = daily_totals[day]
+                days.append([potential.total_seconds(),
+                             {service: duration.total_seconds() for service, duration in booked.items()}])
+            else:
+                days.append(None)
+        weeks[week_start] = days
+        week_start += timedelta(days=7)
+
+    if weeks:
+        try:
+            rollup_store.put_weeks(user_key, config_fingerprint(config), timezone_name, weeks)
+        except sqlite3.Error as e:
+            logger.error(f"Error al guardar semanas consolidadas: {e}")
+            return 0
+    return len(weeks)
+
+
+def delete_rollups(user_key):
+    """Eliminar las semanas consolidadas de un usuario (al cerrar sesión)"""
+    if not user_key:
+        return
+    try:
+        rollup_store.delete(user_key)
+    except sqlite3.Error as e:
+        logger.error(f"Error al eliminar semanas consolidadas: {e}")
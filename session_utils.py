@@ -0,0 +1,358 @@
+"""
+Utilidades para sesiones almacenadas en el servidor.
+Este módulo implementa una SessionInterface de Flask que guarda los datos de
+sesión (incluidas las credenciales OAuth) en el servidor y deja en la cookie
+solo un identificador opaco firmado. Respeta SESSION_TYPE (filesystem, sqlite,
+redis o cookie), SESSION_FILE_THRESHOLD y SESSION_USE_SIGNER.
+"""
+
+import os
+import re
+import time
+import random
+import sqlite3
+import secrets
+import threading
+from contextlib import contextmanager
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, want_bytes
+from loguru import logger
+from werkzeug.datastructures import CallbackDict
+
+# Importar redis si está disponible
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Formato de los identificadores generados por _generate_sid
+_VALID_SID = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+# Probabilidad de limpiar sesiones caducadas en cada escritura
+_CLEANUP_PROBABILITY = 0.01
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Sesión cuyo contenido vive en el servidor, identificada por `sid`"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Asignar un identificador nuevo conservando los datos (p. ej. tras iniciar sesión)"""
+        if self.sid and not self.new:
+            self.previous_sid = self.sid
+        self.sid = _generate_sid()
+        self.modified = True
+
+
+def _generate_sid():
+    return secrets.token_urlsafe(32)
+
+
+class FileSystemSessionBackend:
+    """
+    Sesiones en archivos, uno por sesión. Si se supera `threshold` archivos
+    se eliminan las sesiones caducadas y, si hace falta, las más antiguas.
+    """
+
+    def __init__(self, directory, threshold=500):
+        self.directory = directory
+        self.threshold = threshold
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def get(self, sid):
+        try:
+            with open(self._path(sid), 'r', encoding='utf-8') as f:
+                expires, data = f.read().split('\n', 1)
+            expired = float(expires) < time.time()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            # Archivo truncado o corrupto: se trata como una sesión caducada
+            logger.warning(f"Sesión ilegible descartada: {e}")
+            expired = True
+        if expired:
+            self.delete(sid)
+            return None
+        return data
+
+    def set(self, sid, data, ttl):
+        path = self._path(sid)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{time.time() + ttl}\n{data}")
+        os.replace(tmp_path, path)
+        self._enforce_threshold()
+
+    def touch(self, sid, ttl):
+        """Renovar la caducidad de una sesión sin cambiar sus datos"""
+        data = self.get(sid)
+        if data is None:
+            return
+        path = self._path(sid)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{time.time() + ttl}\n{data}")
+        os.replace(tmp_path, path)
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def _enforce_threshold(self):
+        try:
+            names = [name for name in os.listdir(self.directory) if not name.endswith('.tmp')]
+        except OSError:
+            return
+        if len(names) <= self.threshold:
+            return
+
+        # Primero las caducadas, luego las más antiguas
+        entries = []
+        for name in names:
+            if self.get(name) is None:
+                continue
+            try:
+                entries.append((os.path.getmtime(self._path(name)), name))
+            except OSError:
+                continue
+        entries.sort()
+        for _, name in entries[:max(0, len(entries) - self.threshold)]:
+            self.delete(name)
+
+
+class SqliteSessionBackend:
+    """
+    Sesiones en una base de datos SQLite compartida por todos los workers.
+    Sirve también como sustituto local de Redis.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions '
+                '(sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: sqlite3 no comparte conexiones entre hilos.
+        # `with conn` solo confirma o deshace la transacción; la conexión se cierra aquí.
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, sid):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT data FROM sessions WHERE sid = ? AND expires >= ?', (sid, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, ttl):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                (sid, data, time.time() + ttl)
+            )
+            if random.random() < _CLEANUP_PROBABILITY:
+                conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+    def touch(self, sid, ttl):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE sessions SET expires = ? WHERE sid = ? AND expires >= ?',
+                (time.time() + ttl, sid, time.time())
+            )
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class RedisSessionBackend:
+    """Sesiones en Redis, con caducidad gestionada por el propio Redis"""
+
+    def __init__(self, url, prefix='session:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, sid):
+        data = self.client.get(self.prefix + sid)
+        return data.decode('utf-8') if data is not None else None
+
+    def set(self, sid, data, ttl):
+        self.client.setex(self.prefix + sid, int(ttl), data)
+
+    def touch(self, sid, ttl):
+        self.client.expire(self.prefix + sid, int(ttl))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """SessionInterface que guarda los datos en `backend` y el identificador en la cookie"""
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, backend, use_signer=True):
+        self.backend = backend
+        self.use_signer = use_signer
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session', key_derivation='hmac')
+
+    def _sid_from_cookie(self, app, value):
+        if not value:
+            return None
+        sid = value
+        if self.use_signer:
+            try:
+                sid = self._signer(app).unsign(want_bytes(value)).decode('utf-8')
+            except BadSignature:
+                return None
+        # El identificador se usa como nombre de archivo o clave: rechazar valores inesperados
+        return sid if _VALID_SID.match(sid) else None
+
+    def _sid_to_cookie(self, app, sid):
+        if not self.use_signer:
+            return sid
+        return self._signer(app).sign(want_bytes(sid)).decode('utf-8')
+
+    def open_session(self, app, request):
+        # Los archivos estáticos no usan la sesión: no tocar el almacenamiento
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return self.session_class(new=True)
+
+        sid = self._sid_from_cookie(app, request.cookies.get(self.get_cookie_name(app)))
+        if sid:
+            try:
+                data = self.backend.get(sid)
+            except Exception as e:
+                logger.error(f"Error al leer la sesión del almacenamiento: {e}")
+                data = None
+            if data is not None:
+                try:
+                    return self.session_class(self.serializer.loads(data), sid=sid)
+                except Exception as e:
+                    logger.error(f"Sesión corrupta descartada: {e}")
+        return self.session_class(sid=_generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # La vista ya respondió: un fallo del almacenamiento se registra sin convertirse en un 500
+        if session.previous_sid:
+            try:
+                self.backend.delete(session.previous_sid)
+            except Exception as e:
+                logger.error(f"Error al eliminar la sesión anterior del almacenamiento: {e}")
+            session.previous_sid = None
+
+        # Sesión vaciada (p. ej. logout): borrar datos y cookie
+        if not session:
+            if session.modified and not session.new:
+                try:
+                    self.backend.delete(session.sid)
+                except Exception as e:
+                    logger.error(f"Error al eliminar la sesión del almacenamiento: {e}")
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            try:
+                self.backend.set(session.sid, self.serializer.dumps(dict(session)), ttl)
+            except Exception as e:
+                logger.error(f"Error al guardar la sesión en el almacenamiento: {e}")
+                return
+        elif app.config.get('SESSION_REFRESH_EACH_REQUEST', True) and not session.new:
+            # La caducidad cuenta desde el último acceso, no desde la última escritura
+            try:
+                self.backend.touch(session.sid, ttl)
+            except Exception as e:
+                logger.error(f"Error al renovar la caducidad de la sesión: {e}")
+                return
+        else:
+            return
+
+        response.set_cookie(
+            name,
+            self._sid_to_cookie(app, session.sid),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+        response.vary.add('Cookie')
+
+
+def create_session_backend(app):
+    """
+    Crear el almacenamiento de sesiones según SESSION_TYPE
+
+    Returns:
+        Backend de sesiones o None si se usan cookies firmadas (SESSION_TYPE=cookie)
+    """
+    session_type = (app.config.get('SESSION_TYPE') or 'filesystem').lower()
+
+    if session_type in ('cookie', 'null'):
+        return None
+
+    if session_type == 'redis':
+        redis_url = app.config.get('SESSION_REDIS_URL')
+        if REDIS_AVAILABLE and redis_url:
+            return RedisSessionBackend(redis_url)
+        logger.warning("Redis no disponible para sesiones, usando SQLite local como sustituto")
+        session_type = 'sqlite'
+
+    if session_type == 'sqlite':
+        return SqliteSessionBackend(app.config.get('SESSION_SQLITE_PATH', 'cache/sessions.sqlite3'))
+
+    if session_type != 'filesystem':
+        logger.warning(f"SESSION_TYPE '{session_type}' no soportado, usando filesystem")
+
+    return FileSystemSessionBackend(
+        app.config.get('SESSION_FILE_DIR', 'cache/sessions'),
+        threshold=app.config.get('SESSION_FILE_THRESHOLD', 500)
+    )
+
+
+def init_session(app):
+    """Configurar la aplicación para usar sesiones almacenadas en el servidor"""
+    backend = create_session_backend(app)
+    if backend is None:
+        return
+    app.session_interface = ServerSideSessionInterface(
+        backend, use_signer=app.config.get('SESSION_USE_SIGNER', True)
+    )
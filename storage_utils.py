@@ -0,0 +1,135 @@
+"""
+Utilidades de almacenamiento compartido entre workers.
+Este módulo contiene un almacén clave-valor sencillo basado en archivos JSON,
+pensado para datos temporales que deben ser visibles desde cualquier worker
+de gunicorn (trabajos en segundo plano, informes calculados, etc.).
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+from loguru import logger
+
+# Las claves se usan como nombre de archivo, así que solo se admiten caracteres seguros
+_VALID_KEY = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+class JsonFileStore:
+    """
+    Almacén clave-valor con un archivo JSON por entrada y caducidad por antigüedad.
+
+    Las escrituras son atómicas (archivo temporal + os.replace), por lo que
+    varios procesos pueden leer y escribir en el mismo directorio. Con
+    cleanup_interval, cada proceso elimina las entradas caducadas al escribir
+    como mucho una vez cada cleanup_interval segundos: las entradas que no se
+    vuelven a leer no se quedan en disco.
+    """
+
+    def __init__(self, directory, ttl=3600, clock=time.time, cleanup_interval=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._clock = clock
+        self._last_cleanup = None
+        self._cleanup_lock = threading.Lock()
+
+    def _path(self, key):
+        if not key or not _VALID_KEY.match(key):
+            raise ValueError(f"Clave de almacenamiento inválida: {key!r}")
+        return os.path.join(self.directory, f"{key}.json")
+
+    def set(self, key, value):
+        """Guardar un valor serializable a JSON"""
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._maybe_cleanup()
+
+    def _maybe_cleanup(self):
+        """Ejecutar cleanup si han pasado cleanup_interval segundos desde la última vez"""
+        if not self.cleanup_interval or not self.ttl:
+            return
+        now = self._clock()
+        with self._cleanup_lock:
+            if self._last_cleanup is not None and now - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = now
+        removed = self.cleanup()
+        if removed:
+            logger.info(f"Eliminadas {removed} entradas caducadas de {self.directory}")
+
+    def get(self, key):
+        """
+        Obtener un valor almacenado
+
+        Returns:
+            El valor deserializado o None si no existe o ha caducado
+        """
+        path = self._path(key)
+        try:
+            if self.ttl and self._clock() - os.path.getmtime(path) > self.ttl:
+                self.delete(key)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error al leer entrada '{key}' del almacén: {e}")
+            return None
+
+    def delete(self, key):
+        """Eliminar una entrada si existe"""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_matching(self, predicate):
+        """
+        Eliminar las entradas cuyo valor cumple una condición (p. ej. las de un usuario)
+
+        Returns:
+            Número de entradas eliminadas
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            value = self.get(key)
+            if value is not None and predicate(value):
+                self.delete(key)
+                removed += 1
+        return removed
+
+    def cleanup(self):
+        """
+        Eliminar las entradas caducadas
+
+        Returns:
+            Número de entradas eliminadas
+        """
+        if not self.ttl or not os.path.isdir(self.directory):
+            return 0
+
+        removed = 0
+        now = self._clock()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
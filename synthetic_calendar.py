@@ -0,0 +1,310 @@
+"""
+Generador de calendarios sintéticos para pruebas de rendimiento.
+
+Genera eventos con el mismo formato que devuelve Google Calendar API
+(events.list con singleEvents=True), de forma reproducible a partir de una
+semilla: eventos por día configurables, series recurrentes, eventos de día
+completo, ausencias (outOfOffice), tiempo de concentración y una distribución
+de colores. Los rangos que cruzan un cambio de horario (DST) se generan con
+el desfase correcto en cada evento.
+
+También puede escribirse en formato iCalendar (.ics), con las series como
+eventos recurrentes (RRULE), para probar la importación de ics_utils.py.
+
+Uso:
+    python synthetic_calendar.py --events 100000 --seed 1 -o eventos.json
+    python synthetic_calendar.py --start 2020-01-01 --end 2023-12-31 --format ics -o eventos.ics
+"""
+
+import sys
+import json
+import random
+import argparse
+import datetime
+
+import pytz
+
+# Colores de evento de Google Calendar ('1' a '11'); None = color del calendario
+DEFAULT_COLOR_WEIGHTS = {
+    None: 40, '1': 5, '2': 5, '3': 8, '4': 4, '5': 10, '6': 3,
+    '7': 8, '8': 2, '9': 10, '10': 3, '11': 2,
+}
+
+SUMMARIES = [
+    'Reunión de equipo', 'Revisión de código', 'Llamada con cliente', 'Planificación',
+    'Desarrollo', 'Soporte', 'Formación', 'Entrevista', 'Demo', 'Documentación', '',
+]
+
+DURATIONS_MINUTES = [15, 30, 30, 45, 60, 60, 60, 90, 120]
+
+# Nombres de los colores de Google usados en la propiedad COLOR de los .ics
+ICS_COLOR_NAMES = {
+    '1': 'lavender', '2': 'sage', '3': 'grape', '4': 'flamingo', '5': 'banana', '6': 'tangerine',
+    '7': 'peacock', '8': 'graphite', '9': 'blueberry', '10': 'basil', '11': 'tomato',
+}
+
+# Descripción de relleno: las exportaciones reales incluyen textos largos plegados
+ICS_DESCRIPTION = ('Orden del día: revisión del estado\\, próximos pasos y riesgos. '
+                   'Enlace de la videollamada y notas de la reunión anterior adjuntas. ') * 2
+
+
+def _weighted_choice(rng, weights):
+    values = list(weights)
+    return rng.choices(values, weights=[weights[value] for value in values], k=1)[0]
+
+
+def _timed_event(event_id, timezone, day, start_minutes, duration, summary, color_id=None, event_type='default'):
+    start = timezone.localize(datetime.datetime.combine(day, datetime.time.min) + datetime.timedelta(minutes=start_minutes))
+    end = timezone.normalize(start + datetime.timedelta(minutes=duration))
+    event = {
+        'id': event_id,
+        'status': 'confirmed',
+        'summary': summary,
+        'eventType': event_type,
+        'start': {'dateTime': start.isoformat(), 'timeZone': timezone.zone},
+        'end': {'dateTime': end.isoformat(), 'timeZone': timezone.zone},
+    }
+    if color_id:
+        event['colorId'] = color_id
+    return event
+
+
+def _all_day_event(event_id, day, summary, event_type='default', days=1):
+    return {
+        'id': event_id,
+        'status': 'confirmed',
+        'summary': summary,
+        'eventType': event_type,
+        'start': {'date': day.isoformat()},
+        'end': {'date': (day + datetime.timedelta(days=days)).isoformat()},
+    }
+
+
+def iter_synthetic_events(start_date, end_date=None, seed=0, events_per_day=8, timezone='Europe/Madrid',
+                          recurring_series=3, all_day_ratio=0.03, ooo_ratio=0.02, focus_ratio=0.05,
+                          color_weights=None, weekends=False, max_events=None):
+    """
+    Generar eventos sintéticos día a día, ordenados por hora de inicio
+
+    Args:
+        start_date: Primer día del calendario
+        end_date: Último día (inclusive); None para seguir hasta max_events
+        seed: Semilla del generador (mismos parámetros y semilla = mismos eventos)
+        events_per_day: Media de eventos sueltos por día laborable
+        timezone: Zona horaria de los eventos (nombre de pytz)
+        recurring_series: Número de series semanales (cada una en un día fijo)
+        all_day_ratio: Probabilidad diaria de un evento de día completo
+        ooo_ratio: Probabilidad diaria de una ausencia (outOfOffice) de día completo
+        focus_ratio: Proporción de eventos de tiempo de concentración
+        color_weights: Pesos por colorId (None = sin color)
+        weekends: Si es True también se generan eventos en fin de semana
+        max_events: Número máximo de eventos a generar
+
+    Returns:
+        Generador de eventos con el formato de Google Calendar API
+    """
+    if end_date is None and max_events is None:
+        raise ValueError("Se requiere end_date o max_events")
+
+    rng = random.Random(seed)
+    tz = pytz.timezone(timezone)
+    color_weights = color_weights or DEFAULT_COLOR_WEIGHTS
+
+    series = [
+        {
+            'id': f"serie{index:03d}",
+            'weekday': rng.randrange(5),
+            'start_minutes': rng.randrange(8 * 4, 17 * 4) * 15,
+            'duration': rng.choice(DURATIONS_MINUTES),
+            'summary': rng.choice(SUMMARIES[:-1]),
+            'color_id': _weighted_choice(rng, color_weights),
+        }
+        for index in range(recurring_series)
+    ]
+
+    produced = 0
+    day = start_date
+    while end_date is None or day <= end_date:
+        if day.weekday() < 5 or weekends:
+            day_events = []
+            day_id = day.strftime('%Y%m%d')
+
+            if rng.random() < ooo_ratio:
+                day_events.append((-1, _all_day_event(f"ooo{day_id}", day, 'Fuera de la oficina', 'outOfOffice')))
+            elif rng.random() < all_day_ratio:
+                day_events.append((-1, _all_day_event(f"allday{day_id}", day, rng.choice(SUMMARIES[:-1]))))
+
+            for item in series:
+                if item['weekday'] == day.weekday():
+                    event = _timed_event(f"{item['id']}_{day_id}", tz, day, item['start_minutes'],
+                                         item['duration'], item['summary'], item['color_id'])
+                    event['recurringEventId'] = item['id']
+                    event['originalStartTime'] = dict(event['start'])
+                    day_events.append((item['start_minutes'], event))
+
+            count = max(0, round(rng.gauss(events_per_day, events_per_day / 4)))
+            for index in range(count):
+                start_minutes = rng.randrange(8 * 4, 19 * 4) * 15
+                if rng.random() < focus_ratio:
+                    event = _timed_event(f"ev{day_id}{index:04d}", tz, day, start_minutes, 120,
+                                         'Focus time', event_type='focusTime')
+                else:
+                    event = _timed_event(f"ev{day_id}{index:04d}", tz, day, start_minutes,
+                                         rng.choice(DURATIONS_MINUTES), rng.choice(SUMMARIES),
+                                         _weighted_choice(rng, color_weights))
+                day_events.append((start_minutes, event))
+
+            day_events.sort(key=lambda item: item[0])
+            for _, event in day_events:
+                if max_events is not None and produced >= max_events:
+                    return
+                produced += 1
+                yield event
+
+        day += datetime.timedelta(days=1)
+
+
+def generate_calendar(start_date, end_date=None, **kwargs):
+    """Lista de eventos sintéticos (ver iter_synthetic_events)"""
+    return list(iter_synthetic_events(start_date, end_date, **kwargs))
+
+
+def dst_range(year=2023, weeks=2, timezone='Europe/Madrid'):
+    """
+    Rango de fechas que cruza el cambio de horario de primavera de una zona horaria
+
+    Returns:
+        Tuple (fecha de inicio, fecha de fin)
+    """
+    tz = pytz.timezone(timezone)
+    transitions = [t.date() for t in getattr(tz, '_utc_transition_times', []) if t.year == year]
+    change = transitions[0] if transitions else datetime.date(year, 3, 31)
+    return change - datetime.timedelta(weeks=weeks), change + datetime.timedelta(weeks=weeks)
+
+
+def synthetic_config(use_color_tags=True):
+    """Configuración de usuario con servicios asignados a varios colores"""
+    from config_utils import get_default_config
+
+    config = get_default_config()
+    config['use_color_tags'] = use_color_tags
+    config['group_unlabeled'] = True
+    config['color_tags'] = {'3': 'PROYECTO A', '5': 'PROYECTO B', '7': 'SOPORTE', '9': 'FORMACIÓN'}
+    return config
+
+
+def _ics_fold(line):
+    """Plegar una línea de iCalendar en fragmentos de 75 octetos (RFC 5545, 3.1)"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        # No cortar un carácter UTF-8 por la mitad
+        while limit < len(data) and (data[limit] & 0xC0) == 0x80:
+            limit -= 1
+        parts.append(data[:limit].decode('utf-8'))
+        data = data[limit:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics_escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_time(value, timezone):
+    """Propiedad de fecha de iCalendar a partir de start/end de la API"""
+    if 'date' in value:
+        return f";VALUE=DATE:{value['date'].replace('-', '')}"
+    moment = datetime.datetime.fromisoformat(value['dateTime']).astimezone(timezone)
+    return f";TZID={timezone.zone}:{moment.strftime('%Y%m%dT%H%M%S')}"
+
+
+def _ics_event(event, timezone, rrule=None):
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:{event.get('recurringEventId') if rrule else event['id']}@synthetic",
+        f"DTSTART{_ics_time(event['start'], timezone)}",
+        f"DTEND{_ics_time(event['end'], timezone)}",
+    ]
+    if rrule:
+        lines.append(f'RRULE:{rrule}')
+    lines.append(f"SUMMARY:{_ics_escape(event.get('summary', ''))}")
+    lines.append(f'DESCRIPTION:{ICS_DESCRIPTION}')
+    if event.get('colorId'):
+        lines.append(f"COLOR:{ICS_COLOR_NAMES[event['colorId']]}")
+    if event.get('eventType') == 'outOfOffice':
+        lines.append('X-MICROSOFT-CDO-BUSYSTATUS:OOF')
+    lines.append('END:VEVENT')
+    return ''.join(_ics_fold(line) for line in lines)
+
+
+def write_ics(events, output, timezone='Europe/Madrid'):
+    """
+    Escribir eventos sintéticos en formato iCalendar
+
+    Las instancias de cada serie se escriben como un único evento con
+    RRULE semanal hasta la última instancia generada.
+    """
+    tz = pytz.timezone(timezone)
+    output.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Calendar Work Time Tracker//synthetic//ES\r\n')
+    output.write(f'X-WR-TIMEZONE:{timezone}\r\n')
+    series = {}
+    for event in events:
+        series_id = event.get('recurringEventId')
+        if series_id:
+            first, _ = series.get(series_id, (event, None))
+            series[series_id] = (first, event)
+            continue
+        output.write(_ics_event(event, tz))
+    for first, last in series.values():
+        until = datetime.datetime.fromisoformat(last['start']['dateTime']).astimezone(pytz.utc)
+        output.write(_ics_event(first, tz, f"FREQ=WEEKLY;UNTIL={until.strftime('%Y%m%dT%H%M%SZ')}"))
+    output.write('END:VCALENDAR\r\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generar un calendario sintético en formato de Google Calendar API')
+    parser.add_argument('--start', default='2023-01-02', help='Primer día (AAAA-MM-DD)')
+    parser.add_argument('--end', default=None, help='Último día (AAAA-MM-DD)')
+    parser.add_argument('--events', type=int, default=None, help='Número máximo de eventos')
+    parser.add_argument('--events-per-day', type=float, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timezone', default='Europe/Madrid')
+    parser.add_argument('--recurring', type=int, default=3, help='Series recurrentes semanales')
+    parser.add_argument('--all-day-ratio', type=float, default=0.03)
+    parser.add_argument('--ooo-ratio', type=float, default=0.02)
+    parser.add_argument('--format', choices=['json', 'ics'], default='json')
+    parser.add_argument('-o', '--output', default='-', help='Archivo de salida (- para stdout)')
+    args = parser.parse_args(argv)
+
+    if args.end is None and args.events is None:
+        parser.error('Indique --end o --events')
+
+    events = iter_synthetic_events(
+        datetime.date.fromisoformat(args.start),
+        datetime.date.fromisoformat(args.end) if args.end else None,
+        seed=args.seed, events_per_day=args.events_per_day, timezone=args.timezone,
+        recurring_series=args.recurring, all_day_ratio=args.all_day_ratio,
+        ooo_ratio=args.ooo_ratio, max_events=args.events
+    )
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        if args.format == 'ics':
+            write_ics(events, output, args.timezone)
+            return 0
+        # Escribir evento a evento para no tener el calendario completo en memoria
+        output.write(f'{{"timezone": {json.dumps(args.timezone)}, "items": [')
+        for index, event in enumerate(events):
+            output.write((',\n' if index else '\n') + json.dumps(event, ensure_ascii=False))
+        output.write('\n]}\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Utilidades de compilación de plantillas.
+Jinja compila cada plantilla a código Python la primera vez que se usa, y cada
+worker nuevo de gunicorn vuelve a hacerlo (config.html tiene scripts en línea
+muy grandes). Con TEMPLATE_BYTECODE_CACHE el código compilado se guarda en
+TEMPLATE_CACHE_DIR y lo reutilizan los demás workers y los reinicios;
+warm_templates() compila todas las plantillas por adelantado al arrancar.
+"""
+
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from loguru import logger
+
+# Local imports
+from config_utils import get_env_value
+
+TEMPLATE_CACHE_DIR = get_env_value('TEMPLATE_CACHE_DIR', 'cache/templates')
+
+
+def init_template_cache(app, cache_dir=None):
+    """
+    Guardar el código compilado de las plantillas en disco (solo con TEMPLATE_BYTECODE_CACHE)
+
+    Jinja comprueba el código fuente de cada plantilla al cargarla, así que una
+    plantilla modificada se vuelve a compilar aunque esté en la caché.
+    """
+    if not get_env_value('TEMPLATE_BYTECODE_CACHE', True, bool):
+        return
+
+    cache_dir = cache_dir or TEMPLATE_CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        logger.error(f"No se pudo crear el directorio de caché de plantillas {cache_dir}: {e}")
+        return
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def warm_templates(app):
+    """
+    Compilar por adelantado todas las plantillas de la aplicación
+
+    Returns:
+        Número de plantillas compiladas
+    """
+    start = time.perf_counter()
+    compiled = 0
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            logger.error(f"Error al compilar la plantilla {name}: {e}")
+    logger.info(f"{compiled} plantillas compiladas en {(time.perf_counter() - start) * 1000:.0f} ms")
+    return compiled
@@ -2,10 +2,12 @@
 Tests unitarios para la aplicación Calendar Time Tracker.
 """
 
+import os
 import unittest
 import datetime
 from datetime import time, timedelta, date
 import json
+import threading
 import pytz
 from unittest.mock import patch, MagicMock
 from collections import defaultdict
@@ -13,6 +15,10 @@ from collections import defaultdict
 from config_utils import clean_env_value, get_default_config, validate_config
 from calendar_utils import format_timedelta, assign_service, parse_datetime_api
 from calendar_time_tracker import calculate_weekly_summary, get_calendar_timezone, get_events
+from calendar_time_tracker import get_events_until_deadline, last_complete_week_end
+import resilience_utils
+from resilience_utils import (CircuitBreaker, StaleCache, Deadline, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN,
+                              remember_events, recall_events, forget_events)
 
 class TestConfigUtils(unittest.TestCase):
     """Pruebas para las utilidades de configuración"""
@@ -498,5 +504,2028 @@ class TestAssignService(unittest.TestCase):
             "La capitalización no debería afectar la detección de Focus Time"
         )
 
+class TestResilienceUtils(unittest.TestCase):
+    """Pruebas para el circuit breaker y la caché de datos obsoletos"""
+    
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=lambda: self.now)
+    
+    def test_breaker_opens_after_threshold(self):
+        """El circuito se abre tras los fallos consecutivos configurados"""
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertFalse(self.breaker.allow_request())
+    
+    def test_breaker_half_open_probe(self):
+        """Pasado el timeout se admite una única petición de prueba"""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now = 10
+        self.assertEqual(self.breaker.state, STATE_HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        
+        # Si la prueba falla el circuito vuelve a abrirse
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        
+        # Si la prueba tiene éxito el circuito se cierra
+        self.now = 20
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+    
+    def test_stale_cache_is_bounded(self):
+        """La caché descarta las entradas menos usadas"""
+        cache = StaleCache(max_entries=2, clock=lambda: 123.0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), (1, 123.0))
+        self.assertEqual(cache.get('b'), (None, None))
+        self.assertEqual(cache.get('c'), (3, 123.0))
+    
+    @patch('rollup_utils.ROLLUPS_ENABLED', False)
+    @patch('app.get_events_until_deadline')
+    @patch('app.fetch_calendar_timezone')
+    @patch('app.authenticate_google_calendar')
+    def test_calculate_serves_stale_events_when_open(self, mock_auth, mock_tz, mock_get_events):
+        """Con el circuito abierto /calculate usa los eventos en caché sin llamar a Google"""
+        import app as app_module
+        
+        credentials = {'token': 't', 'refresh_token': 'r', 'client_id': 'c'}
+        # Rango guardado más amplio que el solicitado
+        remember_events(app_module.get_user_key(credentials), 'Europe/Madrid', [{
+            'summary': 'Reunión',
+            'start': {'dateTime': '2023-05-01T10:00:00+02:00'},
+            'end': {'dateTime': '2023-05-01T11:00:00+02:00'},
+        }], date(2023, 4, 24), date(2023, 5, 7))
+        
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['credentials'] = credentials
+        with patch.object(app_module, 'calendar_breaker', breaker):
+            response = client.post('/calculate', data={
+                'start_date': '2023-05-01',
+                'end_date': '2023-05-05',
+                'config': json.dumps(get_default_config())
+            })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('datos guardados', response.get_data(as_text=True))
+        mock_auth.assert_not_called()
+        mock_get_events.assert_not_called()
+        resilience_utils.events_cache.clear()
+    
+    def test_events_cache_bounded_by_event_count(self):
+        """La caché de eventos descarta usuarios antiguos al superar el total de eventos"""
+        cache = StaleCache(max_entries=10, max_weight=5, weigh=lambda ranges: sum(len(entry[3]) for entry in ranges))
+        with patch('resilience_utils.events_cache', cache), patch('resilience_utils.STALE_CACHE_MAX_EVENTS', 5):
+            remember_events('a', 'UTC', ['e'] * 3, date(2023, 5, 1), date(2023, 5, 31))
+            remember_events('b', 'UTC', ['e'] * 2, date(2023, 5, 1), date(2023, 5, 31))
+            remember_events('c', 'UTC', ['e'] * 2, date(2023, 5, 1), date(2023, 5, 31))
+            self.assertIsNone(recall_events('a', date(2023, 5, 1), date(2023, 5, 31)))
+            self.assertIsNotNone(recall_events('b', date(2023, 5, 1), date(2023, 5, 31)))
+            
+            # Un rango mayor que el límite no se guarda ni desplaza a los demás
+            remember_events('d', 'UTC', ['e'] * 6, date(2023, 5, 1), date(2023, 5, 31))
+            self.assertIsNone(recall_events('d', date(2023, 5, 1), date(2023, 5, 31)))
+            self.assertIsNotNone(recall_events('c', date(2023, 5, 1), date(2023, 5, 31)))
+            
+            forget_events('b')
+            remember_events('c', 'UTC', ['e'] * 3, date(2023, 6, 1), date(2023, 6, 30))
+            self.assertEqual(cache._weight, 5)
+    
+    def test_recall_events_matches_contained_ranges(self):
+        """Los eventos guardados sirven para cualquier rango contenido en el guardado"""
+        with patch('resilience_utils.events_cache', StaleCache(max_entries=4)), \
+                patch('resilience_utils.time.time', return_value=50.0):
+            remember_events('u', 'UTC', ['a'], date(2023, 5, 1), date(2023, 5, 31))
+            remember_events('u', 'UTC', ['b'], date(2023, 6, 1), date(2023, 6, 30))
+            self.assertEqual(recall_events('u', date(2023, 5, 8), date(2023, 5, 14)), ('UTC', ['a'], 50.0))
+            self.assertEqual(recall_events('u', date(2023, 6, 1), date(2023, 6, 30)), ('UTC', ['b'], 50.0))
+            self.assertIsNone(recall_events('u', date(2023, 5, 29), date(2023, 6, 4)))
+            self.assertIsNone(recall_events('v', date(2023, 5, 8), date(2023, 5, 14)))
+    
+    @patch('rollup_utils.ROLLUPS_ENABLED', False)
+    @patch('app.get_event_index', return_value=None)
+    @patch('app.authenticate_google_calendar', side_effect=OSError('sin conexión'))
+    def test_calculate_records_auth_failures(self, mock_auth, mock_index):
+        """Un error al conectar con Google cuenta como fallo del circuit breaker"""
+        import app as app_module
+        
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['credentials'] = {'token': 't', 'refresh_token': 'r', 'client_id': 'c'}
+        with patch.object(app_module, 'calendar_breaker', breaker):
+            response = client.post('/calculate', data={
+                'start_date': '2023-05-01',
+                'end_date': '2023-05-05',
+                'config': json.dumps(get_default_config())
+            })
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+class TestDeadline(unittest.TestCase):
+    """Pruebas para el plazo máximo de /calculate y los resultados parciales"""
+    
+    def setUp(self):
+        self.now = 0.0
+        self.timezone = pytz.timezone('Europe/Madrid')
+    
+    def test_call_timeout_is_capped(self):
+        """El timeout de cada llamada no supera el máximo ni el tiempo restante"""
+        deadline = Deadline(25, max_call_timeout=10, clock=lambda: self.now)
+        self.assertEqual(deadline.call_timeout(), 10)
+        self.now = 20
+        self.assertEqual(deadline.call_timeout(), 5)
+        self.now = 30
+        self.assertTrue(deadline.expired())
+        self.assertEqual(deadline.remaining(), 0)
+    
+    def test_last_complete_week_end(self):
+        """Solo cuentan las semanas completas hasta la fecha indicada"""
+        self.assertEqual(last_complete_week_end(date(2023, 5, 7)), date(2023, 5, 7))   # Domingo
+        self.assertEqual(last_complete_week_end(date(2023, 5, 10)), date(2023, 5, 7))  # Miércoles
+    
+    def test_get_events_stops_at_deadline(self):
+        """Al agotarse el plazo se devuelven los eventos obtenidos y la fecha completa"""
+        deadline = Deadline(10, clock=lambda: self.now)
+        first_page = {
+            'items': [{'start': {'dateTime': '2023-05-10T10:00:00+02:00'},
+                       'end': {'dateTime': '2023-05-10T11:00:00+02:00'}}],
+            'nextPageToken': 'page-2'
+        }
+        
+        def execute():
+            self.now = 11  # La primera página consume todo el plazo
+            return first_page
+        
+        mock_service = MagicMock()
+        mock_service.events().list.return_value.execute.side_effect = execute
+        
+        events, complete_until = get_events_until_deadline(
+            mock_service, date(2023, 5, 1), date(2023, 5, 31), self.timezone, deadline
+        )
+        self.assertEqual(events, first_page['items'])
+        self.assertEqual(complete_until, date(2023, 5, 9))
+        self.assertEqual(mock_service.events().list.return_value.execute.call_count, 1)
+    
+    def test_get_events_error_without_deadline(self):
+        """Un error antes del plazo sigue devolviendo None"""
+        mock_service = MagicMock()
+        mock_service.events().list.return_value.execute.side_effect = Exception('boom')
+        deadline = Deadline(10, clock=lambda: self.now)
+        self.assertIsNone(get_events_until_deadline(
+            mock_service, date(2023, 5, 1), date(2023, 5, 31), self.timezone, deadline
+        ))
+    
+    def test_timezone_fails_when_deadline_expires(self):
+        """Sin respuesta de Google dentro del plazo no se usa la zona horaria local"""
+        def execute():
+            self.now = 11
+            raise TimeoutError('timed out')
+        
+        mock_service = MagicMock()
+        mock_service.settings().get.return_value.execute.side_effect = execute
+        self.assertIsNone(get_calendar_timezone(mock_service, Deadline(10, clock=lambda: self.now)))
+        
+        # Sin plazo se mantiene la zona horaria de respaldo
+        mock_service.settings().get.return_value.execute.side_effect = Exception('boom')
+        self.assertIsNotNone(get_calendar_timezone(mock_service))
+
+class TestBackgroundJobs(unittest.TestCase):
+    """Pruebas para los trabajos en segundo plano"""
+    
+    def test_job_result_visible_only_to_owner(self):
+        """El resultado de un trabajo solo lo puede consultar su propietario"""
+        import tempfile
+        import background_utils
+        from storage_utils import JsonFileStore
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(background_utils, 'job_store', JsonFileStore(tmp)):
+                job_id = background_utils.submit_job('user-a', lambda x: {'value': x}, 42)
+                background_utils._get_executor().submit(lambda: None).result()
+                for _ in range(50):
+                    job = background_utils.get_job(job_id, 'user-a')
+                    if job['status'] != background_utils.JOB_PENDING:
+                        break
+                    threading.Event().wait(0.01)
+                self.assertEqual(job['status'], background_utils.JOB_DONE)
+                self.assertEqual(job['result'], {'value': 42})
+                self.assertIsNone(background_utils.get_job(job_id, 'user-b'))
+                self.assertIsNone(background_utils.get_job('../etc/passwd', 'user-a'))
+                
+                background_utils.delete_job(job_id, 'user-b')
+                self.assertIsNotNone(background_utils.get_job(job_id, 'user-a'))
+                background_utils.delete_job(job_id, 'user-a')
+                self.assertIsNone(background_utils.get_job(job_id, 'user-a'))
+    
+    def test_expired_entries_purged_on_write(self):
+        """Las entradas caducadas se eliminan al escribir otras, como mucho una vez por intervalo"""
+        import tempfile
+        from storage_utils import JsonFileStore
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            now = [1000.0]
+            store = JsonFileStore(tmp, ttl=60, clock=lambda: now[0], cleanup_interval=300)
+            store.set('antigua', {'eventos': []})
+            os.utime(os.path.join(tmp, 'antigua.json'), (900, 900))
+            
+            now[0] = 1100.0  # Dentro del intervalo: no se purga
+            store.set('nueva', {})
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'antigua.json')))
+            
+            now[0] = 1300.0
+            os.utime(os.path.join(tmp, 'nueva.json'), (1290, 1290))
+            store.set('otra', {})
+            self.assertEqual(sorted(os.listdir(tmp)), ['nueva.json', 'otra.json'])
+
+class TestHttpUtils(unittest.TestCase):
+    """Pruebas para el transporte HTTP compartido"""
+    
+    def _response(self, status, content=b'{}'):
+        response = MagicMock()
+        response.status_code = status
+        response.reason = 'OK' if status == 200 else 'Unauthorized'
+        response.headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        response.content = content
+        return response
+    
+    def test_shared_session_is_reused(self):
+        """Todos los usuarios del worker comparten la misma sesión"""
+        from http_utils import get_shared_session
+        self.assertIs(get_shared_session(), get_shared_session())
+    
+    def test_request_refreshes_on_401(self):
+        """Ante un 401 se renuevan las credenciales y se reintenta una vez"""
+        from http_utils import PooledAuthorizedHttp
+        
+        session = MagicMock()
+        session.request.side_effect = [self._response(401), self._response(200, b'{"ok": true}')]
+        credentials = MagicMock()
+        http = PooledAuthorizedHttp(credentials, session=session, timeout=5)
+        
+        resp, content = http.request('https://example.com/api', 'GET', headers={'accept': 'application/json'})
+        
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(content, b'{"ok": true}')
+        self.assertNotIn('content-encoding', resp)
+        credentials.refresh.assert_called_once()
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(session.request.call_args.kwargs['timeout'], 5)
+    
+    def test_expired_token_refreshed_through_callback(self):
+        """Un token expirado se renueva con el callback (con lock por usuario), no en before_request"""
+        from http_utils import PooledAuthorizedHttp
+        
+        session = MagicMock()
+        session.request.return_value = self._response(200)
+        expired, refreshed = MagicMock(expired=True), MagicMock(expired=False)
+        refresh = MagicMock(return_value=refreshed)
+        http = PooledAuthorizedHttp(expired, session=session, refresh=refresh)
+        
+        http.request('https://example.com/api')
+        http.request('https://example.com/api')
+        
+        refresh.assert_called_once_with(expired)
+        expired.before_request.assert_not_called()
+        self.assertEqual(refreshed.before_request.call_count, 2)
+
+class TestAsyncCalendar(unittest.TestCase):
+    """Pruebas del cliente asíncrono contra un servidor local falso"""
+    
+    def setUp(self):
+        from fake_calendar_server import FakeCalendar, FakeCalendarServer
+        
+        calendar = FakeCalendar([
+            {'summary': 'Reunión', 'colorId': '1',
+             'start': {'dateTime': '2023-05-01T10:00:00+02:00'},
+             'end': {'dateTime': '2023-05-01T11:00:00+02:00'}},
+            {'summary': 'Reunión 2', 'colorId': '1',
+             'start': {'dateTime': '2023-05-02T10:00:00+02:00'},
+             'end': {'dateTime': '2023-05-02T12:00:00+02:00'}},
+        ])
+        calendar.issue_token('fresh-token')
+        self.server = FakeCalendarServer(calendar)
+        self.server.start_in_thread()
+        self.token_uri = self.server.environment()['GOOGLE_TOKEN_URI']
+        self.base_url = self.server.environment()['GOOGLE_API_BASE_URL']
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_calculate_many_users(self):
+        """Se calculan varios usuarios a la vez, renovando el token caducado"""
+        from async_calendar import run_calculations
+        
+        config = get_default_config()
+        config['use_color_tags'] = True
+        config['color_tags'] = {'1': 'Proyecto A'}
+        jobs = [{
+            'credentials': {'token': token, 'refresh_token': 'r', 'client_id': 'c',
+                            'client_secret': 's', 'token_uri': self.token_uri},
+            'start_date': date(2023, 5, 1),
+            'end_date': date(2023, 5, 5),
+            'config': config
+        } for token in ('fresh-token', 'expired-token')]
+        
+        results = run_calculations(jobs, concurrency=2, base_url=self.base_url)
+        
+        for result in results:
+            self.assertEqual(result['timezone'], 'Europe/Madrid')
+            self.assertEqual(result['events_count'], 2)
+            self.assertEqual(result['weekly_summary'][date(2023, 5, 1)]['Proyecto A'], timedelta(hours=3))
+        self.assertIsNone(results[0]['credentials'])
+        self.assertTrue(results[1]['credentials']['token'].startswith('fake-access-'))
+    
+    def test_timezone_fallback_matches_sync_path(self):
+        """Sin zona horaria de Google el cliente asíncrono usa la misma de respaldo que /calculate"""
+        import asyncio
+        from async_calendar import AsyncCalendarClient
+        from calendar_time_tracker import fetch_calendar_timezone
+        
+        service = MagicMock()
+        service.settings().get.return_value.execute.side_effect = Exception('boom')
+        calendar = AsyncCalendarClient({'token': 'fresh-token'}, MagicMock(), self.base_url)
+        with patch.object(calendar, 'get_settings', side_effect=OSError('sin conexión')):
+            timezone = asyncio.run(calendar.get_timezone())
+        self.assertEqual(fetch_calendar_timezone(service), (timezone, False))
+    
+    def test_batch_summary_from_google(self):
+        """batch_summary --google obtiene los calendarios con el cliente asíncrono sin modificar la configuración"""
+        import tempfile
+        import batch_summary
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs = os.path.join(tmp, 'credenciales')
+            output = os.path.join(tmp, 'informes')
+            os.makedirs(inputs)
+            for user, token in (('ana', 'fresh-token'), ('luis', 'expired-token')):
+                with open(os.path.join(inputs, f'{user}.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'token': token, 'refresh_token': 'r', 'client_id': 'c',
+                               'client_secret': 's', 'token_uri': self.token_uri}, f)
+            # Con --google los .ics del directorio no son credenciales: se ignoran
+            with open(os.path.join(inputs, 'exportado.ics'), 'w', encoding='utf-8') as f:
+                f.write('BEGIN:VCALENDAR\nEND:VCALENDAR\n')
+            config = {'work_start_time': '09:00', 'work_end_time': '17:00'}
+            with open(os.path.join(tmp, 'config.json'), 'w', encoding='utf-8') as f:
+                json.dump(config, f)
+            
+            # ... y si se indican explícitamente, se rechazan con un error claro
+            with patch('sys.stderr'), self.assertRaises(SystemExit):
+                batch_summary.main([os.path.join(inputs, 'exportado.ics'), '--month', '2023-05', '--google'])
+            
+            with patch.dict('os.environ', {'GOOGLE_API_BASE_URL': self.base_url}):
+                code = batch_summary.main([inputs, '--start-date', '2023-05-01', '--end-date', '2023-05-05',
+                                           '--google', '--config', os.path.join(tmp, 'config.json'),
+                                           '--output-dir', output])
+            self.assertEqual(code, 0)
+            self.assertFalse(os.path.exists(os.path.join(output, 'exportado.json')))
+            for user in ('ana', 'luis'):
+                with open(os.path.join(output, f'{user}.json'), encoding='utf-8') as f:
+                    report = json.load(f)
+                self.assertEqual(report['events'], 2)
+                self.assertEqual(report['timezone'], 'Europe/Madrid')
+                self.assertEqual(sum(report['period'].values()), 35 * 3600)
+        
+        # validate_config trabaja sobre una copia
+        validate_config(config)
+        self.assertEqual(config, {'work_start_time': '09:00', 'work_end_time': '17:00'})
+
+class TestConcurrencySafety(unittest.TestCase):
+    """Pruebas del estado compartido bajo workers con hilos"""
+    
+    @patch.dict('os.environ', {'GOOGLE_CLIENT_ID': 'id', 'GOOGLE_CLIENT_SECRET': 'secret',
+                               'GOOGLE_REDIRECT_URI': 'http://localhost/oauth2callback'})
+    def test_oauth_flow_not_shared_between_requests(self):
+        """Cada petición recibe su propio flujo OAuth"""
+        from auth_utils import get_oauth_flow, get_authorization_url
+        
+        flow_a = get_oauth_flow(force_new=True)
+        flow_b = get_oauth_flow()
+        self.assertIsNot(flow_a, flow_b)
+        self.assertIsNot(flow_a.oauth2session, flow_b.oauth2session)
+        auth_url, _ = get_authorization_url()
+        self.assertIn('redirect_uri=http%3A%2F%2Flocalhost%2Foauth2callback', auth_url)
+    
+    def test_complete_oauth_flow_uses_session_verifier(self):
+        """El intercambio del código usa el code verifier del propio usuario"""
+        import auth_utils
+        
+        flow = MagicMock()
+        with patch.object(auth_utils, 'get_oauth_flow', return_value=flow):
+            creds = auth_utils.complete_oauth_flow('code', 'verifier-a')
+        self.assertEqual(flow.code_verifier, 'verifier-a')
+        flow.fetch_token.assert_called_once_with(code='code')
+        self.assertIs(creds, flow.credentials)
+    
+    def test_gunicorn_config_uses_threaded_workers(self):
+        """La configuración de Gunicorn usa por defecto workers con hilos"""
+        with patch.dict('os.environ'):
+            import gunicorn_config
+        self.assertEqual(gunicorn_config.worker_class, 'gthread')
+        self.assertGreater(gunicorn_config.threads, 1)
+
+class TestTokenRefresh(unittest.TestCase):
+    """Pruebas de expiración y renovación proactiva de tokens"""
+    
+    def setUp(self):
+        import auth_utils
+        self.auth_utils = auth_utils
+        auth_utils._token_cache.clear()
+        self.utcnow = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    
+    def _credentials_dict(self, expires_in):
+        return {
+            'token': 'old-token', 'refresh_token': 'refresh', 'token_uri': 'https://oauth2.example/token',
+            'client_id': 'client', 'client_secret': 'secret', 'scopes': ['scope'],
+            'expiry': (self.utcnow + timedelta(seconds=expires_in)).isoformat()
+        }
+    
+    def test_expiry_round_trip(self):
+        """La expiración se guarda en sesión y se recupera al reconstruir las credenciales"""
+        creds = self.auth_utils.dict_to_credentials(self._credentials_dict(-60))
+        self.assertTrue(creds.expired)
+        data = self.auth_utils.credentials_to_dict(creds)
+        self.assertEqual(self.auth_utils.dict_to_credentials(data).expiry, creds.expiry)
+        
+        # Las sesiones antiguas sin expiración siguen funcionando
+        legacy = self._credentials_dict(0)
+        del legacy['expiry']
+        self.assertIsNone(self.auth_utils.dict_to_credentials(legacy).expiry)
+    
+    def test_concurrent_refresh_calls_token_endpoint_once(self):
+        """Las peticiones concurrentes de un mismo usuario comparten la renovación"""
+        calls = []
+        
+        def fake_refresh(creds, request):
+            calls.append(1)
+            threading.Event().wait(0.05)
+            creds.token = 'new-token'
+            creds.expiry = self.utcnow + timedelta(hours=1)
+        
+        credentials = self._credentials_dict(-60)
+        results = []
+        with patch('google.oauth2.credentials.Credentials.refresh', autospec=True, side_effect=fake_refresh), \
+                patch.object(self.auth_utils, 'build_calendar_service', return_value=MagicMock()):
+            threads = [threading.Thread(target=lambda: results.append(
+                self.auth_utils.authenticate_google_calendar(credentials))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(updated['token'] == 'new-token' for _, updated in results))
+    
+    def test_token_close_to_expiry_refreshed_in_background(self):
+        """Un token que expira pronto se usa y se renueva fuera del camino crítico"""
+        with patch.object(self.auth_utils, 'submit_background') as mock_submit, \
+                patch.object(self.auth_utils, 'build_calendar_service', return_value=MagicMock()):
+            service, updated = self.auth_utils.authenticate_google_calendar(self._credentials_dict(300))
+            self.auth_utils._background_refreshes.clear()
+        
+        self.assertIsNotNone(service)
+        self.assertEqual(updated['token'], 'old-token')
+        mock_submit.assert_called_once()
+    
+    def test_token_caches_are_bounded(self):
+        """Los tokens y locks por usuario se limitan y los tokens expirados se descartan"""
+        from resilience_utils import StaleCache
+        
+        with patch.object(self.auth_utils, '_token_cache', StaleCache(max_entries=2)), \
+                patch.object(self.auth_utils, '_refresh_locks', StaleCache(max_entries=2)):
+            for user in ('a', 'b', 'c'):
+                creds = self.auth_utils.dict_to_credentials(self._credentials_dict(3600))
+                self.auth_utils._remember_token(user, creds)
+                self.auth_utils._get_refresh_lock(user)
+            self.assertEqual(self.auth_utils._token_cache.get('a'), (None, None))
+            self.assertEqual(self.auth_utils._refresh_locks.get('a'), (None, None))
+            
+            expired = self.auth_utils.dict_to_credentials(self._credentials_dict(-60))
+            self.auth_utils._token_cache.set('b', {'token': 'viejo', 'expiry': expired.expiry})
+            creds = self.auth_utils._apply_cached_token('b', self.auth_utils.dict_to_credentials(self._credentials_dict(-120)))
+            self.assertEqual(creds.token, 'old-token')
+            self.assertEqual(self.auth_utils._token_cache.get('b'), (None, None))
+    
+    def test_failed_background_submit_is_forgotten(self):
+        """Si no se puede programar la renovación en segundo plano se podrá volver a intentar"""
+        creds = self.auth_utils.dict_to_credentials(self._credentials_dict(300))
+        with patch.object(self.auth_utils, 'submit_background', side_effect=RuntimeError('apagando')):
+            self.auth_utils._schedule_background_refresh(creds, 'usuario')
+        self.assertNotIn('usuario', self.auth_utils._background_refreshes)
+
+class TestServerSideSession(unittest.TestCase):
+    """Pruebas de las sesiones almacenadas en el servidor"""
+    
+    def _make_app(self, session_type, tmp):
+        from flask import Flask, session
+        from session_utils import init_session
+        
+        app = Flask(__name__)
+        app.config.update(
+            SECRET_KEY='test', SESSION_TYPE=session_type,
+            SESSION_FILE_DIR=f'{tmp}/sessions', SESSION_SQLITE_PATH=f'{tmp}/sessions.sqlite3'
+        )
+        init_session(app)
+        
+        @app.route('/login')
+        def login():
+            session['credentials'] = {'token': 'secret-token', 'refresh_token': 'r' * 100}
+            return 'ok'
+        
+        @app.route('/whoami')
+        def whoami():
+            return session.get('credentials', {}).get('token', 'anonymous')
+        
+        @app.route('/logout')
+        def logout():
+            session.clear()
+            return 'bye'
+        
+        return app
+    
+    def test_cookie_holds_only_opaque_id(self):
+        """La cookie solo lleva el identificador y los datos se recuperan del servidor"""
+        import tempfile
+        
+        for session_type in ('filesystem', 'sqlite', 'redis'):
+            with tempfile.TemporaryDirectory() as tmp:
+                client = self._make_app(session_type, tmp).test_client()
+                response = client.get('/login')
+                cookie = response.headers['Set-Cookie']
+                self.assertNotIn('secret-token', cookie)
+                self.assertLess(len(cookie), 200)
+                
+                self.assertEqual(client.get('/whoami').get_data(as_text=True), 'secret-token')
+                client.get('/logout')
+                self.assertEqual(client.get('/whoami').get_data(as_text=True), 'anonymous')
+    
+    def test_tampered_cookie_is_ignored(self):
+        """Un identificador sin firma válida abre una sesión nueva"""
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            client = self._make_app('filesystem', tmp).test_client()
+            client.set_cookie('session', '../../etc/passwd')
+            self.assertEqual(client.get('/whoami').get_data(as_text=True), 'anonymous')
+            self.assertNotIn('Set-Cookie', client.get('/whoami').headers)
+    
+    def test_corrupt_file_and_storage_errors(self):
+        """Un archivo de sesión corrupto cuenta como caducado y un fallo al guardar no rompe la respuesta"""
+        import tempfile
+        from session_utils import FileSystemSessionBackend
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = FileSystemSessionBackend(tmp, threshold=1)
+            with open(os.path.join(tmp, 'truncada'), 'w', encoding='utf-8') as f:
+                f.write('17000')
+            self.assertIsNone(backend.get('truncada'))
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'truncada')))
+            
+            # La limpieza por umbral tampoco falla con archivos corruptos
+            with open(os.path.join(tmp, 'corrupta'), 'w', encoding='utf-8') as f:
+                f.write('no-es-una-fecha\n{}')
+            backend.set('buena', '{}', 60)
+            self.assertEqual(backend.get('buena'), '{}')
+            
+            app = self._make_app('filesystem', tmp)
+            client = app.test_client()
+            with patch.object(app.session_interface.backend, 'set', side_effect=OSError('disco lleno')):
+                response = client.get('/login')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Set-Cookie', response.headers)
+    
+    def test_session_expiry_slides_on_access(self):
+        """Cada acceso renueva la caducidad: solo caduca la sesión inactiva"""
+        import tempfile
+        
+        for session_type in ('filesystem', 'sqlite'):
+            with tempfile.TemporaryDirectory() as tmp:
+                app = self._make_app(session_type, tmp)
+                app.permanent_session_lifetime = timedelta(seconds=100)
+                client = app.test_client()
+                now = [1000.0]
+                with patch('session_utils.time.time', side_effect=lambda: now[0]):
+                    client.get('/login')
+                    for _ in range(3):
+                        now[0] += 60
+                        self.assertEqual(client.get('/whoami').get_data(as_text=True), 'secret-token')
+                    now[0] += 150
+                    self.assertEqual(client.get('/whoami').get_data(as_text=True), 'anonymous')
+    
+    def test_sqlite_connections_are_closed(self):
+        """El backend SQLite cierra cada conexión tras usarla"""
+        import tempfile
+        import sqlite3
+        from session_utils import SqliteSessionBackend
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SqliteSessionBackend(f'{tmp}/sessions.sqlite3')
+            connect = sqlite3.connect
+            opened, closed = [], []
+            
+            class TrackingConnection(sqlite3.Connection):
+                def close(self):
+                    closed.append(self)
+                    super().close()
+            
+            def tracking_connect(*args, **kwargs):
+                opened.append(connect(*args, factory=TrackingConnection, **kwargs))
+                return opened[-1]
+            
+            with patch('session_utils.sqlite3.connect', side_effect=tracking_connect):
+                backend.set('sid', 'datos', 60)
+                self.assertEqual(backend.get('sid'), 'datos')
+                backend.touch('sid', 60)
+                backend.delete('sid')
+            self.assertEqual(len(opened), 4)
+            self.assertEqual(closed, opened)
+
+class TestAssetPipeline(unittest.TestCase):
+    """Pruebas del purgado de CSS y de los recursos versionados"""
+    
+    def test_purge_keeps_used_classes_only(self):
+        """Se eliminan las reglas con clases no usadas, también dentro de @media"""
+        from build_assets import purge_css
+        
+        css = ('/*! licencia */*,::before{box-sizing:border-box}.flex{display:flex}.grid{display:grid}'
+               '.a,.b{color:red}@media (min-width:640px){.sm\\:flex{display:flex}.sm\\:grid{display:grid}}'
+               '.w-1\\/2{width:50%}@keyframes spin{to{transform:rotate(360deg)}}')
+        purged = purge_css(css, {'flex', 'b', 'sm:flex', 'w-1/2'})
+        
+        self.assertIn('/*! licencia */', purged)
+        self.assertIn('*,::before{box-sizing:border-box}', purged)
+        self.assertIn('.flex{display:flex}', purged)
+        self.assertNotIn('.grid{', purged)
+        self.assertIn('.b{color:red}', purged)
+        self.assertNotIn('.a,', purged)
+        self.assertIn('@media (min-width:640px){.sm\\:flex{display:flex}}', purged)
+        self.assertIn('.w-1\\/2{width:50%}', purged)
+        self.assertIn('@keyframes spin{to{transform:rotate(360deg)}}', purged)
+    
+    def test_versioned_asset_served_precompressed(self):
+        """asset_url usa el manifest y la ruta sirve la variante gzip con caché inmutable"""
+        import os
+        import gzip
+        import tempfile
+        from flask import Flask, render_template_string
+        from asset_utils import init_assets, IMMUTABLE_CACHE_CONTROL
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'dist', 'css'))
+            content = b'.flex{display:flex}' * 100
+            with open(os.path.join(tmp, 'dist', 'css', 'app.abc123.css'), 'wb') as f:
+                f.write(content)
+            with open(os.path.join(tmp, 'dist', 'css', 'app.abc123.css.gz'), 'wb') as f:
+                f.write(gzip.compress(content))
+            with open(os.path.join(tmp, 'dist', 'manifest.json'), 'w') as f:
+                json.dump({'css/app.css': 'css/app.abc123.css'}, f)
+            
+            app = Flask(__name__, static_folder=tmp, static_url_path='/static')
+            init_assets(app)
+            with app.test_request_context():
+                self.assertEqual(render_template_string("{{ asset_url('css/app.css') }}"),
+                                 '/static/dist/css/app.abc123.css')
+                self.assertEqual(render_template_string("{{ asset_url('css/other.css') }}"),
+                                 '/static/css/other.css')
+            
+            client = app.test_client()
+            response = client.get('/static/dist/css/app.abc123.css', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.headers['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+            self.assertEqual(gzip.decompress(response.get_data()), content)
+            response.close()
+            
+            response = client.get('/static/dist/css/app.abc123.css')
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.get_data(), content)
+            response.close()
+
+class TestCachePolicy(unittest.TestCase):
+    """Pruebas de la política de caché por ruta"""
+    
+    def _make_app(self, default_no_store=False):
+        from flask import Flask, session
+        from cache_utils import cache_policy, init_cache_policy, POLICY_REVALIDATE, POLICY_NO_STORE
+        
+        app = Flask(__name__)
+        app.config['SECRET_KEY'] = 'test'
+        init_cache_policy(app, default_no_store=default_no_store)
+        
+        @app.route('/page')
+        @cache_policy(POLICY_REVALIDATE, last_modified=lambda: 1700000000)
+        def page():
+            return f"hola {session.get('name', 'anónimo')}"
+        
+        @app.route('/results')
+        @cache_policy(POLICY_NO_STORE)
+        def results():
+            return 'privado'
+        
+        @app.route('/other')
+        def other():
+            return 'sin política'
+        
+        return app
+    
+    def test_revalidate_returns_304_until_content_changes(self):
+        """Las páginas revalidables responden 304 con el mismo ETag y 200 si cambia el contenido"""
+        client = self._make_app().test_client()
+        response = client.get('/page')
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        self.assertIn('Last-Modified', response.headers)
+        etag = response.headers['ETag']
+        
+        response = client.get('/page', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        
+        with client.session_transaction() as sess:
+            sess['name'] = 'Ana'
+        response = client.get('/page', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Ana', response.get_data(as_text=True))
+    
+    def test_no_store_and_default_policy(self):
+        """no-store en rutas privadas y, con DISABLE_CACHE, en las que no tienen política"""
+        client = self._make_app(default_no_store=True).test_client()
+        self.assertTrue(client.get('/results').headers['Cache-Control'].startswith('no-store'))
+        self.assertTrue(client.get('/other').headers['Cache-Control'].startswith('no-store'))
+        self.assertEqual(client.get('/page').headers['Cache-Control'], 'private, no-cache')
+        
+        client = self._make_app(default_no_store=False).test_client()
+        self.assertNotIn('Cache-Control', client.get('/other').headers)
+    
+    def test_pages_leave_caching_to_headers(self):
+        """Las páginas no incluyen meta etiquetas de caché que contradigan la cabecera"""
+        import app as app_module
+        
+        response = app_module.app.test_client().get('/privacy-policy')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('http-equiv', response.get_data(as_text=True))
+        self.assertIn('Cache-Control', response.headers)
+
+class TestCompressionMiddleware(unittest.TestCase):
+    """Pruebas del middleware de compresión"""
+    
+    def _make_app(self):
+        from flask import Flask, Response, jsonify
+        from compression_utils import CompressionMiddleware
+        
+        app = Flask(__name__)
+        
+        @app.route('/big')
+        def big():
+            return '<tr><td>Servicio</td><td>1:30</td></tr>' * 200
+        
+        @app.route('/small')
+        def small():
+            return jsonify({'ok': True})
+        
+        @app.route('/stream')
+        def stream():
+            return Response((f'<p>semana {i}</p>' for i in range(50)), mimetype='text/html')
+        
+        @app.route('/image')
+        def image():
+            return Response(b'\x89PNG' * 500, mimetype='image/png')
+        
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=500)
+        return app
+    
+    def test_large_html_is_gzipped(self):
+        """Las respuestas grandes se comprimen y las pequeñas o binarias no"""
+        import gzip
+        
+        client = self._make_app().test_client()
+        response = client.get('/big', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        body = response.get_data()
+        self.assertEqual(int(response.headers['Content-Length']), len(body))
+        self.assertLess(len(body), 1000)
+        self.assertIn(b'Servicio', gzip.decompress(body))
+        
+        self.assertNotIn('Content-Encoding', client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers)
+        self.assertNotIn('Content-Encoding', client.get('/image', headers={'Accept-Encoding': 'gzip'}).headers)
+        self.assertNotIn('Content-Encoding', client.get('/big', headers={'Accept-Encoding': 'gzip;q=0'}).headers)
+    
+    def test_streamed_response_compressed_per_chunk(self):
+        """Las respuestas en streaming se comprimen fragmento a fragmento"""
+        import zlib
+        
+        client = self._make_app().test_client()
+        response = client.get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        
+        # Cada fragmento es descomprimible en cuanto llega (Z_SYNC_FLUSH)
+        decompressor = zlib.decompressobj(31)
+        first = decompressor.decompress(next(iter(response.response)))
+        self.assertEqual(first, b'<p>semana 0</p>')
+        response.close()
+
+class TestStreamedResults(unittest.TestCase):
+    """Pruebas del informe de resultados enviado en streaming"""
+    
+    def test_report_builders(self):
+        """Los totales del período y las filas de semanas se calculan a partir del resumen"""
+        from report_utils import build_period_summary, iter_week_rows, buffered_stream
+        
+        weekly_summary = {
+            date(2023, 5, 8): {'B': timedelta(hours=1)},
+            date(2023, 5, 1): {'B': timedelta(hours=2), 'A': timedelta(hours=1)},
+        }
+        period_summary, total = build_period_summary(weekly_summary)
+        self.assertEqual(total, timedelta(hours=4))
+        self.assertEqual([s['name'] for s in period_summary], ['B', 'A'])
+        self.assertEqual(period_summary[0]['percentage'], 75.0)
+        
+        rows = iter_week_rows(weekly_summary)
+        first = next(rows)
+        self.assertEqual(first['start_date'], '01/05/2023')
+        self.assertEqual([s['name'] for s in first['services']], ['A', 'B'])
+        self.assertEqual(first['total_hours'], format_timedelta(timedelta(hours=3)))
+        self.assertEqual(next(rows)['start_date'], '08/05/2023')
+        
+        self.assertEqual(list(buffered_stream(['ab', 'cd', 'e'], min_size=3)), ['abcd', 'e'])
+    
+    @patch('rollup_utils.ROLLUPS_ENABLED', False)
+    @patch('app.get_events_until_deadline')
+    @patch('app.fetch_calendar_timezone')
+    @patch('app.authenticate_google_calendar')
+    def test_calculate_streams_summary_before_weeks(self, mock_auth, mock_tz, mock_get_events):
+        """/calculate envía la página en streaming con el resumen del período antes de las semanas"""
+        import app as app_module
+        
+        mock_auth.return_value = (MagicMock(), None)
+        mock_tz.return_value = (pytz.timezone('Europe/Madrid'), True)
+        mock_get_events.return_value = ([{
+            'summary': 'Reunión',
+            'start': {'dateTime': '2023-05-01T10:00:00+02:00'},
+            'end': {'dateTime': '2023-05-01T11:00:00+02:00'},
+        }], None)
+        
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['credentials'] = {'token': 't', 'refresh_token': 'r', 'client_id': 'c'}
+            sess['_flashes'] = [('success', 'Autenticación completada')]
+        response = client.post('/calculate', data={
+            'start_date': '2023-05-01',
+            'end_date': '2023-05-14',
+            'config': json.dumps(get_default_config())
+        })
+        
+        self.assertTrue(response.is_streamed)
+        self.assertTrue(response.headers['Cache-Control'].startswith('no-store'))
+        html = response.get_data(as_text=True)
+        self.assertLess(html.index('Resumen de Horas por Período'), html.index('Semana (01/05/2023'))
+        self.assertIn('Semana (08/05/2023', html)
+        self.assertIn('Autenticación completada', html)
+        
+        # El mensaje flash se consumió antes de guardar la sesión
+        with client.session_transaction() as sess:
+            self.assertNotIn('_flashes', sess)
+        
+        # Acotar el rango consulta el índice de eventos sin volver a llamar a Google
+        response = client.post('/calculate', data={
+            'start_date': '2023-05-01',
+            'end_date': '2023-05-07',
+            'config': json.dumps(get_default_config())
+        })
+        html = response.get_data(as_text=True)
+        self.assertIn('Semana (01/05/2023', html)
+        self.assertNotIn('Semana (08/05/2023', html)
+        self.assertIn('Calculado con los eventos obtenidos de Google Calendar el', html)
+        self.assertIn('name="refresh" value="1"', html)
+        self.assertEqual(mock_get_events.call_count, 1)
+        
+        # "Actualizar" vuelve a pedir los eventos a Google aunque el índice cubra el rango
+        response = client.post('/calculate', data={
+            'start_date': '2023-05-01',
+            'end_date': '2023-05-07',
+            'config': json.dumps(get_default_config()),
+            'refresh': '1'
+        })
+        self.assertNotIn('Calculado con los eventos obtenidos', response.get_data(as_text=True))
+        self.assertEqual(mock_get_events.call_count, 2)
+        
+        from event_index_utils import event_index_cache
+        event_index_cache.clear()
+        resilience_utils.events_cache.clear()
+
+class TestReportPaging(unittest.TestCase):
+    """Pruebas de la carga por páginas de las semanas de un informe"""
+    
+    def setUp(self):
+        import tempfile
+        from storage_utils import JsonFileStore
+        import report_utils
+        
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store_patch = patch.object(report_utils, 'report_store', JsonFileStore(self.tmp.name))
+        self.store_patch.start()
+    
+    def tearDown(self):
+        self.store_patch.stop()
+        self.tmp.cleanup()
+    
+    def test_unread_reports_purged(self):
+        """Los informes que nadie vuelve a leer se eliminan al guardar otros tras caducar"""
+        import report_utils
+        from storage_utils import JsonFileStore
+        from report_utils import save_report, get_report
+        
+        now = [1000.0]
+        store = JsonFileStore(self.tmp.name, ttl=60, clock=lambda: now[0], cleanup_interval=300)
+        weekly_summary = {date(2023, 1, 2): {'Servicio': timedelta(hours=1)}}
+        with patch.object(report_utils, 'report_store', store):
+            old_id = save_report('ana', weekly_summary, date(2023, 1, 2), date(2023, 1, 8))
+            os.utime(os.path.join(self.tmp.name, f'{old_id}.json'), (900, 900))
+            now[0] = 1300.0
+            new_id = save_report('ana', weekly_summary, date(2023, 1, 2), date(2023, 1, 8))
+        self.assertEqual(os.listdir(self.tmp.name), [f'{new_id}.json'])
+        self.assertIsNotNone(get_report(new_id, 'ana'))
+    
+    def test_report_pages(self):
+        """El informe guarda segundos y se sirve por páginas solo a su propietario"""
+        from report_utils import save_report, get_report, get_report_page
+        
+        weekly_summary = {
+            date(2023, 1, 2) + timedelta(weeks=i): {'Servicio': timedelta(hours=i + 1)}
+            for i in range(5)
+        }
+        report_id = save_report('owner', weekly_summary, date(2023, 1, 2), date(2023, 2, 5))
+        self.assertIsNone(get_report(report_id, 'otro'))
+        self.assertIsNone(get_report('../etc', 'owner'))
+        
+        report = get_report(report_id, 'owner')
+        self.assertEqual(report['weeks'][0][1], {'Servicio': 3600.0})
+        
+        page = get_report_page(report, 2, 2)
+        self.assertEqual(page['total'], 5)
+        self.assertEqual(page['next_offset'], 4)
+        self.assertEqual([w['start_date'] for w in page['weeks']], ['16/01/2023', '23/01/2023'])
+        self.assertEqual(page['weeks'][0]['total_hours'], format_timedelta(timedelta(hours=3)))
+        self.assertIsNone(get_report_page(report, 4, 2)['next_offset'])
+    
+    def test_weeks_endpoint(self):
+        """La ruta JSON de semanas exige la sesión del propietario"""
+        import app as app_module
+        from report_utils import save_report
+        
+        credentials = {'token': 't', 'refresh_token': 'r', 'client_id': 'c'}
+        report_id = save_report(app_module.get_user_key(credentials),
+                                {date(2023, 1, 2): {'A': timedelta(hours=2)}},
+                                date(2023, 1, 2), date(2023, 1, 8))
+        client = app_module.app.test_client()
+        self.assertEqual(client.get(f'/calculate/reports/{report_id}/weeks').status_code, 404)
+        
+        with client.session_transaction() as sess:
+            sess['credentials'] = credentials
+        response = client.get(f'/calculate/reports/{report_id}/weeks?offset=0&limit=10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['weeks'][0]['services'][0]['name'], 'A')
+        self.assertIsNone(response.get_json()['next_offset'])
+
+class TestReportExport(unittest.TestCase):
+    """Pruebas de la exportación de informes a CSV y XLSX"""
+    
+    REPORT = {
+        'range': ['2023-01-02', '2023-01-15'],
+        'weeks': [
+            ['2023-01-02', {'Desarrollo': 5400.0, 'Reuniones & Gestión': 1800.0}],
+            ['2023-01-09', {'Desarrollo': 3600.0}],
+        ]
+    }
+    
+    def test_csv_rows_in_seconds(self):
+        """El CSV incluye filas semanales y totales del período calculados en segundos"""
+        import csv
+        import io
+        from export_utils import iter_export_rows, stream_csv
+        
+        content = ''.join(stream_csv(iter_export_rows(self.REPORT)))
+        rows = list(csv.reader(io.StringIO(content.lstrip('\ufeff'))))
+        self.assertEqual(rows[0], ['tipo', 'inicio', 'fin', 'servicio', 'segundos', 'horas'])
+        self.assertEqual(rows[1], ['semana', '2023-01-02', '2023-01-08', 'Desarrollo', '5400', '1.5'])
+        self.assertEqual(rows[-2], ['periodo', '2023-01-02', '2023-01-15', 'Desarrollo', '9000', '2.5'])
+        self.assertEqual(rows[-1][3], 'Reuniones & Gestión')
+    
+    def test_xlsx_is_valid_zip_streamed_in_chunks(self):
+        """El XLSX se genera por fragmentos y contiene la hoja con las filas"""
+        import io
+        import zipfile
+        import xml.etree.ElementTree as ET
+        import export_utils
+        
+        rows = [['semana', '2023-01-02', '2023-01-08', f'Servicio {i}', i, i / 3600] for i in range(3000)]
+        with patch.object(export_utils, 'EXPORT_CHUNK_SIZE', 1024):
+            chunks = list(export_utils.stream_xlsx(iter(rows)))
+        self.assertGreater(len(chunks), 2)
+        
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertIn('xl/workbook.xml', archive.namelist())
+            sheet = ET.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        self.assertEqual(len(sheet.findall('.//s:row', ns)), 3001)
+
+class TestLogSampling(unittest.TestCase):
+    """Pruebas del registro por muestreo de errores repetitivos"""
+    
+    def test_sampler_logs_first_and_every_nth(self):
+        """Se registran las primeras apariciones y luego una de cada N"""
+        from loguru import logger
+        from logging_utils import LogSampler
+        
+        messages = []
+        sink_id = logger.add(lambda message: messages.append(message.record), level='ERROR')
+        try:
+            sampler = LogSampler(first=3, every=10)
+            logged = sum(sampler.log('parse', 'Error al parsear', value='x') for _ in range(50))
+        finally:
+            logger.remove(sink_id)
+        
+        # 1, 2, 3, 10, 20, 30, 40, 50
+        self.assertEqual(logged, 8)
+        self.assertEqual(sampler.count('parse'), 50)
+        self.assertEqual(messages[-1]['message'], 'Error al parsear (50 apariciones)')
+        self.assertEqual(messages[-1]['extra']['value'], 'x')
+    
+    def test_malformed_events_are_sampled(self):
+        """Miles de fechas mal formadas no generan miles de líneas de log"""
+        import logging_utils
+        
+        sampler = logging_utils.LogSampler(first=2, every=1000)
+        with patch('calendar_utils.event_error_sampler', sampler), \
+             patch.object(sampler, 'log', wraps=sampler.log) as wrapped, \
+             patch('logging_utils.logger') as mock_logger:
+            for _ in range(3000):
+                self.assertEqual(parse_datetime_api({'dateTime': 'no-es-una-fecha'}), (None, False))
+        
+        self.assertEqual(wrapped.call_count, 3000)
+        # 1, 2, 1000, 2000, 3000
+        self.assertEqual(mock_logger.bind.call_count, 5)
+    
+    def test_sampler_counts_reset_each_window(self):
+        """Pasada la ventana se vuelven a registrar las primeras apariciones"""
+        from logging_utils import LogSampler
+        
+        now = [0.0]
+        sampler = LogSampler(first=2, every=1000, window=60, clock=lambda: now[0])
+        with patch('logging_utils.logger'):
+            self.assertEqual([sampler.log('parse', 'Error') for _ in range(4)], [True, True, False, False])
+            now[0] = 59
+            self.assertFalse(sampler.log('parse', 'Error'))
+            self.assertEqual(sampler.count('parse'), 5)
+            now[0] = 60
+            self.assertEqual(sampler.count('parse'), 0)
+            self.assertEqual([sampler.log('parse', 'Error') for _ in range(3)], [True, True, False])
+
+class TestMetrics(unittest.TestCase):
+    """Pruebas de las métricas por etapa y de /metrics"""
+    
+    def _stage_count(self, text, stage):
+        import re
+        match = re.search(r'calendar_stage_seconds_count\{stage="%s"\} ([0-9.]+)' % stage, text)
+        return float(match.group(1)) if match else 0.0
+    
+    def test_parse_and_summarize_split(self):
+        """El cálculo en dos etapas da el mismo resultado y registra cada etapa"""
+        from calendar_time_tracker import parse_events, summarize_parsed_events
+        from metrics_utils import render_metrics
+        
+        tz = pytz.timezone('Europe/Madrid')
+        config = get_default_config()
+        events = [{
+            'summary': 'Reunión',
+            'start': {'dateTime': '2023-05-02T10:00:00+02:00'},
+            'end': {'dateTime': '2023-05-02T12:00:00+02:00'},
+        }]
+        before = render_metrics()[0].decode('utf-8')
+        
+        parsed = parse_events(events, tz, config)
+        self.assertEqual(parsed[0]['start'].hour, 10)
+        args = (date(2023, 5, 1), date(2023, 5, 7), tz, time(9, 0), time(17, 0), [0, 1, 2, 3, 4], config)
+        self.assertEqual(summarize_parsed_events(parsed, *args), calculate_weekly_summary(events, *args))
+        
+        after = render_metrics()[0].decode('utf-8')
+        for stage in ('parse', 'assign_service', 'weekly_summary'):
+            self.assertGreater(self._stage_count(after, stage), self._stage_count(before, stage))
+    
+    def test_metrics_endpoint(self):
+        """/metrics expone las métricas en formato de texto de Prometheus"""
+        import app as app_module
+        from metrics_utils import record_cache
+        
+        record_cache('token', True)
+        response = app_module.app.test_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE calendar_stage_seconds histogram', text)
+        self.assertIn('calendar_cache_hits_total{cache="token"}', text)
+    
+    def test_metrics_endpoint_requires_token_or_local_client(self):
+        """/metrics no es público: exige METRICS_TOKEN o una petición directa desde localhost"""
+        import app as app_module
+        
+        client = app_module.app.test_client()
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        self.assertEqual(client.get('/metrics', environ_base=remote).status_code, 404)
+        self.assertEqual(client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.7'}).status_code, 404)
+        
+        with patch.dict('os.environ', {'METRICS_TOKEN': 'secreto'}):
+            self.assertEqual(client.get('/metrics').status_code, 404)
+            self.assertEqual(client.get('/metrics', environ_base=remote,
+                                        headers={'Authorization': 'Bearer otro'}).status_code, 404)
+            self.assertEqual(client.get('/metrics', environ_base=remote,
+                                        headers={'Authorization': 'Bearer secreto'}).status_code, 200)
+    
+    def test_gunicorn_config_sets_multiprocess_dir(self):
+        """gunicorn_config define PROMETHEUS_MULTIPROC_DIR antes de cargar la aplicación"""
+        import importlib
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.dict('os.environ', {'METRICS_MULTIPROC_DIR': f'{tmp}/metricas'}):
+            os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+            import gunicorn_config
+            importlib.reload(gunicorn_config)
+            self.assertEqual(os.environ['PROMETHEUS_MULTIPROC_DIR'], f'{tmp}/metricas')
+            self.assertTrue(os.path.isdir(f'{tmp}/metricas'))
+        self.assertNotEqual(os.environ.get('PROMETHEUS_MULTIPROC_DIR'), f'{tmp}/metricas')
+
+class TestBenchmarks(unittest.TestCase):
+    """Pruebas del generador de calendarios sintéticos y de las pruebas de rendimiento"""
+    
+    def test_synthetic_calendar_is_reproducible(self):
+        """La misma semilla genera los mismos eventos y el rango de DST cambia de desfase"""
+        from synthetic_calendar import generate_calendar, dst_range
+        
+        first = generate_calendar(date(2023, 1, 2), seed=7, max_events=300)
+        self.assertEqual(len(first), 300)
+        self.assertEqual(first, generate_calendar(date(2023, 1, 2), seed=7, max_events=300))
+        self.assertNotEqual(first, generate_calendar(date(2023, 1, 2), seed=8, max_events=300))
+        self.assertTrue(any(event.get('recurringEventId') for event in first))
+        
+        start, end = dst_range(2023)
+        events = generate_calendar(start, end, seed=1, ooo_ratio=0.5)
+        offsets = {event['start']['dateTime'][-6:] for event in events if 'dateTime' in event['start']}
+        self.assertEqual(offsets, {'+01:00', '+02:00'})
+        self.assertTrue(any(event['eventType'] == 'outOfOffice' for event in events))
+    
+    def test_benchmark_results_are_serializable(self):
+        """run_benchmarks devuelve resultados en JSON, incluida la petición completa a /calculate"""
+        import benchmark
+        import report_utils
+        import rollup_utils
+        import app as app_module
+        
+        # Los informes, las semanas consolidadas y las cachés de la aplicación no se tocan
+        with patch.object(report_utils.report_store, 'set') as mock_report, \
+                patch.object(rollup_utils.rollup_store, 'put_weeks') as mock_rollups:
+            report = benchmark.run_benchmarks([200], repeat=2, warmup=0, only={'parse_events', 'calculate_endpoint'})
+        mock_report.assert_not_called()
+        mock_rollups.assert_not_called()
+        self.assertEqual(resilience_utils.events_cache.get(app_module.get_user_key({'refresh_token': 'bench'})), (None, None))
+        report = json.loads(json.dumps(report))
+        self.assertEqual(report['meta']['seed'], 0)
+        self.assertEqual([item['name'] for item in report['results']], ['parse_events', 'calculate_endpoint'])
+        for item in report['results']:
+            self.assertEqual(item['events'], 200)
+            self.assertEqual(len(item['timings']), 2)
+            self.assertLessEqual(item['min'], item['median'])
+        
+        ratios = benchmark.compare_results(report, report)
+        self.assertEqual([ratio for *_, ratio in ratios], [1.0, 1.0])
+
+class TestFakeCalendarServer(unittest.TestCase):
+    """Pruebas del servidor falso de Google Calendar API para pruebas de carga"""
+    
+    def setUp(self):
+        from synthetic_calendar import generate_calendar
+        self.events = generate_calendar(date(2023, 1, 2), date(2023, 3, 31), seed=3)
+    
+    def test_events_paging_sync_token_and_errors(self):
+        """events.list pagina por rango, devuelve nextSyncToken al final y se pueden inyectar errores"""
+        from fake_calendar_server import FakeCalendar
+        
+        calendar = FakeCalendar(self.events)
+        items, page_token = [], None
+        while True:
+            status, payload = calendar.list_events(
+                '2023-02-01T00:00:00+01:00', '2023-03-01T00:00:00+01:00', page_token, max_results=40
+            )
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(payload['items']), 40)
+            items.extend(payload['items'])
+            page_token = payload.get('nextPageToken')
+            if not page_token:
+                break
+        expected = [e for e in self.events if '2023-02' in (e['start'].get('dateTime') or e['start']['date'])]
+        self.assertEqual(items, expected)
+        
+        status, payload = calendar.list_events(sync_token=payload['nextSyncToken'])
+        self.assertEqual((status, payload['items']), (200, []))
+        self.assertEqual(calendar.list_events(sync_token='caducado')[0], 410)
+        
+        failing = FakeCalendar([], error_rate=1.0, error_statuses=[503], seed=1)
+        self.assertEqual(failing.injected_error(), 503)
+        self.assertEqual(failing.stats['errors_injected'], 1)
+    
+    def test_in_process_service_matches_events_list(self):
+        """El servicio sin HTTP devuelve lo mismo que events.list del servidor y falla con los errores inyectados"""
+        from fake_calendar_server import FakeCalendar, InProcessCalendarService
+        
+        service = InProcessCalendarService(FakeCalendar(self.events))
+        timezone = get_calendar_timezone(service)
+        self.assertEqual(timezone.zone, 'Europe/Madrid')
+        self.assertEqual(get_events(service, date(2023, 1, 2), date(2023, 3, 31), timezone), self.events)
+        
+        failing = InProcessCalendarService(FakeCalendar(self.events, error_rate=1.0, seed=1))
+        self.assertIsNone(get_events(failing, date(2023, 1, 2), date(2023, 3, 31), timezone))
+    
+    def test_google_client_against_fake_server(self):
+        """La configuración de endpoints apunta el cliente de Google y el flujo OAuth al servidor falso"""
+        import auth_utils
+        from google.oauth2.credentials import Credentials
+        from fake_calendar_server import FakeCalendar, FakeCalendarServer
+        
+        server = FakeCalendarServer(FakeCalendar(self.events))
+        server.start_in_thread()
+        try:
+            env = dict(server.environment(), GOOGLE_CLIENT_ID='c', GOOGLE_CLIENT_SECRET='s')
+            with patch.dict('os.environ', env):
+                client_config, _ = auth_utils._load_client_config()
+                self.assertEqual(client_config['web']['token_uri'], env['GOOGLE_TOKEN_URI'])
+                
+                # Token desconocido: googleapiclient recibe 401 y lo renueva en el servidor falso
+                creds = Credentials(token='caducado', refresh_token='r', client_id='c', client_secret='s',
+                                    token_uri=env['GOOGLE_TOKEN_URI'])
+                service = auth_utils.build_calendar_service(creds, 'usuario-falso')
+                timezone = get_calendar_timezone(service)
+                events = get_events(service, date(2023, 1, 2), date(2023, 3, 31), timezone)
+            self.assertEqual(timezone.zone, 'Europe/Madrid')
+            self.assertEqual(events, self.events)
+            self.assertEqual(server.calendar.stats['tokens_issued'], 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class TestRequestProfiling(unittest.TestCase):
+    """Pruebas del perfilado bajo demanda de peticiones"""
+    
+    def setUp(self):
+        import tempfile
+        import profiling_utils
+        from flask import Flask, Response, request as flask_request
+        from storage_utils import JsonFileStore
+        from metrics_utils import observe_stage, record_events
+        
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(profiling_utils, 'PROFILING_ENABLED', True),
+            patch.object(profiling_utils, 'PROFILES_DIR', self.tmpdir),
+            patch.object(profiling_utils, 'PROFILES_MAX', 2),
+            patch.object(profiling_utils, 'profile_store', JsonFileStore(self.tmpdir, ttl=0)),
+            patch.dict('os.environ', {'PROFILING_TOKEN': 'secreto', 'PROFILING_USERS': 'usuario-lento'}),
+        ]
+        for p in self.patches:
+            p.start()
+        
+        self.app = Flask(__name__)
+        profiling_utils.init_profiling(self.app)
+        
+        @self.app.route('/lento/<user>')
+        @profiling_utils.profiled(lambda: flask_request.view_args['user'])
+        def slow(user):
+            record_events(42)
+            def chunks():
+                observe_stage('render', 0.5)
+                yield 'a'
+                yield 'b'
+            return Response(chunks())
+        
+        self.client = self.app.test_client()
+    
+    def tearDown(self):
+        import shutil
+        for p in reversed(self.patches):
+            p.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_disabled_leaves_view_untouched(self):
+        """Sin PROFILING_ENABLED el decorador devuelve la vista original"""
+        import profiling_utils
+        
+        def view():
+            return 'ok'
+        with patch.object(profiling_utils, 'PROFILING_ENABLED', False):
+            self.assertIs(profiling_utils.profiled()(view), view)
+    
+    def test_profile_saved_with_request_metrics(self):
+        """La cabecera de administración o un usuario marcado generan un perfil descargable"""
+        response = self.client.get('/lento/otro')
+        self.assertEqual(response.get_data(as_text=True), 'ab')
+        self.assertNotIn('X-Profile-Id', response.headers)
+        
+        response = self.client.get('/lento/otro', headers={'X-Profile-Token': 'secreto'})
+        self.assertEqual(response.get_data(as_text=True), 'ab')
+        profile_id = response.headers['X-Profile-Id']
+        
+        self.assertEqual(self.client.get(f'/debug/profiles/{profile_id}').status_code, 404)
+        admin = {'X-Profile-Token': 'secreto'}
+        data = self.client.get(f'/debug/profiles/{profile_id}', headers=admin).get_json()
+        self.assertEqual(data['reason'], 'header')
+        self.assertEqual(data['events'], 42)
+        self.assertEqual(data['stages'], {'render': 0.5})
+        self.assertIn('function calls', data['summary'])
+        download = self.client.get(f'/debug/profiles/{profile_id}.prof', headers=admin)
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(download.data), 0)
+        
+        for _ in range(2):
+            self.client.get('/lento/usuario-lento').get_data()
+        profiles = self.client.get('/debug/profiles', headers=admin).get_json()
+        self.assertEqual([p['reason'] for p in profiles], ['user', 'user'])
+
+class TestMemoryTracing(unittest.TestCase):
+    """Pruebas de la medición de memoria por etapa con tracemalloc"""
+    
+    def setUp(self):
+        import tracemalloc
+        from memory_utils import start_memory_tracing
+        self.was_tracing = tracemalloc.is_tracing()
+        start_memory_tracing(frames=1)
+    
+    def tearDown(self):
+        import tracemalloc
+        from memory_utils import memory_stage
+        from metrics_utils import unregister_stage_hook
+        unregister_stage_hook(memory_stage)
+        if not self.was_tracing:
+            tracemalloc.stop()
+    
+    def test_nested_stages_keep_outer_peak(self):
+        """El pico de una etapa interior cuenta también para la exterior"""
+        from memory_utils import memory_stage
+        from metrics_utils import start_request_collector, stop_request_collector, current_request_collector
+        
+        collector, token = start_request_collector()
+        try:
+            self.assertIs(current_request_collector(), collector)
+            with memory_stage('exterior'):
+                with memory_stage('temporal'):
+                    temporary = bytearray(4 * 1024 * 1024)
+                    del temporary
+                retained = bytearray(1024 * 1024)
+        finally:
+            stop_request_collector(token)
+        self.assertIsNone(current_request_collector())
+        
+        memory = collector['memory']
+        self.assertGreaterEqual(memory['temporal']['peak_bytes'], 4 * 1024 * 1024)
+        self.assertLess(memory['temporal']['retained_bytes'], 1024 * 1024)
+        self.assertGreaterEqual(memory['exterior']['peak_bytes'], 4 * 1024 * 1024)
+        self.assertGreaterEqual(memory['exterior']['retained_bytes'], 1024 * 1024)
+        del retained
+    
+    def test_stage_timer_records_memory(self):
+        """Con la medición activa, stage_timer y timed_stream registran la memoria de la etapa"""
+        from memory_utils import top_allocation_sites
+        from metrics_utils import stage_timer, timed_stream, render_metrics
+        from metrics_utils import start_request_collector, stop_request_collector
+        
+        collector, token = start_request_collector()
+        try:
+            with stage_timer('parse'):
+                parsed = [{'n': i} for i in range(5000)]
+            chunks = list(timed_stream(iter(['x' * 100000, 'y']), 'render'))
+        finally:
+            stop_request_collector(token)
+        
+        self.assertEqual(set(collector['memory']), {'parse', 'render'})
+        self.assertGreater(collector['memory']['parse']['retained_bytes'], 5000 * 50)
+        self.assertGreater(collector['stages']['parse'], 0)
+        self.assertIn('calendar_stage_peak_bytes', render_metrics()[0].decode('utf-8'))
+        self.assertTrue(all({'file', 'line', 'size_bytes'} <= set(site) for site in top_allocation_sites(5)))
+        del parsed, chunks
+
+class TestLazyImports(unittest.TestCase):
+    """Pruebas de la carga diferida del cliente de Google"""
+    
+    def test_app_import_does_not_load_google_client(self):
+        """Importar la aplicación no carga googleapiclient, google_auth_oauthlib ni el transporte HTTP"""
+        import subprocess
+        import sys
+        with patch.dict('os.environ'):
+            import gunicorn_config
+        
+        heavy = ['googleapiclient.discovery', 'google_auth_oauthlib.flow', 'google.oauth2.credentials',
+                 'requests', 'httplib2']
+        code = f"import sys, json, app; print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(json.loads(result.stdout.strip().splitlines()[-1]), [])
+        self.assertTrue(gunicorn_config.preload_app)
+    
+    def test_discovery_document_parsed_once(self):
+        """El servicio se construye con build_from_document a partir del documento ya analizado"""
+        import auth_utils
+        import googleapiclient.discovery_cache
+        from google.oauth2.credentials import Credentials
+        
+        auth_utils._discovery_document = None
+        creds = Credentials(token='t')
+        with patch.object(googleapiclient.discovery_cache, 'get_static_doc',
+                          wraps=googleapiclient.discovery_cache.get_static_doc) as mock_doc, \
+                patch('googleapiclient.discovery.build') as mock_build:
+            first = auth_utils.build_calendar_service(creds, 'u')
+            second = auth_utils.build_calendar_service(creds, 'u')
+        
+        mock_doc.assert_called_once_with('calendar', 'v3')
+        mock_build.assert_not_called()
+        self.assertIs(auth_utils.get_discovery_document(), auth_utils.get_discovery_document())
+        request = first.events().list(calendarId='primary')
+        self.assertTrue(request.uri.startswith('https://www.googleapis.com/calendar/v3/calendars/primary/events'))
+        self.assertIsNot(first, second)
+
+class TestTemplateCache(unittest.TestCase):
+    """Pruebas de la caché de plantillas compiladas"""
+    
+    def _app(self, template_folder):
+        from flask import Flask
+        return Flask('template_cache_test', root_path=os.path.dirname(os.path.abspath(__file__)),
+                     template_folder=template_folder)
+    
+    def test_warm_templates_uses_disk_cache(self):
+        """Las plantillas compiladas por un worker no se vuelven a compilar en otro"""
+        import tempfile
+        from template_utils import init_template_cache, warm_templates
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            first = self._app('templates')
+            init_template_cache(first, tmp)
+            templates = first.jinja_env.list_templates()
+            self.assertIn('config.html', templates)
+            self.assertEqual(warm_templates(first), len(templates))
+            self.assertEqual(len(os.listdir(tmp)), len(templates))
+            
+            second = self._app('templates')
+            init_template_cache(second, tmp)
+            with patch.object(second.jinja_env, 'compile', wraps=second.jinja_env.compile) as mock_compile:
+                self.assertEqual(warm_templates(second), len(templates))
+            mock_compile.assert_not_called()
+    
+    def test_modified_and_broken_templates(self):
+        """Una plantilla modificada se recompila, una con errores no detiene la compilación y la caché puede desactivarse"""
+        import tempfile
+        from template_utils import init_template_cache, warm_templates
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = os.path.join(tmp, 'templates')
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'page.html'), 'w', encoding='utf-8') as f:
+                f.write('v1 {{ value }}')
+            with open(os.path.join(folder, 'broken.html'), 'w', encoding='utf-8') as f:
+                f.write('{% if %}')
+            
+            app = self._app(folder)
+            init_template_cache(app, os.path.join(tmp, 'bytecode'))
+            self.assertEqual(warm_templates(app), 1)
+            
+            with open(os.path.join(folder, 'page.html'), 'w', encoding='utf-8') as f:
+                f.write('v2 {{ value }}')
+            fresh = self._app(folder)
+            init_template_cache(fresh, os.path.join(tmp, 'bytecode'))
+            self.assertEqual(fresh.jinja_env.get_template('page.html').render(value=1), 'v2 1')
+            
+            disabled = self._app(folder)
+            with patch.dict(os.environ, {'TEMPLATE_BYTECODE_CACHE': 'false'}):
+                init_template_cache(disabled, os.path.join(tmp, 'other'))
+            self.assertIsNone(disabled.jinja_env.bytecode_cache)
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'other')))
+
+class TestBatchSummary(unittest.TestCase):
+    """Pruebas del cálculo por lotes de calendarios exportados"""
+    
+    def setUp(self):
+        import tempfile
+        from synthetic_calendar import generate_calendar
+        
+        self.tmp = tempfile.TemporaryDirectory()
+        self.inputs = os.path.join(self.tmp.name, 'exportaciones')
+        self.output = os.path.join(self.tmp.name, 'informes')
+        os.makedirs(self.inputs)
+        self.events = generate_calendar(date(2023, 5, 1), date(2023, 5, 31), seed=1)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _write(self, name, data):
+        with open(os.path.join(self.inputs, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    
+    def test_export_formats_give_same_summary(self):
+        """Una página de events().list, varias páginas y una lista de eventos dan el mismo resumen"""
+        import batch_summary
+        
+        self._write('ana.json', {'kind': 'calendar#events', 'timeZone': 'Europe/Madrid', 'items': self.events})
+        self._write('luis.json', [{'timeZone': 'Europe/Madrid', 'items': self.events[:50]},
+                                  {'items': self.events[50:]}])
+        self._write('eva.json', self.events)
+        
+        code = batch_summary.main([self.inputs, '--month', '2023-05', '--output-dir', self.output,
+                                   '--workers', '2', '--csv'])
+        self.assertEqual(code, 0)
+        
+        reports = {}
+        for user in ('ana', 'luis', 'eva'):
+            with open(os.path.join(self.output, f'{user}.json'), encoding='utf-8') as f:
+                reports[user] = json.load(f)
+            self.assertTrue(os.path.exists(os.path.join(self.output, f'{user}.csv')))
+        self.assertEqual(reports['ana']['events'], len(self.events))
+        self.assertEqual(reports['ana']['range'], ['2023-05-01', '2023-05-31'])
+        self.assertEqual(reports['ana']['weeks'], reports['luis']['weeks'])
+        self.assertEqual(reports['ana']['weeks'], reports['eva']['weeks'])
+        
+        # El mismo resultado que calculate_weekly_summary directamente
+        timezone = pytz.timezone('Europe/Madrid')
+        expected = calculate_weekly_summary(self.events, date(2023, 5, 1), date(2023, 5, 31), timezone,
+                                            time(9, 0), time(17, 0), [0, 1, 2, 3, 4], get_default_config())
+        self.assertEqual(reports['ana']['weeks'][0][0], min(expected).isoformat())
+        self.assertAlmostEqual(sum(reports['ana']['period'].values()),
+                               sum(sum(services.values(), timedelta()).total_seconds() for services in expected.values()))
+    
+    def test_errors_and_user_config(self):
+        """Un archivo incorrecto no detiene el lote y se usa la configuración de cada usuario"""
+        import batch_summary
+        
+        self._write('ana.json', self.events)
+        self._write('roto.json', {'timeZone': 'Marte/Base', 'items': self.events})
+        with open(os.path.join(self.inputs, 'mal.json'), 'w', encoding='utf-8') as f:
+            f.write('{')
+        configs = os.path.join(self.tmp.name, 'configuraciones')
+        os.makedirs(configs)
+        config = get_default_config()
+        config['default_service'] = 'LIBRE'
+        with open(os.path.join(configs, 'ana.json'), 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        
+        code = batch_summary.main([self.inputs, '--start-date', '2023-05-01', '--end-date', '2023-05-07',
+                                   '--config-dir', configs, '--output-dir', self.output, '--workers', '1'])
+        self.assertEqual(code, 1)
+        
+        with open(os.path.join(self.output, batch_summary.BATCH_SUMMARY_NAME), encoding='utf-8') as f:
+            results = {item['user']: item for item in json.load(f)['results']}
+        self.assertIn('JSONDecodeError', results['mal']['error'])
+        self.assertIn('UnknownTimeZoneError', results['roto']['error'])
+        self.assertNotIn('error', results['ana'])
+        with open(results['ana']['output'], encoding='utf-8') as f:
+            self.assertIn('LIBRE', json.load(f)['period'])
+        
+        with self.assertRaises(SystemExit):
+            batch_summary.main([self.inputs, '--month', '2023-5x', '--output-dir', self.output])
+
+class TestIcsImport(unittest.TestCase):
+    """Pruebas de la importación de calendarios .ics"""
+    
+    ICS = "\r\n".join([
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'X-WR-TIMEZONE:Europe/Madrid',
+        'BEGIN:VTIMEZONE',
+        'TZID:Europe/Madrid',
+        'END:VTIMEZONE',
+        'BEGIN:VEVENT',
+        'UID:serie-1',
+        'DTSTART;TZID=Europe/Madrid:20230320T100000',
+        'DTEND;TZID=Europe/Madrid:20230320T110000',
+        'RRULE:FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20230402T090000Z',
+        'EXDATE;TZID=Europe/Madrid:20230322T100000',
+        'SUMMARY:Seguimiento',
+        'COLOR:tomato',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:serie-1',
+        'RECURRENCE-ID;TZID=Europe/Madrid:20230329T100000',
+        'DTSTART;TZID=Europe/Madrid:20230329T150000',
+        'DTEND;TZID=Europe/Madrid:20230329T160000',
+        'SUMMARY:Seguimiento movido',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:vacaciones',
+        'DTSTART;VALUE=DATE:20230323',
+        'DTEND;VALUE=DATE:20230324',
+        'SUMMARY:Vacaciones',
+        'X-MICROSOFT-CDO-BUSYSTATUS:OOF',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:cancelado',
+        'DTSTART;TZID=Europe/Madrid:20230321T120000',
+        'DTEND;TZID=Europe/Madrid:20230321T130000',
+        'STATUS:CANCELLED',
+        'SUMMARY:Cancelado',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:cliente',
+        'DTSTART:20230321T080000Z',
+        'DURATION:PT1H30M',
+        'SUMMARY:Reunión con',
+        '  cliente',
+        'DESCRIPTION:' + 'x' * 70,
+        ' ' + 'y' * 70,
+        'CATEGORIES:Proyecto A,Otros',
+        'BEGIN:VALARM',
+        'ACTION:DISPLAY',
+        'SUMMARY:Aviso',
+        'END:VALARM',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:nueva-york',
+        'DTSTART;TZID="America/New_York":20230324T090000',
+        'DTEND;TZID="America/New_York":20230324T100000',
+        'SUMMARY:Llamada',
+        'COLOR:#5484ed',
+        'END:VEVENT',
+        'BEGIN:VEVENT',
+        'UID:fuera-de-rango',
+        'DTSTART;TZID=Europe/Madrid:20230501T100000',
+        'DTEND;TZID=Europe/Madrid:20230501T110000',
+        'SUMMARY:Mayo',
+        'END:VEVENT',
+        'END:VCALENDAR',
+        '',
+    ])
+    
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'calendario.ics')
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            f.write(self.ICS)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_recurrences_colors_and_timezones(self):
+        """Se expanden las series (con EXDATE y excepciones) y COLOR/CATEGORIES se asignan a servicios"""
+        from ics_utils import parse_ics
+        
+        config = get_default_config()
+        config.update({'use_color_tags': True, 'group_unlabeled': True,
+                       'color_tags': {'3': 'PROYECTO A', '11': 'URGENTE'}})
+        events, timezone = parse_ics(self.path, date(2023, 3, 20), date(2023, 4, 2), config)
+        
+        self.assertEqual(timezone.zone, 'Europe/Madrid')
+        result = [(event['summary'], event['start'].isoformat(), event['end'].isoformat(),
+                   event['service'], event['is_all_day'])
+                  for event in sorted(events, key=lambda event: event['start'])]
+        self.assertEqual(result, [
+            ('Seguimiento', '2023-03-20T10:00:00+01:00', '2023-03-20T11:00:00+01:00', 'URGENTE', False),
+            ('Reunión con cliente', '2023-03-21T09:00:00+01:00', '2023-03-21T10:30:00+01:00', 'PROYECTO A', False),
+            ('Vacaciones', '2023-03-23T01:00:00+01:00', '2023-03-24T01:00:00+01:00', 'FUERA DE OFICINA', True),
+            ('Llamada', '2023-03-24T14:00:00+01:00', '2023-03-24T15:00:00+01:00', 'SIN ETIQUETA', False),
+            # Después del cambio de horario la serie mantiene la hora local
+            ('Seguimiento', '2023-03-27T10:00:00+02:00', '2023-03-27T11:00:00+02:00', 'URGENTE', False),
+            ('Seguimiento movido', '2023-03-29T15:00:00+02:00', '2023-03-29T16:00:00+02:00', 'TIEMPO NO ETIQUETADO', False),
+        ])
+    
+    def test_matches_json_export(self):
+        """El mismo calendario en .ics y en JSON da el mismo resumen, también en el lote"""
+        import batch_summary
+        from ics_utils import parse_ics
+        from synthetic_calendar import generate_calendar, synthetic_config, write_ics
+        from calendar_time_tracker import parse_events, summarize_parsed_events
+        
+        timezone = pytz.timezone('Europe/Madrid')
+        config = synthetic_config()
+        events = generate_calendar(date(2023, 3, 1), date(2023, 4, 30), seed=3)
+        inputs = os.path.join(self.tmp.name, 'exportaciones')
+        os.makedirs(inputs)
+        with open(os.path.join(inputs, 'ana.ics'), 'w', encoding='utf-8', newline='') as f:
+            write_ics(events, f, 'Europe/Madrid')
+        with open(os.path.join(inputs, 'luis.json'), 'w', encoding='utf-8') as f:
+            json.dump({'timezone': 'Europe/Madrid', 'items': events}, f)
+        
+        start, end = date(2023, 3, 13), date(2023, 4, 9)
+        args = (start, end, timezone, time(9, 0), time(17, 0), [0, 1, 2, 3, 4], config)
+        from_ics, _ = parse_ics(os.path.join(inputs, 'ana.ics'), start, end, config)
+        self.assertEqual(summarize_parsed_events(from_ics, *args),
+                         summarize_parsed_events(parse_events(events, timezone, config), *args))
+        
+        config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        output = os.path.join(self.tmp.name, 'informes')
+        self.assertEqual(batch_summary.main([inputs, '--start-date', start.isoformat(), '--end-date', end.isoformat(),
+                                             '--config', config_path, '--output-dir', output, '--workers', '1']), 0)
+        reports = {}
+        for user in ('ana', 'luis'):
+            with open(os.path.join(output, f'{user}.json'), encoding='utf-8') as f:
+                reports[user] = json.load(f)
+        self.assertEqual(reports['ana']['weeks'], reports['luis']['weeks'])
+
+class TestEventIndex(unittest.TestCase):
+    """Pruebas del índice de eventos por intervalos"""
+    
+    def setUp(self):
+        self.timezone = pytz.timezone('Europe/Madrid')
+        self.config = get_default_config()
+    
+    def _event(self, event_id, start, days):
+        start_dt = self.timezone.localize(datetime.datetime.combine(start, time(10, 0)))
+        return {'id': event_id, 'summary': event_id, 'start': start_dt,
+                'end': start_dt + timedelta(days=days, hours=1), 'is_all_day': False, 'service': 'S'}
+    
+    def test_index_age_survives_extension(self):
+        """Ampliar el índice conserva la antigüedad de sus eventos, que limita su reutilización"""
+        from event_index_utils import EventIndex, get_event_index, store_event_index, EVENT_INDEX_TTL
+        from resilience_utils import StaleCache
+        
+        index = EventIndex([self._event('a', date(2023, 3, 6), 0)], date(2023, 3, 6), date(2023, 3, 12),
+                           'Europe/Madrid', fetched_at=1000.0)
+        extended = index.extend([self._event('b', date(2023, 3, 14), 0)], date(2023, 3, 13), date(2023, 3, 19))
+        self.assertEqual(extended.fetched_at, 1000.0)
+        
+        with patch('event_index_utils.event_index_cache', StaleCache()), \
+                patch('event_index_utils.time.time', return_value=1000.0 + EVENT_INDEX_TTL + 1):
+            store_event_index('u', self.config, extended)
+            self.assertIsNone(get_event_index('u', self.config))
+    
+    def test_overlapping_matches_full_scan(self):
+        """Las consultas devuelven lo mismo (y en el mismo orden) que recorrer todos los eventos"""
+        import random
+        from event_index_utils import EventIndex
+        
+        rng = random.Random(7)
+        first = date(2023, 1, 1)
+        events = [self._event(str(i), first + timedelta(days=rng.randrange(120)), rng.choice([0, 0, 0, 2, 15]))
+                  for i in range(400)]
+        index = EventIndex(events)
+        for _ in range(200):
+            start = first + timedelta(days=rng.randrange(-5, 140))
+            end = start + timedelta(days=rng.randrange(1, 30))
+            expected = [event for event in events
+                        if event['start'].date() < end and event['end'].date() >= start]
+            self.assertEqual(index.overlapping(start, end), expected)
+        
+        # Serializable a JSON sin perder resultados
+        restored = EventIndex.from_dict(json.loads(json.dumps(index.to_dict())), self.timezone)
+        day = date(2023, 2, 14)
+        self.assertEqual([event['id'] for event in restored.on_day(day)],
+                         [event['id'] for event in index.on_day(day)])
+    
+    def test_shifted_range_fetches_only_missing_days(self):
+        """Desplazar el rango solo pide a Google los días nuevos y el resumen coincide con un cálculo completo"""
+        from event_index_utils import EventIndex
+        from calendar_time_tracker import parse_events, summarize_parsed_events, extend_event_index
+        from synthetic_calendar import generate_calendar, synthetic_config
+        
+        config = synthetic_config()
+        events = generate_calendar(date(2023, 3, 6), date(2023, 4, 30), seed=5)
+        
+        def in_range(start, end):
+            # Mismo criterio que timeMin/timeMax de events().list
+            time_min = self.timezone.localize(datetime.datetime.combine(start, time.min))
+            time_max = self.timezone.localize(datetime.datetime.combine(end + timedelta(days=1), time.min))
+            return [event for event in events
+                    if parse_datetime_api(event['start'])[0] < time_max
+                    and parse_datetime_api(event['end'])[0] > time_min]
+        
+        requested = []
+        def fake_fetch(service, start, end, timezone, deadline=None):
+            requested.append((start, end))
+            return in_range(start, end), None
+        
+        index = EventIndex(parse_events(in_range(date(2023, 3, 6), date(2023, 4, 2)), self.timezone, config),
+                           date(2023, 3, 6), date(2023, 4, 2), self.timezone.zone)
+        with patch('calendar_time_tracker.get_events_until_deadline', side_effect=fake_fetch):
+            shifted = extend_event_index(None, index, date(2023, 3, 13), date(2023, 4, 9), self.timezone, config)
+            self.assertIsNone(extend_event_index(None, index, date(2023, 4, 20), date(2023, 4, 30),
+                                                 self.timezone, config))
+        
+        self.assertEqual(requested, [(date(2023, 4, 3), date(2023, 4, 9))])
+        self.assertEqual((shifted.start_date, shifted.end_date), (date(2023, 3, 6), date(2023, 4, 9)))
+        self.assertTrue(shifted.covers(date(2023, 3, 13), date(2023, 4, 9)))
+        self.assertEqual(len({event['id'] for event in shifted.events}), len(shifted))
+        
+        args = (date(2023, 3, 13), date(2023, 4, 9), self.timezone, time(9, 0), time(17, 0), [0, 1, 2, 3, 4], config)
+        self.assertEqual(summarize_parsed_events(shifted, *args),
+                         calculate_weekly_summary(in_range(date(2023, 3, 13), date(2023, 4, 9)), *args))
+
+class TestWeeklyRollups(unittest.TestCase):
+    """Pruebas de las semanas consolidadas"""
+    
+    def setUp(self):
+        import tempfile
+        from rollup_utils import RollupStore
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store_patch = patch('rollup_utils.rollup_store', RollupStore(os.path.join(self.tmp.name, 'rollups.sqlite3')))
+        self.store_patch.start()
+        self.timezone = pytz.timezone('Europe/Madrid')
+    
+    def tearDown(self):
+        self.store_patch.stop()
+        self.tmp.cleanup()
+    
+    def test_stored_weeks_match_full_calculation(self):
+        """Las semanas consolidadas más los días restantes dan el mismo resumen, también en semanas cortadas"""
+        from rollup_utils import load_rollup_days, pending_range, save_rollups
+        from calendar_time_tracker import parse_events, summarize_days, summarize_weeks, summarize_parsed_events
+        from synthetic_calendar import generate_calendar, synthetic_config
+        
+        config = synthetic_config()
+        parsed = parse_events(generate_calendar(date(2023, 2, 27), date(2023, 5, 14), seed=11), self.timezone, config)
+        args = (self.timezone, time(9, 0), time(17, 0), [0, 1, 2, 3, 4], config)
+        
+        # Cálculo previo del 1 de marzo al 20 de abril, hecho el 18 de abril
+        first = summarize_days(parsed, date(2023, 3, 1), date(2023, 4, 20), *args)
+        stored = save_rollups('ana', config, 'Europe/Madrid', first, date(2023, 3, 1), date(2023, 4, 20),
+                              today=date(2023, 4, 18))
+        self.assertEqual(stored, 6)  # Hasta el 9 de abril; la semana del 10 aún está en el margen
+        
+        start, end = date(2023, 3, 8), date(2023, 5, 10)
+        rollup_days = load_rollup_days('ana', config, 'Europe/Madrid', start, end)
+        self.assertEqual(min(rollup_days), start)
+        self.assertEqual(pending_range(start, end, rollup_days), (date(2023, 4, 10), end))
+        self.assertEqual(load_rollup_days('ana', dict(config, work_end_time='18:00'), 'Europe/Madrid', start, end), {})
+        # Días calculados con otra zona horaria (o sin conocerla) no sirven
+        self.assertEqual(load_rollup_days('ana', config, 'America/New_York', start, end), {})
+        self.assertEqual(load_rollup_days('ana', config, None, start, end), {})
+        
+        daily_totals = dict(rollup_days)
+        daily_totals.update(summarize_days(parsed, date(2023, 4, 10), end, *args))
+        self.assertEqual(summarize_weeks(daily_totals, start, end, config),
+                         summarize_parsed_events(parsed, start, end, *args))
+    
+    def test_weeks_expire_and_are_deleted(self):
+        """Las semanas caducan tras el TTL, se purgan al guardar otras y cada conexión se cierra"""
+        import sqlite3
+        import rollup_utils
+        from rollup_utils import RollupStore, delete_rollups
+        
+        store = RollupStore(os.path.join(self.tmp.name, 'ttl.sqlite3'), ttl=100)
+        week = {date(2023, 3, 6): [[3600.0, {}]] + [None] * 6}
+        connect = sqlite3.connect
+        opened, closed = [], []
+        
+        class TrackingConnection(sqlite3.Connection):
+            def close(self):
+                closed.append(self)
+                super().close()
+        
+        def tracking_connect(*args, **kwargs):
+            opened.append(connect(*args, factory=TrackingConnection, **kwargs))
+            return opened[-1]
+        
+        with patch('rollup_utils.sqlite3.connect', side_effect=tracking_connect):
+            with patch('rollup_utils.time.time', return_value=1000.0):
+                store.put_weeks('ana', 'h', 'UTC', week)
+                store.put_weeks('luis', 'h', 'UTC', week)
+            with patch('rollup_utils.time.time', return_value=1050.0):
+                self.assertEqual(store.get_weeks('ana', 'h', 'UTC', date(2023, 3, 6), date(2023, 3, 6)), week)
+            with patch('rollup_utils.time.time', return_value=1101.0):
+                self.assertEqual(store.get_weeks('ana', 'h', 'UTC', date(2023, 3, 6), date(2023, 3, 6)), {})
+                store.put_weeks('ana', 'h', 'UTC', week)
+            with patch.object(rollup_utils, 'rollup_store', store):
+                delete_rollups('ana')
+        self.assertEqual(closed, opened)
+        
+        with sqlite3.connect(store.path) as conn:
+            # La semana caducada de luis se purgó al guardar; la de ana se eliminó
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM weekly_rollups').fetchone()[0], 0)
+        conn.close()
+    
+    def test_logout_drops_user_data(self):
+        """Al cerrar sesión se eliminan los informes, trabajos, índices y eventos del usuario"""
+        import app as app_module
+        import report_utils
+        import background_utils
+        import event_index_utils
+        from storage_utils import JsonFileStore
+        from event_index_utils import EventIndex
+        from resilience_utils import recall_events
+        
+        credentials = {'token': 't', 'refresh_token': 'r', 'client_id': 'logout'}
+        user_key = app_module.get_user_key(credentials)
+        config = get_default_config()
+        reports = JsonFileStore(os.path.join(self.tmp.name, 'reports'))
+        jobs = JsonFileStore(os.path.join(self.tmp.name, 'jobs'))
+        with patch.object(report_utils, 'report_store', reports), \
+                patch.object(background_utils, 'job_store', jobs), \
+                patch.object(event_index_utils, 'event_index_cache', StaleCache()), \
+                patch('resilience_utils.events_cache', StaleCache()):
+            summary = {date(2023, 3, 6): {'Servicio': timedelta(hours=1)}}
+            own_report = report_utils.save_report(user_key, summary, date(2023, 3, 6), date(2023, 3, 12))
+            other_report = report_utils.save_report('otro', summary, date(2023, 3, 6), date(2023, 3, 12))
+            jobs.set('job1', {'owner': user_key, 'status': background_utils.JOB_DONE, 'result': {}})
+            event_index_utils.store_event_index(user_key, config, EventIndex([], date(2023, 3, 6), date(2023, 3, 12), 'UTC'))
+            remember_events(user_key, 'UTC', [], date(2023, 3, 6), date(2023, 3, 12))
+            
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess['credentials'] = credentials
+            client.get('/logout')
+            
+            self.assertIsNone(report_utils.get_report(own_report, user_key))
+            self.assertIsNotNone(report_utils.get_report(other_report, 'otro'))
+            self.assertIsNone(background_utils.get_job('job1', user_key))
+            self.assertIsNone(event_index_utils.get_event_index(user_key, config))
+            self.assertIsNone(recall_events(user_key, date(2023, 3, 6), date(2023, 3, 12)))
+    
+    def test_privacy_policy_states_retention(self):
+        """La política de privacidad indica los días que se conservan las semanas consolidadas"""
+        import app as app_module
+        
+        with patch.object(app_module, 'ROLLUP_TTL', 7 * 24 * 3600):
+            text = app_module.app.test_client().get('/privacy-policy').get_data(as_text=True)
+        self.assertIn('durante un máximo de 7 días', text)
+    
+    @patch('app.get_events_until_deadline')
+    @patch('app.fetch_calendar_timezone')
+    @patch('app.authenticate_google_calendar')
+    def test_calculate_fetches_only_open_weeks(self, mock_auth, mock_tz, mock_get_events):
+        """/calculate consolida las semanas pasadas y en el siguiente informe solo pide a Google las restantes"""
+        import re
+        import app as app_module
+        import rollup_utils
+        from config_utils import config_fingerprint
+        from event_index_utils import event_index_cache
+        from synthetic_calendar import generate_calendar, synthetic_config
+        
+        events = generate_calendar(date(2023, 1, 2), date(2023, 6, 30), seed=2)
+        mock_auth.return_value = (MagicMock(), None)
+        mock_tz.return_value = (self.timezone, True)
+        mock_get_events.side_effect = lambda service, start, end, timezone, deadline=None: ([
+            event for event in events
+            if start <= parse_datetime_api(event['start'])[0].astimezone(timezone).date() <= end
+        ], None)
+        
+        client = app_module.app.test_client()
+        credentials = {'token': 't', 'refresh_token': 'r', 'client_id': 'rollups'}
+        with client.session_transaction() as sess:
+            sess['credentials'] = credentials
+        
+        def calculate(start, end):
+            event_index_cache.clear()
+            response = client.post('/calculate', data={
+                'start_date': start, 'end_date': end, 'config': json.dumps(synthetic_config())
+            })
+            self.assertEqual(response.status_code, 200)
+            report_id = re.search(r'reports/([0-9a-f]{32})/', response.get_data(as_text=True)).group(1)
+            return app_module.get_report(report_id, app_module.get_user_key(credentials))['weeks']
+        
+        march = calculate('2023-03-01', '2023-03-31')
+        self.assertEqual(len(march), 5)
+        self.assertEqual(calculate('2023-03-01', '2023-03-31'), march)
+        self.assertEqual(mock_get_events.call_count, 1)  # El segundo informe solo lee semanas consolidadas
+        
+        calculate('2023-03-01', '2023-04-30')
+        self.assertEqual(mock_get_events.call_args[0][1:3], (date(2023, 4, 1), date(2023, 4, 30)))
+        
+        # Sin la zona de Google (se usa la local) el resultado se muestra pero no se consolida
+        with patch.object(rollup_utils.rollup_store, 'put_weeks') as mock_put:
+            mock_tz.return_value = (pytz.utc, False)
+            calculate('2023-05-01', '2023-05-31')
+            mock_put.assert_not_called()
+        
+        # Zona horaria cambiada: al pedir a Google los días de mayo se descartan las
+        # semanas consolidadas con la zona anterior y se pide el rango entero
+        mock_tz.return_value = (pytz.timezone('America/New_York'), True)
+        calculate('2023-03-01', '2023-05-31')
+        self.assertEqual(mock_get_events.call_args[0][1:3], (date(2023, 3, 1), date(2023, 5, 31)))
+        with client.session_transaction() as sess:
+            self.assertEqual(sess['calendar_timezone'], 'America/New_York')
+        
+        # "Actualizar" vuelve a pedir a Google también las semanas consolidadas
+        calls = mock_get_events.call_count
+        client.post('/calculate', data={
+            'start_date': '2023-03-01', 'end_date': '2023-03-31',
+            'config': json.dumps(synthetic_config()), 'refresh': '1'
+        })
+        self.assertEqual(mock_get_events.call_count, calls + 1)
+        self.assertEqual(mock_get_events.call_args[0][1:3], (date(2023, 3, 1), date(2023, 3, 31)))
+        
+        # Cerrar sesión elimina las semanas del usuario
+        client.get('/logout')
+        self.assertEqual(rollup_utils.rollup_store.get_weeks(
+            app_module.get_user_key(credentials), config_fingerprint(synthetic_config()), 'America/New_York',
+            date(2023, 2, 27), date(2023, 4, 24)), {})
+        resilience_utils.events_cache.clear()
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -1,13 +1,13 @@
 """
 Punto de entrada WSGI para Calendar Work Time Tracker
 Permite ejecutar la aplicación con Gunicorn u otro servidor WSGI
+
+Configuración soportada (workers con hilos o gevent, ver gunicorn_config.py):
+    gunicorn -c gunicorn_config.py wsgi:app
 """
 import os
 from app import app
 
-# Asegurarse de que no haya problemas de caché
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-
 # Logs adicionales en startup
 if os.environ.get('FLASK_ENV') == 'production':
     print("Arrancando en modo producción")